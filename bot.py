@@ -1,6 +1,5 @@
 import discord
 import os
-import aiosqlite
 from dotenv import load_dotenv
 
 # Load ENV before other imports
@@ -8,9 +7,15 @@ load_dotenv()
 
 from discord import app_commands
 from discord.ext import commands
-from core.database import Database
+from core.storage import create_storage
 from core.helpers import rainbow_log, generate_ranks_from_ai, txa_embed
 from core.migrate import migrate_data
+from core.backup import BackupService
+from core.database import Database
+from core.live_views import LiveViewScheduler
+from core.rest_broker import RestBroker
+from core.dm_dispatcher import DMDispatcher
+from core.leaderboard import Leaderboard
 import random
 
 # --- PHIÊN BẢN MỚI ---
@@ -38,7 +43,12 @@ class TXATUTIen(commands.Bot):
         intents = discord.Intents.all()
         # Slash commands only, but we keep a dummy prefix to avoid library errors
         super().__init__(command_prefix="!", intents=intents)
-        self.db = Database()
+        self.db = create_storage() # SQLite mặc định, DB_BACKEND=memory để chạy thử không cần đĩa
+        self.backups = BackupService(self.db) if isinstance(self.db, Database) else None
+        self.live_views = LiveViewScheduler() # Một vòng lặp chung cho mọi tin nhắn cập nhật real-time
+        self.rest = RestBroker() # Mọi edit tin nhắn đi qua đây: ưu tiên + giới hạn theo kênh
+        self.dm = DMDispatcher(self) # DM hàng loạt: giới hạn luồng, nhớ người đóng DM
+        self.leaderboard = Leaderboard(self.db) # Bảng xếp hạng trong RAM, cập nhật theo từng lần ghi tu vi
         # Admin IDs: ID đầu tiên là Super Admin (có quyền Admin server), còn lại là Bot Admin
         all_admin_ids = [int(i.strip()) for i in os.getenv("ADMIN_IDS", "").replace(";", ",").split(",") if i.strip()]
         self.super_admin_id = all_admin_ids[0] if all_admin_ids else None
@@ -52,13 +62,17 @@ class TXATUTIen(commands.Bot):
     async def setup_hook(self):
         rainbow_log(ASCII_TXA, is_ascii=True)
         
-        # Init DB
+        # Init DB (mở pool kết nối dùng chung cho toàn bộ cogs)
         await self.db.initialize()
-        # Add aiosqlite reference for cogs
-        self.db.aiosqlite = aiosqlite
         
         # Migrate
         await migrate_data(self.db)
+
+        # Nạp bảng xếp hạng sau migrate (từ đây mỗi lần ghi layer/exp tự cập nhật vào bảng)
+        await self.leaderboard.load()
+
+        # Sao lưu nóng định kỳ (chỉ backend SQLite)
+        if self.backups: self.backups.start()
         
         # Generate RANKS từ AI (hoặc fallback)
         await generate_ranks_from_ai()
@@ -102,6 +116,14 @@ class TXATUTIen(commands.Bot):
         if os.path.exists("cache/emoji_cache.json"):
              rainbow_log("📜 Phát hiện tàn tích emoji_cache.json (Hiện đang bị phong ấn - không sử dụng)", is_italic=True)
 
+    async def close(self):
+        # Dọn các tin nhắn real-time khi còn kết nối, đóng pool DB sau khi ngắt Discord
+        await self.live_views.stop()
+        await self.rest.stop()
+        await super().close()
+        if self.backups: await self.backups.stop()
+        await self.db.close()
+
     async def on_ready(self):
         rainbow_log(f"✅ Hộ Pháp {self.user.name} đã sẵn sàng bảo vệ Thiên Lam Tông!")
         
@@ -5,6 +5,9 @@ from datetime import timedelta, datetime
 from discord import app_commands
 from discord.ext import commands
 from core.helpers import rainbow_log, txa_embed
+from core.backup import list_backups, restore_database
+from core.metrics import metrics
+from core.progression import goal_for, level_up_result
 
 class Admin(commands.Cog):
     def __init__(self, bot):
@@ -41,8 +44,8 @@ class Admin(commands.Cog):
         if not current_data:
             return await interaction.followup.send("⚠️ Kẻ này người trần mắt thịt, chưa từng bước vào con đường tu tiên (Chưa dùng `/start`).")
 
-        # Cập nhật tầng thứ
-        await self.db.update_user(uid, layer=layer)
+        # Cập nhật tầng thứ (ngưỡng EXP theo tầng mới)
+        await self.db.update_user(uid, layer=layer, goal=goal_for(layer))
         
         # Thông báo
         embed = txa_embed(
@@ -70,20 +73,18 @@ class Admin(commands.Cog):
             
         await interaction.response.defer(ephemeral=True)
         uid = str(user.id)
-        current_data = await self.db.get_user(uid)
+        current_data = await self.db.apply_delta(uid, reason='admin', level_up=True, exp=amount)
         
         if not current_data:
             return await interaction.followup.send("⚠️ Kẻ này chưa ghi danh tu luyện.")
-
-        new_exp = current_data['exp'] + amount
-        # Check level up simple logic (optional, but keep it raw for admin)
-        await self.db.update_user(uid, exp=new_exp)
+        leveled_up, layer = level_up_result(current_data)
         
         embed = txa_embed(
             "🌀 Truyền Công Đại Pháp",
             f"Lão Tổ vung tay áo, một luồng linh lực hùng hậu **(+{amount:,} EXP)** đã rót thẳng vào đan điền của {user.mention}!\n\n*\"Hậu bối, hấp thu cho tốt!\"*",
             discord.Color.blue()
         )
+        if leveled_up: embed.add_field(name="🔥 ĐỘT PHÁ CẢNH GIỚI", value=f"Đột phá lên **Tầng {layer}**!")
         await interaction.followup.send(embed=embed)
 
     @app_commands.command(name="admin_grant_stones", description="[Lão Tổ] Ban Thưởng Linh Thạch - Khai mở ngân khố")
@@ -94,13 +95,10 @@ class Admin(commands.Cog):
             
         await interaction.response.defer(ephemeral=True)
         uid = str(user.id)
-        current_data = await self.db.get_user(uid)
+        current_data = await self.db.apply_delta(uid, reason='admin', spirit_stones=amount)
         
         if not current_data:
             return await interaction.followup.send("⚠️ Kẻ này chưa ghi danh tu luyện.")
-
-        new_stones = current_data['spirit_stones'] + amount
-        await self.db.update_user(uid, spirit_stones=new_stones)
         
         embed = txa_embed(
             "💎 Khai Mở Thiên Kho",
@@ -126,7 +124,7 @@ class Admin(commands.Cog):
         new_layer = max(1, u_data['layer'] - 1)
         new_exp = max(0, int(u_data['exp'] * 0.5))
         
-        await self.db.update_user(uid, layer=new_layer, exp=new_exp)
+        await self.db.update_user(uid, layer=new_layer, exp=new_exp, goal=goal_for(new_layer))
         
         embed = txa_embed(
             "⛈️ Thiên Phạt Chi Lôi",
@@ -262,6 +260,112 @@ class Admin(commands.Cog):
         except Exception as e:
             await interaction.followup.send(f"❌ Lỗi: {e}")
 
+    @app_commands.command(name="admin_flush_db", description="[Lão Tổ] Ghi ngay mọi thay đổi đang chờ xuống Thiên Thư (DB)")
+    async def admin_flush_db(self, interaction: discord.Interaction):
+        if interaction.user.id not in self.bot.admin_ids:
+            return await interaction.response.send_message("🚫 Chỉ có Lão Tổ mới được động vào Thiên Thư!", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        count = await self.db.flush()
+        mode = "Write-behind" if self.db.write_behind else "Ghi trực tiếp"
+        embed = txa_embed(
+            "📜 Thiên Thư Đã Khắc",
+            f"Đã ghi **{count}** đệ tử đang chờ xuống Thiên Thư.\nChế độ: `{mode}`",
+            discord.Color.green()
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        rainbow_log(f"📜 {interaction.user.name} đã xả hàng đợi DB ({count} đệ tử).")
+
+    @app_commands.command(name="admin_db_stats", description="[Lão Tổ] Xem độ trễ các thao tác Thiên Thư (DB)")
+    @app_commands.describe(top="Số thao tác tốn thời gian nhất cần hiện", reset="Xóa số liệu sau khi xem")
+    async def admin_db_stats(self, interaction: discord.Interaction, top: app_commands.Range[int, 1, 25] = 12, reset: bool = False):
+        if interaction.user.id not in self.bot.admin_ids:
+            return await interaction.response.send_message("🚫 Chỉ có Lão Tổ mới được động vào Thiên Thư!", ephemeral=True)
+
+        snap = self.db.metrics_snapshot()
+        if snap is None:
+            return await interaction.response.send_message("⚠️ Backend hiện tại không bật đo đạc (DB_METRICS=0 hoặc backend RAM).", ephemeral=True)
+
+        lines = [f"{'thao tác':<34} {'lần':>6} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7} {'dòng':>7}"]
+        for name, st in list(snap.items())[:top]:
+            label = name if len(name) <= 34 else name[:33] + "…"
+            lines.append(
+                f"{label:<34} {st['count']:>6} {st['p50_ms']:>7.2f} {st['p95_ms']:>7.2f} "
+                f"{st['p99_ms']:>7.2f} {st['max_ms']:>7.1f} {st['rows']:>7}"
+            )
+        embed = txa_embed(
+            "📊 Mạch Đập Thiên Thư",
+            f"Thời gian tính bằng ms, từ <t:{int(metrics.started)}:R>.\n```\n" + "\n".join(lines)[:3900] + "\n```",
+            discord.Color.blurple()
+        )
+        embed.add_field(name="🐢 Truy vấn chậm", value=f"**{metrics.slow_count}** (ngưỡng {metrics.slow_ms:g}ms)", inline=True)
+        cache = self.db.cache_stats()
+        if cache:
+            embed.add_field(name="🧠 Cache đệ tử", value="\n".join(f"{k}: **{v:.1%}**" if isinstance(v, float) else f"{k}: **{v}**" for k, v in cache.items()), inline=True)
+        live = self.bot.live_views.stats()
+        embed.add_field(name="📺 Tin nhắn real-time", value=f"Đang chạy: **{live['views']}** | Edit: **{live['edits']}** | Bỏ qua: **{live['skipped']}**", inline=True)
+        rest = self.bot.rest.stats()
+        embed.add_field(name="📡 Hàng đợi edit", value=f"Đã gửi: **{rest['sent']}** | Gộp: **{rest['merged']}** | Bỏ: **{rest['dropped']}** | Lỗi: **{rest['failed']}** | Chờ: **{rest['queued']}**", inline=True)
+        board = self.bot.leaderboard.stats()
+        embed.add_field(name="🏆 Thiên bảng", value=f"Đạo hữu: **{board['users']}** | Trang cache: **{board['cached_pages']}** | Trúng cache: **{board['hits']}** | Render: **{board['renders']}**", inline=True)
+        if reset: metrics.reset()
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="admin_backup", description="[Lão Tổ] Chụp bản sao lưu nóng của Thiên Thư (DB)")
+    async def admin_backup(self, interaction: discord.Interaction):
+        if interaction.user.id not in self.bot.admin_ids:
+            return await interaction.response.send_message("🚫 Chỉ có Lão Tổ mới được động vào Thiên Thư!", ephemeral=True)
+        if not self.bot.backups:
+            return await interaction.response.send_message("⚠️ Backend hiện tại không lưu trên đĩa, không có gì để sao lưu.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        try:
+            await self.db.flush()
+            stats = await self.bot.backups.run_once()
+        except Exception as e:
+            return await interaction.followup.send(f"❌ Sao lưu thất bại: {e}", ephemeral=True)
+        embed = txa_embed(
+            "💾 Thiên Thư Đã Sao Lưu",
+            f"File: `{os.path.basename(stats['path'])}`\n"
+            f"Dung lượng: **{stats['size'] / 1048576:.2f} MB** trong **{stats['seconds']:.2f}s** ({stats['mb_per_s']:.1f} MB/s)\n"
+            f"Đã dọn **{len(stats['pruned'])}** bản cũ.",
+            discord.Color.green()
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        rainbow_log(f"💾 {interaction.user.name} đã sao lưu DB: {stats['path']}")
+
+    async def backup_autocomplete(self, interaction: discord.Interaction, current: str):
+        if not self.bot.backups: return []
+        names = [os.path.basename(p) for p, _, _ in list_backups(self.bot.backups.dest_dir)]
+        return [app_commands.Choice(name=n, value=n) for n in names if current.lower() in n.lower()][:25]
+
+    @app_commands.command(name="admin_restore", description="[Lão Tổ] Khôi phục Thiên Thư (DB) từ một bản sao lưu")
+    @app_commands.describe(file="Tên file sao lưu")
+    @app_commands.autocomplete(file=backup_autocomplete)
+    async def admin_restore(self, interaction: discord.Interaction, file: str):
+        if interaction.user.id not in self.bot.admin_ids:
+            return await interaction.response.send_message("🚫 Chỉ có Lão Tổ mới được động vào Thiên Thư!", ephemeral=True)
+        if not self.bot.backups:
+            return await interaction.response.send_message("⚠️ Backend hiện tại không lưu trên đĩa, không thể khôi phục.", ephemeral=True)
+
+        path = os.path.join(self.bot.backups.dest_dir, os.path.basename(file))
+        if not os.path.exists(path):
+            return await interaction.response.send_message(f"❌ Không tìm thấy bản sao lưu `{file}`.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        try:
+            safety = await restore_database(self.db, path)
+        except Exception as e:
+            return await interaction.followup.send(f"❌ Khôi phục thất bại: {e}", ephemeral=True)
+        embed = txa_embed(
+            "♻️ Thiên Thư Đã Khôi Phục",
+            f"Đã khôi phục từ `{os.path.basename(path)}`.\n"
+            f"Bản trước khi khôi phục được giữ tại `{os.path.basename(safety['path'])}`.",
+            discord.Color.gold()
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        rainbow_log(f"♻️ {interaction.user.name} đã khôi phục DB từ {path}")
+
     @app_commands.command(name="clear_cache", description="Quét sạch linh khí tạp chất trong mọi ngóc ngách")
     async def clear_cache(self, interaction: discord.Interaction):
         """Dọn dẹp linh khí tạp chất (__pycache__, .pyc) - Chỉ dành cho Tổ Sư"""
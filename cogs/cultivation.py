@@ -1,17 +1,23 @@
 import discord
 import random
 import asyncio
-import json
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone, time as dtime
 from discord import app_commands, Color
 from discord.ext import commands, tasks
-from core.helpers import VN_TZ, ask_ancestor, get_rank_info, txa_embed, number_to_emoji, get_all_rank_names, rainbow_log
+from core.helpers import VN_TZ, DAILY_RESET_HOUR, current_reset, ask_ancestor, get_rank_info, txa_embed, number_to_emoji, get_all_rank_names, rainbow_log
 from core.format import TXAFormat
-from core.database import Database
+from core.storage import Storage, LEDGER_KEEP_DAYS, DAILY_RESET_STATE, ledger_day_start
 from core.game_data import CultivationData
 from core.roles_config import RoleConfig
 from core.combat import CombatSystem
+from core.live_views import LiveView
+from core.rest_broker import PRIORITY_RESULT
+from core.mission_timers import MissionTimers
+from core.mission_pool import MissionPool
+from core.progression import level_up_result
+from core.lucky_draw import lucky_draw
+from core.role_sync import RoleSync, RankRoleIndex, nick_prefix, target_nick, create_rank_role
 
 class Cultivation(commands.Cog):
     NARRATIVE_STAGES = [
@@ -25,40 +31,27 @@ class Cultivation(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self.db: Database = bot.db
-        self.active_missions = {}
+        self.db: Storage = bot.db
+        self.active_missions = {} # uid -> (mission_id, tin nhắn tiến độ) để báo kết quả
+        self.mission_timers = MissionTimers(self.db, self.on_mission_due)
+        self.mission_pool = MissionPool(self.db)
+        self.rank_roles = RankRoleIndex()
+        self.role_sync = RoleSync(bot, self.rank_roles)
         self.battling_users = set()
 
     async def check_auto_role(self, member: discord.Member, layer: int):
         """Tự động cập nhật Role và Nickname dựa trên cảnh giới"""
         rank_name, rank_info = get_rank_info(layer)
-        role_data = RoleConfig.get_role_data(rank_name)
         
         # 1. Update Nickname (Prefix)
-        # Đặc biệt cho Admin
-        is_super = member.id == getattr(self.bot, 'super_admin_id', None)
-        is_admin = member.id in getattr(self.bot, 'admin_ids', [])
-        
-        if is_super:
-            prefix = "[Chưởng Môn]"
-        elif is_admin:
-            prefix = "[Tổ Sư]"
-        else:
-            prefix = f"[{rank_name}]"
-            
-        new_nick = member.display_name
-        
-        # Remove old prefix if exists
-        import re
-        new_nick = re.sub(r"^\[.*?\]\s*", "", new_nick) 
-        new_nick = f"{prefix} {new_nick}"
-        
-        if len(new_nick) <= 32:
+        new_nick = target_nick(member.display_name, nick_prefix(
+            member.id, rank_name, getattr(self.bot, 'super_admin_id', None), getattr(self.bot, 'admin_ids', [])
+        ))
+        if new_nick:
             try:
-                if member.display_name != new_nick:
-                    # Note: Vẫn sẽ fail nếu là Guild Owner mà bot không đủ quyền, 
-                    # nhưng try-except sẽ bắt lỗi này.
-                    await member.edit(nick=new_nick)
+                # Note: Vẫn sẽ fail nếu là Guild Owner mà bot không đủ quyền, 
+                # nhưng try-except sẽ bắt lỗi này.
+                await member.edit(nick=new_nick)
             except: 
                 pass
             
@@ -69,30 +62,14 @@ class Cultivation(commands.Cog):
         target_role_name = rank_name
         
         # Find or create role
-        target_role = discord.utils.get(guild.roles, name=target_role_name)
+        target_role = self.rank_roles.get(guild, target_role_name)
         if not target_role:
-             try:
-                 permissions = discord.Permissions.none()
-                 # Apply CUMULATIVE permissions from config (inherit from lower ranks)
-                 perm_dict = RoleConfig.get_cumulative_permissions(rank_name)
-                 if perm_dict:
-                    permissions.update(**perm_dict)
-                 
-                 target_role = await guild.create_role(
-                     name=target_role_name, 
-                     color=discord.Color(role_data['color']), 
-                     hoist=True, # Show separately
-                     permissions=permissions,
-                     mentionable=False,
-                     reason="Auto-generated by Cultivation Bot"
-                 )
-             except Exception as e: 
-                 rainbow_log(f"Role create error: {e}")
-                 pass
+            target_role = await create_rank_role(guild, target_role_name)
+            if target_role: self.rank_roles.add(target_role)
         
         if target_role:
             # Luôn kiểm tra và dọn dẹp các role cảnh giới cũ để tránh bị trùng lặp role (như hình đệ tử gửi)
-            all_rank_roles = RoleConfig.get_all_roles().keys()
+            all_rank_roles = get_all_rank_names()
             to_remove = [r for r in current_roles if r.name in all_rank_roles and r.name != target_role_name]
             
             try:
@@ -107,6 +84,20 @@ class Cultivation(commands.Cog):
                 # rainbow_log(f"Role sync error: {e}")
                 pass
 
+    # Giữ index role cảnh giới khớp với server
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        self.rank_roles.invalidate(role.guild.id, role.name)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.rank_roles.invalidate(role.guild.id, role.name)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.name != after.name:
+            self.rank_roles.invalidate(after.guild.id, before.name, after.name)
+
     async def check_daily_xp_limit(self, user_data, exp_to_add):
         """Kiểm tra giới hạn XP hàng ngày"""
         rank_name, _ = get_rank_info(user_data['layer'])
@@ -137,39 +128,27 @@ class Cultivation(commands.Cog):
                     rank_info['color']
                 )
                 embed.set_footer(text="Thiên Đạo ghi danh - Tương lai rộng mở!")
-                await member.send(embed=embed)
+                await self.bot.dm.send(member.id, embed=embed)
             except: pass
 
     @tasks.loop(hours=1)
     async def spirit_stone_buff_task(self):
         """Buff x3 Linh Thạch ngẫu nhiên mỗi giờ"""
-        users = await self.db.get_all_users()
-        if not users: return
-        
-        # Chọn ngẫu nhiên 3 người may mắn (hoặc 10% user)
-        lucky_count = max(1, len(users) // 10)
-        lucky_users = random.sample(users, min(len(users), lucky_count))
-        
         now = time.time()
         expiry = now + 3600 # 1 tiếng
-        
-        for u in lucky_users:
-            buffs = u.get('buffs', {})
-            buffs['stone_x3'] = expiry
-            await self.db.update_user(u['user_id'], buffs=buffs)
-            
-            # Thông báo nếu có thể
-            try:
-                user_obj = await self.bot.fetch_user(int(u['user_id']))
-                embed = txa_embed(
-                    "✨ THIÊN ĐẠO CHIẾU CỐ", 
-                    "Ngươi đã được nhận **Hào Quang Thái Dương**, x3 Linh Thạch nhận được trong 1 giờ tới!", 
-                    discord.Color.gold()
-                )
-                await user_obj.send(embed=embed)
-                rainbow_log(f"🌞 [Thiên Đạo] Đã ban buff x3 Linh Thạch cho đạo hữu {u['name']} ({u['user_id']}).")
-            except: 
-                rainbow_log(f"🌞 [Thiên Đạo] Đã ban buff x3 Linh Thạch cho {u['name']} (Không thể gửi DM).")
+
+        # Rút thăm ~10% đệ tử ngay trong DB (bảng alias dựng sẵn), chỉ nhận về ID người trúng
+        lucky_ids = await lucky_draw(self.db, 'stone_x3', expiry)
+        if not lucky_ids: return
+        rainbow_log(f"🌞 [Thiên Đạo] Đã ban buff x3 Linh Thạch cho {len(lucky_ids)} đạo hữu.")
+
+        # Thông báo nếu có thể (người đóng DM được nhớ để lần sau bỏ qua)
+        embed = txa_embed(
+            "✨ THIÊN ĐẠO CHIẾU CỐ", 
+            "Ngươi đã được nhận **Hào Quang Thái Dương**, x3 Linh Thạch nhận được trong 1 giờ tới!", 
+            discord.Color.gold()
+        )
+        await self.bot.dm.broadcast([(uid, {"embed": embed}) for uid in lucky_ids], "Hào Quang Thái Dương")
 
     @spirit_stone_buff_task.before_loop
     async def before_spirit_stone_buff(self):
@@ -181,9 +160,8 @@ class Cultivation(commands.Cog):
         now = datetime.now(VN_TZ)
         if now.hour != 6: return
         
-        users = await self.db.get_all_users()
-        today_reset = now.replace(hour=7, minute=0, second=0, microsecond=0)
-        today_date = (now - timedelta(hours=7)).strftime("%Y-%m-%d")
+        today_reset = current_reset(now) + timedelta(days=1)
+        today_date = (now - timedelta(hours=DAILY_RESET_HOUR)).strftime("%Y-%m-%d")
         
         portal_url = None
         target_guild = None
@@ -202,44 +180,90 @@ class Cultivation(commands.Cog):
                     random_channel = random.choice(target_channels)
                     portal_url = f"https://discord.com/channels/{target_guild.id}/{random_channel.id}"
 
-        for u_data in users:
-            if u_data['last_daily_date'] != today_date:
-                user = self.bot.get_user(int(u_data['user_id']))
-                if not user: continue
-                
-                streak_emoji = number_to_emoji(u_data['daily_streak'])
-                timestamp = int(today_reset.timestamp())
-                
-                embed = txa_embed("⏰ Nhắc Nhở Điểm Danh", "", Color.orange())
-                embed.description = (
-                    f"🔥 **Chuỗi điểm danh hiện tại:** {streak_emoji} ngày\n"
-                    f"⚠️ **Còn 1 giờ nữa là reset!** (<t:{timestamp}:t>)\n\n"
-                    f"💡 Hãy dùng `/daily` ngay để giữ chuỗi streak!\n"
-                    f"📈 Streak càng cao, phần thưởng càng lớn!"
-                )
-                embed.add_field(name="🌀 Cổng Dịch Chuyển", value="Nhấn nút bên dưới để trở về Thiên Lam Tông", inline=False)
-                time_now = TXAFormat.time(now.hour * 3600 + now.minute * 60 + now.second)
-                embed.set_footer(text=f"Pháp thời: {time_now} - THIEN-LAM-LIVE-AI BY TXA!")
-                
-                view = discord.ui.View()
-                if portal_url:
-                    view.add_item(discord.ui.Button(label="Trở về Tông Môn", url=portal_url, emoji="⛩️"))
-                
-                try:
-                    await user.send(embed=embed, view=view)
-                except: pass
+        view = discord.ui.View()
+        if portal_url:
+            view.add_item(discord.ui.Button(label="Trở về Tông Môn", url=portal_url, emoji="⛩️"))
+        timestamp = int(today_reset.timestamp())
+        time_now = TXAFormat.time(now.hour * 3600 + now.minute * 60 + now.second)
+
+        def reminder(streak):
+            streak_emoji = number_to_emoji(streak)
+            embed = txa_embed("⏰ Nhắc Nhở Điểm Danh", "", Color.orange())
+            embed.description = (
+                f"🔥 **Chuỗi điểm danh hiện tại:** {streak_emoji} ngày\n"
+                f"⚠️ **Còn 1 giờ nữa là reset!** (<t:{timestamp}:t>)\n\n"
+                f"💡 Hãy dùng `/daily` ngay để giữ chuỗi streak!\n"
+                f"📈 Streak càng cao, phần thưởng càng lớn!"
+            )
+            embed.add_field(name="🌀 Cổng Dịch Chuyển", value="Nhấn nút bên dưới để trở về Thiên Lam Tông", inline=False)
+            embed.set_footer(text=f"Pháp thời: {time_now} - THIEN-LAM-LIVE-AI BY TXA!")
+            return {"embed": embed, "view": view}
+
+        async def jobs():
+            users = self.db.iter_users(columns=['user_id', 'daily_streak'], exclude={'last_daily_date': today_date})
+            async for u_data in users:
+                # Chỉ nhắc người còn ở chung server với bot (tra cache, không gọi REST)
+                if not self.bot.get_user(int(u_data['user_id'])): continue
+                yield u_data['user_id'], reminder(u_data['daily_streak'])
+
+        # Gửi song song có giới hạn; task chạy lại trong giờ 6 (vd: khởi động lại) không nhắc trùng
+        await self.bot.dm.broadcast(jobs(), "Nhắc điểm danh", dedupe_key=f"reminder:{today_date}")
 
     @daily_reminder_task.before_loop
     async def before_daily_reminder(self):
         await self.bot.wait_until_ready()
 
+    async def run_daily_reset(self):
+        """Áp reset ngày cho toàn bộ đệ tử nếu mốc 7h gần nhất chưa được áp (gọi cả lúc khởi động để bù)"""
+        epoch = current_reset().timestamp()
+        if (await self.db.get_state(DAILY_RESET_STATE, 0) or 0) >= epoch: return
+        started = time.perf_counter()
+        count = await self.db.apply_daily_reset(epoch)
+        rainbow_log(f"🌅 [Thiên Thời] Reset ngày cho {count} đệ tử trong {(time.perf_counter() - started) * 1000:.1f}ms.")
+        # Gom đột phá còn sót (EXP cộng từ đường không tự đột phá) cho mọi đệ tử trong một lượt
+        changed = await self.db.apply_level_ups()
+        if changed: rainbow_log(f"🔥 [Thiên Thời] {len(changed)} đệ tử đột phá cảnh giới khi reset ngày.")
+
+    # Giờ VN cố định UTC+7 (tasks.loop cần tzinfo chuẩn, không dùng được pytz)
+    @tasks.loop(time=dtime(hour=DAILY_RESET_HOUR, second=1, tzinfo=timezone(timedelta(hours=7))))
+    async def daily_reset_task(self):
+        try:
+            await self.run_daily_reset()
+        except Exception as e:
+            rainbow_log(f"⚠️ [Thiên Thời] Reset ngày thất bại: {e}")
+
+    @daily_reset_task.before_loop
+    async def before_daily_reset(self):
+        try:
+            await self.run_daily_reset()
+        except Exception as e:
+            rainbow_log(f"⚠️ [Thiên Thời] Bù reset ngày thất bại: {e}")
+
+    @tasks.loop(hours=6)
+    async def ledger_compact_task(self):
+        """Nén ledger cũ hơn LEDGER_KEEP_DAYS ngày thành tổng theo ngày để bảng không phình mãi"""
+        try:
+            await self.db.compact_ledger(ledger_day_start(time.time() - LEDGER_KEEP_DAYS * 86400))
+        except Exception as e:
+            rainbow_log(f"⚠️ [Ledger] Nén sổ thu chi thất bại: {e}")
+
     async def cog_load(self):
         self.daily_reminder_task.start()
         self.spirit_stone_buff_task.start()
+        self.ledger_compact_task.start()
+        self.daily_reset_task.start()
+        asyncio.create_task(self.start_mission_timers())
+        self.mission_pool.start()
+        self.db.add_restore_listener(self.mission_timers.reload)
 
     async def cog_unload(self):
         self.daily_reminder_task.cancel()
         self.spirit_stone_buff_task.cancel()
+        self.ledger_compact_task.cancel()
+        self.daily_reset_task.cancel()
+        self.db.remove_restore_listener(self.mission_timers.reload)
+        await self.mission_timers.stop()
+        await self.mission_pool.stop()
 
     async def cog_check(self, ctx):
         """Prefix commands are disabled, but keeping for safety"""
@@ -288,8 +312,7 @@ class Cultivation(commands.Cog):
         now = time.time()
         expiry = now + item_info['duration']
         # Tặng vào túi đồ
-        inv = [{"id": gift_id, "count": 1, "expiry": expiry}]
-        await self.db.update_user(uid, inventory=inv)
+        await self.db.set_item(uid, gift_id, 1, expiry)
         
         rainbow_log(f"🎁 [Nhập Môn] Đã tặng {item_info['name']} cho tân đệ tử {interaction.user.display_name} ({uid}).")
         
@@ -300,45 +323,34 @@ class Cultivation(commands.Cog):
         await interaction.followup.send(embed=embed, ephemeral=True)
 
     @app_commands.command(name="admin_sync_roles", description="[Admin] Đồng bộ Role & Nickname cho toàn bộ đệ tử")
-    async def admin_sync_roles(self, interaction: discord.Interaction):
+    @app_commands.describe(lam_lai="Bỏ checkpoint của lần chạy bị ngắt trước đó và so lại từ đầu")
+    async def admin_sync_roles(self, interaction: discord.Interaction, lam_lai: bool = False):
         if interaction.user.id not in self.bot.admin_ids:
             return await interaction.response.send_message("🚫 Ngươi không có quyền năng này!", ephemeral=True)
+        if self.role_sync.running:
+            return await interaction.response.send_message("⏳ Tiến trình đồng bộ đang chạy, hãy đợi nó hoàn tất.", ephemeral=True)
         
         await interaction.response.defer(ephemeral=True)
-        
-        users = await self.db.get_all_users()
-        count = 0
-        failed = 0
-        
-        rainbow_log(f"🔄 Bắt đầu tiến trình đồng bộ {len(users)} đệ tử...")
-        for u_data in users:
-            uid = int(u_data['user_id'])
-            layer = u_data['layer']
-            u_name = u_data['name']
-            
-            try:
-                member = interaction.guild.get_member(uid)
-                if not member:
-                    member = await interaction.guild.fetch_member(uid)
-                
-                if member:
-                    rainbow_log(f"  [+] Đang quy cấp cho: {member.display_name} ({u_name}) - Cấp: {layer}")
-                    await self.check_auto_role(member, layer)
-                    count += 1
-                    await asyncio.sleep(0.5) # Tránh rate limit của Discord
-                else:
-                    rainbow_log(f"  [-] Không tìm thấy member {uid} ({u_name}) trong server.")
-                    failed += 1
-            except Exception as e:
-                rainbow_log(f"  [!] Lỗi đồng bộ cho {uid} ({u_name}): {e}")
-                failed += 1
-                
-        embed = txa_embed(
-            "🔄 Đồng Bộ Hoàn Tất",
-            f"Đã cập nhật Role & Nickname cho **{count}** đệ tử.\nThất bại/Không tìm thấy: **{failed}**",
-            discord.Color.green()
-        )
-        await interaction.followup.send(embed=embed)
+        self.role_sync.progress = {}
+        msg = await interaction.followup.send(embed=self.role_sync.progress_embed(), ephemeral=True)
+
+        # Chỉ người có role / nickname lệch mới bị edit; tiến độ + ETA cập nhật qua bộ lập lịch chung
+        # (token interaction sống 15 phút nên view dừng trước đó, tiến trình vẫn chạy tiếp)
+        async def render(now):
+            return {"embed": self.role_sync.progress_embed()}
+        key = f"sync_roles:{interaction.guild.id}"
+        self.bot.live_views.register(LiveView(key, render, self.bot.rest.editor(msg), until=time.time() + 14 * 60, interval=3))
+        try:
+            await self.role_sync.run(interaction.guild, restart=lam_lai)
+        except Exception as e:
+            rainbow_log(f"⚠️ [Đồng Bộ] Tiến trình bị ngắt, lần chạy sau sẽ tiếp tục từ checkpoint: {e}")
+            self.bot.live_views.cancel(key)
+            try: await self.bot.rest.edit(msg, PRIORITY_RESULT, embed=txa_embed("⚠️ Đồng Bộ Bị Ngắt", f"Lỗi: {e}\nGọi lại lệnh để tiếp tục từ checkpoint.", discord.Color.orange()))
+            except: pass
+            return
+        self.bot.live_views.cancel(key)
+        try: await self.bot.rest.edit(msg, PRIORITY_RESULT, embed=self.role_sync.progress_embed())
+        except: pass
 
     @app_commands.command(name="info", description="Xem thông tin tu luyện (Real-time Update)")
     async def info(self, interaction: discord.Interaction, user: discord.Member = None):
@@ -346,17 +358,14 @@ class Cultivation(commands.Cog):
         uid = str(target_user.id)
         
         # Initial defer
-        msg = await interaction.response.send_message("🌀 Đang vận chuyển linh lực để soi xét căn cốt...", ephemeral=True)
-        
-        start_time = time.time()
-        # Loop for 3 minutes (180s)
-        while time.time() - start_time < 180:
+        await interaction.response.send_message("🌀 Đang vận chuyển linh lực để soi xét căn cốt...", ephemeral=True)
+        if not await self.db.get_user(uid, children=False):
+            return await self.bot.rest.edit(interaction, content="⚠️ Ngươi chưa bước chân vào con đường tu tiên.")
+
+        # Cập nhật 5s/lần trong 3 phút qua bộ lập lịch chung, hết hạn thì xóa
+        async def render(now):
             user_data = await self.db.get_user(uid)
-            if not user_data:
-                if time.time() - start_time < 5: # First try
-                     await interaction.edit_original_response(content="⚠️ Ngươi chưa bước chân vào con đường tu tiên.")
-                     return
-                break # Stop if user deleted or something
+            if not user_data: return None # Stop if user deleted or something
 
             rank_name, rank_info = get_rank_info(user_data['layer'])
             progress = (user_data['exp'] / user_data['goal']) * 100
@@ -423,19 +432,17 @@ class Cultivation(commands.Cog):
                     rainbow_log(f"Error parsing current_mission in info: {e}")
             
             embed.add_field(name="Nhiệm Vụ Hàng Ngày", value=mission_status, inline=False)
-            embed.set_footer(text=f"Cập nhật: {datetime.now(VN_TZ).strftime('%H:%M:%S')} | Tự hủy sau 3 phút")
-            
-            try:
-                await interaction.edit_original_response(content=None, embed=embed)
-            except:
-                break # Error editing (deleted?)
-            
-            await asyncio.sleep(5) # Update every 5s
-            
-        # End loop - Delete
-        try:
-            await interaction.delete_original_response()
-        except: pass
+            embed.set_footer(text=f"Cập nhật: {datetime.now(VN_TZ).strftime('%H:%M')} | Tự hủy sau 3 phút")
+            return {"content": None, "embed": embed}
+
+        async def expire():
+            try: await interaction.delete_original_response()
+            except: pass
+
+        self.bot.live_views.register(LiveView(
+            f"info:{interaction.user.id}", render, self.bot.rest.editor(interaction),
+            until=time.time() + 180, interval=5, on_expire=expire
+        ))
 
     @app_commands.command(name="daily", description="Nhận quà hàng ngày")
     async def daily(self, interaction: discord.Interaction):
@@ -446,24 +453,16 @@ class Cultivation(commands.Cog):
             return await interaction.response.send_message(embed=embed, ephemeral=True)
         
         now = datetime.now(VN_TZ)
-        reset_hour = 7
-        today_reset = now.replace(hour=reset_hour, minute=0, second=0, microsecond=0)
-        if now < today_reset: today_reset -= timedelta(days=1)
+        today_reset = current_reset(now)
 
-        if user.get('last_daily_exp_reset', 0) < today_reset.timestamp():
-            await self.db.update_user(uid, daily_exp=0, last_daily_exp_reset=now.timestamp())
-            user['daily_exp'] = 0 
-        
         if user['last_daily'] > today_reset.timestamp():
             await interaction.response.defer(ephemeral=True)
             next_reset = today_reset + timedelta(days=1)
             ts = int(next_reset.timestamp())
-            loop_end = time.time() + 300 
-            while time.time() < loop_end:
-                now_loop = datetime.now(VN_TZ)
-                diff = next_reset - now_loop
-                total_seconds = int(diff.total_seconds())
-                if total_seconds <= 0: break
+
+            async def render(now):
+                total_seconds = int(ts - now)
+                if total_seconds <= 0: return None
                 time_str = TXAFormat.duration_detail(total_seconds)
                 embed = txa_embed(
                     "⏳ Cấm Chế Thổ Nạp",
@@ -473,13 +472,16 @@ class Cultivation(commands.Cog):
                     discord.Color.orange()
                 )
                 embed.set_thumbnail(url="https://hoathinh3d.moi/wp-content/uploads/2023/02/luyen-khi-10-van-nam-300x450.jpg")
-                try: await interaction.edit_original_response(embed=embed)
-                except: break 
-                await asyncio.sleep(1)
+                return {"embed": embed}
+
+            self.bot.live_views.register(LiveView(
+                f"daily:{uid}", render, self.bot.rest.editor(interaction),
+                until=min(time.time() + 300, ts), interval=1
+            ))
             return
         
         await interaction.response.defer(ephemeral=True)
-        logical_now = now - timedelta(hours=reset_hour)
+        logical_now = now - timedelta(hours=DAILY_RESET_HOUR)
         today_date = logical_now.strftime("%Y-%m-%d")
         yesterday_date = (logical_now - timedelta(days=1)).strftime("%Y-%m-%d")
         
@@ -501,18 +503,12 @@ class Cultivation(commands.Cog):
         if not can_add:
             return await interaction.followup.send(f"🛑 Ngươi đã đạt giới hạn tích lũy linh lực trong ngày (**{limit} EXP**). Hãy nghỉ ngơi!", ephemeral=True)
         
-        exp = user['exp'] + reward
-        layer = user['layer']
-        goal = user['goal']
-        daily_exp = user.get('daily_exp', 0) + reward
-        leveled_up = False
-        while exp >= goal:
-            exp -= goal
-            layer += 1
-            goal = layer * 1000
-            leveled_up = True
-            
-        await self.db.update_user(uid, exp=exp, layer=layer, goal=goal, last_daily=now.timestamp(), last_daily_date=today_date, daily_streak=streak, daily_exp=daily_exp, spirit_stones=user['spirit_stones'] + stones)
+        user = await self.db.apply_delta(
+            uid,
+            assign={'last_daily': now.timestamp(), 'last_daily_date': today_date, 'daily_streak': streak},
+            reason='daily', level_up=True, exp=reward, daily_exp=reward, spirit_stones=stones
+        )
+        leveled_up, layer = level_up_result(user)
         if leveled_up: await self.check_auto_role(interaction.user, layer) 
         
         msg = await ask_ancestor("Ban thưởng điểm danh.", f"Đệ tử nhận {reward} EXP ngày {streak}. Viết 1 câu thâm sâu.")
@@ -544,33 +540,12 @@ class Cultivation(commands.Cog):
         embed.add_field(name="✨ Tiến Độ", value=f"`{bar}` ({TXAFormat.pad2(0)}%) - {rem_str}")
         msg = await interaction.followup.send(embed=embed, ephemeral=True)
         
-        # Cập nhật thanh tiến trình mỗi 1 giây (real-time)
-        while True:
-            now_t = time.time()
-            elapsed = now_t - start_time
-            remaining = max(0, int(end_time - now_t))
-            percent = min(100, int((elapsed / duration) * 100))
-            
-            if percent >= 100: break
-            
-            # Chọn narrative text theo %
-            stage_msg = self.NARRATIVE_STAGES[0][1]
-            for threshold, text in self.NARRATIVE_STAGES:
-                if percent >= threshold:
-                    stage_msg = text
-            
-            # Cập nhật mỗi 1 giây
-            bar = TXAFormat.progress_bar(percent, 15)
-            rem_str = TXAFormat.remaining_detail(remaining)
-            
-            embed.description = f"{stage_msg}\n⏳ Ước tính hoàn tất: <t:{end_time}:t> (<t:{end_time}:R>)"
-            embed.set_field_at(0, name="✨ Tiến Độ", value=f"`{bar}` ({TXAFormat.pad2(percent)}%) - {rem_str}")
-            
-            try: await msg.edit(embed=embed)
-            except: pass
-            
-            if percent >= 100: break
-            await asyncio.sleep(1)
+        # Thanh tiến trình real-time qua bộ lập lịch chung, chờ tới khi tu luyện xong
+        view = self.bot.live_views.register(LiveView(
+            f"tu_luyen:{interaction.id}", self.progress_renderer(embed, start_time, end_time), self.bot.rest.editor(msg), until=end_time
+        ))
+        await view.wait()
+        await asyncio.sleep(max(0, end_time - time.time()))
         
         # Re-fetch user to get latest state
         user = await self.db.get_user(uid)
@@ -580,7 +555,7 @@ class Cultivation(commands.Cog):
         if not can_add:
             res_embed = txa_embed("🛑 Kiệt Sức", f"Ngươi đã đạt giới hạn tích lũy linh lực trong ngày (**{limit} EXP**). Hãy nghỉ ngơi, tham gia hoạt động giải trí (như nghe nhạc) để thư giãn!", Color.orange())
             res_embed.set_footer(text="Công khóa hoàn tất. (Nhấn để đóng)")
-            try: await msg.edit(embed=res_embed)
+            try: await self.bot.rest.edit(msg, PRIORITY_RESULT, embed=res_embed)
             except: pass
             return
         
@@ -592,25 +567,14 @@ class Cultivation(commands.Cog):
             gain += bonus_xp
             bonus_msg = f"\n🔥 **Kỳ Duyên Phụ Trợ:** +{bonus_xp} EXP (Streak x{user['daily_streak']})"
 
-        exp = user['exp'] + gain
-        layer = user['layer']
-        goal = user['goal']
-        daily_exp = user.get('daily_exp', 0) + gain
-        
-        leveled_up = False
-        while exp >= goal:
-            exp -= goal
-            layer += 1
-            goal = layer * 1000
-            leveled_up = True
-            
         # Linh thạch ngẫu nhiên khi tu luyện
         stones = random.randint(5, 15)
         # Check for x3 buff
         is_x3 = user.get('buffs', {}).get('stone_x3', 0) > time.time()
         if is_x3: stones *= 3
         
-        await self.db.update_user(uid, exp=exp, layer=layer, goal=goal, daily_exp=daily_exp, spirit_stones=user['spirit_stones'] + stones)
+        user = await self.db.apply_delta(uid, reason='tu_luyen', level_up=True, exp=gain, daily_exp=gain, spirit_stones=stones)
+        leveled_up, layer = level_up_result(user)
         if leveled_up: await self.check_auto_role(interaction.user, layer) # Call new auto role check
         
         res_text = f"Chu thiên tuần hoàn kết thúc, linh khí đã được luyện hóa.\n📈 Nhận được: **{gain} EXP** linh lực.\n💰 Nhận được: **{stones} Linh Thạch**{ ' (🎰 x3)' if is_x3 else ''}.{bonus_msg}"
@@ -619,74 +583,54 @@ class Cultivation(commands.Cog):
         
         res_embed.set_footer(text="Công khóa hoàn tất. (Nhấn để đóng)")
         try:
-            await msg.edit(embed=res_embed)
+            await self.bot.rest.edit(msg, PRIORITY_RESULT, embed=res_embed)
         except: pass
 
+    def progress_renderer(self, embed, start_time, end_time):
+        """Render thanh tiến độ + lời dẫn theo % cho tu luyện / nhiệm vụ (dùng với LiveView)"""
+        duration = max(1, end_time - start_time)
+
+        async def render(now):
+            remaining = max(0, int(end_time - now))
+            percent = min(100, int(((now - start_time) / duration) * 100))
+
+            # Chọn narrative text theo %
+            stage_msg = self.NARRATIVE_STAGES[0][1]
+            for threshold, text in self.NARRATIVE_STAGES:
+                if percent >= threshold:
+                    stage_msg = text
+
+            bar = TXAFormat.progress_bar(percent, 15)
+            rem_str = TXAFormat.remaining_detail(remaining)
+            embed.description = f"{stage_msg}\n⏳ Ước tính hoàn tất: <t:{end_time}:t> (<t:{end_time}:R>)"
+            embed.set_field_at(0, name="✨ Tiến Độ", value=f"`{bar}` ({TXAFormat.pad2(percent)}%) - {rem_str}")
+            return {"embed": embed}
+        return render
+
     async def generate_missions(self, user):
-        """Tạo danh sách nhiệm vụ mới via AI hoặc Fallback"""
+        """Tạo danh sách nhiệm vụ mới từ kho AI sinh sẵn (kho cạn thì bù bằng Fallback)"""
         uid = str(user['user_id'])
         is_sect = user.get('sect_id') is not None
         num_missions = 10 if is_sect else 5
-        prompt = (
-            f"Tạo {num_missions} nhiệm vụ tu tiên ngắn gọn, thâm sâu. "
-            "Phân cấp độ khó từ 1 (Dễ) đến 10 (Cực khó). "
-            "Phần thưởng (reward) từ 500 đến 10000 tùy độ khó. "
-            "Thời gian thực hiện (time) từ 30 đến 300 giây. "
-            "Format JSON: [{'id': 1, 'title': '...', 'desc': '...', 'diff': 1-10, 'reward': int, 'time': int}]"
-        )
-        
-        rainbow_log(f"🔮 Đang thỉnh thị Tổ Sư Từ Dương tạo công khóa cho {user['name']}...")
-        ai_res = await ask_ancestor("Người tạo nhiệm vụ tu tiên.", prompt, json_mode=True)
-        
-        missions = []
-        try:
-            raw_missions = json.loads(ai_res)
-            if isinstance(raw_missions, dict): 
-                raw_missions = raw_missions.get('missions', [])
-                
-            for i, m in enumerate(raw_missions):
-                diff = m.get('diff', random.randint(1, 10))
-                missions.append({
-                    "id": i + 1,
-                    "title": m.get('title', "Nhiệm vụ vô danh"),
-                    "desc": m.get('desc', "Đi tìm cơ duyên..."),
-                    "difficulty": diff,
-                    "time": m.get('time', diff * 30),
-                    "reward": m.get('reward', diff * 500 + random.randint(100, 300)),
-                    "stones": random.randint(5, 15) + (diff * 2), # Base stones
-                    "success_rate": max(10, 100 - (diff * 8)),
-                    "done": False
-                })
-            rainbow_log(f"✅ AI đã ban xuống {len(missions)} công khóa mới cho {user['name']}.")
-        except Exception as e:
-            rainbow_log(f"⚠️ Thỉnh thị AI thất bại: {e}. Sử dụng bí tịch Fallback.")
-            # Fallback using CultivationData
-            num_fallback = 10 if is_sect else 5
-            for i in range(num_fallback):
-                diff = (i % 5) + 1
-                mission_title = CultivationData.get_random_mission()
-                missions.append({
-                    "id": i + 1,
-                    "title": mission_title,
-                    "desc": f"Thực hiện {mission_title} để tích lũy kinh nghiệm.",
-                    "difficulty": diff,
-                    "time": diff * 40,
-                    "reward": diff * 350 + random.randint(10, 50), # Random XP base
-                    "stones": random.randint(5, 10) + diff, # Fallback stones
-                    "success_rate": 100 - (diff * 12),
-                    "done": False
-                })
-        
-        return missions
-
-    async def finalize_mission(self, interaction: discord.Interaction, uid: str, user: dict, mission_id: int, silent: bool = False):
-        if not silent: await interaction.response.defer(ephemeral=True)
-        mission = next((m for m in user['missions'] if m['id'] == mission_id), None)
-        if not mission:
-            await self.db.update_user(uid, current_mission=None)
-            return
+        return await self.mission_pool.take(uid, num_missions)
+
+    def find_member(self, uid: str):
+        """Tìm Member của đệ tử trong các server bot đang ở (dùng khi không có interaction)"""
+        for guild in self.bot.guilds:
+            member = guild.get_member(int(uid))
+            if member: return member
+        return None
+
+    async def complete_mission(self, uid: str, mission_id: int, member: discord.Member = None):
+        """
+        Chốt kết quả nhiệm vụ đã hết giờ, trả về embed kết quả.
+        Hàng đợi hẹn giờ và lệnh bù có thể cùng gọi: chỉ bên giành được clear_current_mission (rowcount = 1)
+        mới phát thưởng, bên còn lại nhận None.
+        """
+        if not await self.db.clear_current_mission(uid, mission_id): return None
         user = await self.db.get_user(uid)
-        if not user or not user.get('current_mission'): return
+        mission = next((m for m in user['missions'] if m['id'] == mission_id), None) if user else None
+        if not mission: return None
         
         success_rate = mission['success_rate']
         # Pet "Tiểu Hắc" buff (kiểm tra hạn dùng)
@@ -695,57 +639,73 @@ class Cultivation(commands.Cog):
             success_rate += 20
         success = random.randint(1, 100) <= success_rate
         
-        await self.db.update_user(uid, current_mission=None)
-        if success:
-            new_missions = user['missions']
-            for m in new_missions:
-                if m['id'] == mission['id']: m['done'] = True
-            
-            reward = mission['reward']
-            
-            # Stones logic update
-            base_stones = mission.get('stones', random.randint(20, 50))
-            buffs = user.get('buffs', {})
-            is_x3 = buffs.get('stone_x3', 0) > time.time()
-            stones = base_stones * 3 if is_x3 else base_stones
-
-            can_add, limit = await self.check_daily_xp_limit(user, reward)
-            if not can_add:
-                if not silent: return await interaction.followup.send(f"🛑 Đạt giới hạn EXP (**{limit}**).", ephemeral=True)
-                return 
-
-            if user.get('sect_id'): reward += random.randint(50, 100)
-            bonus_msg = ""
-            if user['daily_streak'] >= 3:
-                bonus_xp = int(reward * min(0.5, (user['daily_streak'] // 3) * 0.05))
-                reward += bonus_xp
-                bonus_msg = f"\n🔥 **Streak Bonus:** +{bonus_xp} EXP"
-
-            exp = user['exp'] + reward
-            layer = user['layer']
-            goal = user['goal']
-            daily_exp = user.get('daily_exp', 0) + reward
-            leveled_up = False
-            while exp >= goal:
-                exp -= goal
-                layer += 1
-                goal = max(layer * 1000, 200)
-                leveled_up = True
-            
-            await self.db.update_user(uid, missions=new_missions, missions_completed=user['missions_completed'] + 1, exp=exp, layer=layer, goal=goal, daily_exp=daily_exp, spirit_stones=user['spirit_stones'] + stones)
-            if leveled_up: await self.check_auto_role(interaction.user, layer) 
-            
-            if not silent:
-                res_embed = txa_embed("✅ Hoàn Thành", f"**{mission['title']}** xong!\n📈: **{reward} EXP**{bonus_msg}\n💰: **{stones} Linh Thạch**{ ' (🎰 x3)' if is_x3 else ''}", Color.green())
-                if leveled_up: res_embed.add_field(name="🔥 ĐỘT PHÁ", value=f"Tầng {layer}!")
-                await interaction.followup.send(embed=res_embed, ephemeral=True)
-        else:
-            new_missions = user['missions']
-            for m in new_missions:
-                if m['id'] == mission['id']: m['retry_time'] = int(time.time() + 180)
-            await self.db.update_user(uid, missions=new_missions)
-            if not silent:
-                await interaction.followup.send(embed=txa_embed("❌ Thất Bại", f"**{mission['title']}** thất bại. Chờ 3 phút.", Color.red()), ephemeral=True)
+        if not success:
+            # Ghi lại thời gian thất bại (3 phút)
+            await self.db.update_mission(uid, mission['id'], retry_time=int(time.time() + 180))
+            return txa_embed("❌ Tâm Ma Xâm Nhập", f"Đáng tiếc! Ngươi đã thất bại trong nhiệm vụ **{mission['title']}**.\n⏱️ Cần tịnh tâm trong **3 phút** để có thể thử lại.", Color.red())
+
+        reward = mission['reward']
+        
+        # Stones logic update
+        base_stones = mission.get('stones', random.randint(20, 50))
+        buffs = user.get('buffs', {})
+        is_x3 = buffs.get('stone_x3', 0) > time.time()
+        stones = base_stones * 3 if is_x3 else base_stones
+
+        can_add, limit = await self.check_daily_xp_limit(user, reward)
+        if not can_add:
+            return txa_embed("🛑 Kiệt Sức", f"Ngươi đã đạt giới hạn tích lũy linh lực trong ngày (**{limit} EXP**). Hãy nghỉ ngơi, tham gia hoạt động giải trí (như nghe nhạc) để thư giãn!", Color.orange())
+
+        if user.get('sect_id'): reward += random.randint(50, 100)
+        bonus_msg = ""
+        if user['daily_streak'] >= 3:
+            bonus_xp = int(reward * min(0.5, (user['daily_streak'] // 3) * 0.05))
+            reward += bonus_xp
+            bonus_msg = f"\n🔥 **Hào Quang Streak:** +{bonus_xp} EXP"
+
+        await self.db.update_mission(uid, mission['id'], done=True)
+        user = await self.db.apply_delta(
+            uid, reason='mission', level_up=True, exp=reward, daily_exp=reward, spirit_stones=stones, missions_completed=1
+        )
+        leveled_up, layer = level_up_result(user)
+        member = member or self.find_member(uid)
+        if leveled_up and member: await self.check_auto_role(member, layer)
+        
+        res_embed = txa_embed("✅ Cơ Duyên Viên Mãn", f"Chúc mừng! Ngươi đã hoàn thành **{mission['title']}**.\n📈 Nhận được: **{reward} EXP** linh lực.\n💰 Nhận được: **{stones} Linh Thạch**{ ' (🎰 x3)' if is_x3 else ''}.{bonus_msg}", Color.green())
+        if leveled_up: res_embed.add_field(name="🔥 ĐỘT PHÁ CẢNH GIỚI", value=f"Ngươi đã đạt tới **Tầng {layer}**!")
+        return res_embed
+
+    async def on_mission_due(self, uid: str, mission_id: int):
+        """Hàng đợi hẹn giờ gọi đúng end_time: chốt kết quả rồi báo vào tin nhắn tiến độ (hoặc DM nếu không còn)"""
+        res_embed = await self.complete_mission(uid, mission_id)
+        if not res_embed: return
+        self.bot.live_views.cancel(f"lam_nhiem_vu:{uid}")
+        active = self.active_missions.pop(uid, None)
+        if active and active[0] == mission_id:
+            try: return await self.bot.rest.edit(active[1], PRIORITY_RESULT, embed=res_embed)
+            except: pass
+        # Bot vừa khởi động lại / tin nhắn ephemeral đã hết hạn -> báo qua DM
+        await self.bot.dm.send(uid, embed=res_embed)
+
+    async def finalize_mission(self, interaction: discord.Interaction, uid: str, mission_id: int, silent: bool = False):
+        """Bù chốt nhiệm vụ đã quá hạn ngay trong lệnh (hàng đợi hẹn giờ chưa kịp chạy)"""
+        if not silent: await interaction.response.defer(ephemeral=True)
+        self.mission_timers.cancel(uid)
+        res_embed = await self.complete_mission(uid, mission_id, interaction.user)
+        if silent: return
+        if not res_embed:
+            res_embed = txa_embed("✅ Công Khóa Đã Chốt", "Kết quả công khóa này đã được Thiên Đạo ghi nhận từ trước.", Color.green())
+        await interaction.followup.send(embed=res_embed, ephemeral=True)
+
+    async def start_mission_timers(self):
+        """Nạp lại hẹn giờ nhiệm vụ từ DB sau khi bot sẵn sàng (nhiệm vụ quá hạn lúc tắt bot được chốt ngay)"""
+        await self.bot.wait_until_ready()
+        try:
+            count = await self.mission_timers.load()
+            self.mission_timers.start()
+            if count: rainbow_log(f"⏰ [Nhiệm Vụ] Nạp lại {count} hẹn giờ nhiệm vụ đang làm dở.")
+        except Exception as e:
+            rainbow_log(f"⚠️ [Nhiệm Vụ] Không nạp được hẹn giờ nhiệm vụ: {e}")
 
     def get_diff_name(self, diff: int):
         """Chuyển độ khó thành danh xưng tu tiên"""
@@ -766,16 +726,8 @@ class Cultivation(commands.Cog):
         if not user: return await interaction.followup.send("⛩️ Ngươi chưa ghi danh!", ephemeral=True)
         
         now = datetime.now(VN_TZ)
-        # Reset lúc 7h sáng
-        reset_hour = 7
-        today_reset = now.replace(hour=reset_hour, minute=0, second=0, microsecond=0)
-        if now < today_reset: today_reset -= timedelta(days=1)
-        
-        # Reset daily exp if needed
-        if user.get('last_daily_exp_reset', 0) < today_reset.timestamp():
-            await self.db.update_user(uid, daily_exp=0, last_daily_exp_reset=now.timestamp())
-            user['daily_exp'] = 0 # Update local user object for current operation
-        
+        # daily_exp / missions_completed / nhiệm vụ cũ đã được daily_reset_task reset lúc 7h sáng
+
         # Calculate dynamic daily limit
         daily_limit = 10 # Base limit
         sect_bonus_limit = 0
@@ -787,11 +739,9 @@ class Cultivation(commands.Cog):
             sect_bonus_limit = temp_random.randint(3, 7)
             daily_limit += sect_bonus_limit
         
-        # Kiểm tra reset nhiệm vụ
+        # Kiểm tra làm mới nhiệm vụ (qua ngày mới thì danh sách đã bị xóa, all([]) -> làm mới)
         should_refresh = False
-        if user['last_mission_reset'] < today_reset.timestamp():
-            should_refresh = True
-        elif user['missions_completed'] >= daily_limit: # Check against dynamic limit
+        if user['missions_completed'] >= daily_limit: # Check against dynamic limit
             # If all missions are done and limit reached, no refresh
             pass
         elif all(m['done'] for m in user['missions']):
@@ -801,9 +751,8 @@ class Cultivation(commands.Cog):
 
         if should_refresh:
             missions = await self.generate_missions(user)
-            await self.db.update_user(uid, missions=missions, last_mission_reset=now.timestamp(), missions_completed=0) # Reset missions_completed on new day
+            await self.db.update_user(uid, missions=missions, last_mission_reset=now.timestamp())
             user['missions'] = missions
-            user['missions_completed'] = 0 # Update local user object
 
         # Kiểm tra nhiệm vụ đang làm (Đồng bộ ID)
         current_mission_id = None
@@ -814,7 +763,7 @@ class Cultivation(commands.Cog):
                 current_mission_id = int(curr['id'])
             else:
                 # Tự động finalize nếu đã xong
-                asyncio.create_task(self.finalize_mission(interaction, uid, user, int(curr['id']), silent=True))
+                asyncio.create_task(self.finalize_mission(interaction, uid, int(curr['id']), silent=True))
 
         async def build_desc(curr_rem=0):
             d = f"📊 **Tiến độ hôm nay:** `{user['missions_completed']}/{daily_limit}` công khóa\n"
@@ -864,22 +813,16 @@ class Cultivation(commands.Cog):
         msg = await interaction.followup.send(embed=embed, ephemeral=True)
 
         if current_mission_id and curr_rem > 0:
-            loop_end = time.time() + 300
-            while time.time() < loop_end:
-                now_t = time.time()
-                curr_rem = int(user['current_mission']['end_time'] - now_t)
-                
-                if curr_rem <= 0:
-                    # Cập nhật lần cuối khi xong
-                    embed.description = await build_desc(0)
-                    try: await msg.edit(embed=embed)
-                    except: pass
-                    break
-                
-                embed.description = await build_desc(curr_rem)
-                try: await msg.edit(embed=embed)
-                except: break
-                await asyncio.sleep(1)
+            end_time = user['current_mission']['end_time']
+
+            async def render(now):
+                embed.description = await build_desc(max(0, int(end_time - now)))
+                return {"embed": embed}
+
+            # Đếm ngược tối đa 5 phút, cập nhật lần cuối khi xong
+            self.bot.live_views.register(LiveView(
+                f"nhiem_vu:{uid}", render, self.bot.rest.editor(msg), until=min(time.time() + 300, end_time), final=True
+            ))
 
     @app_commands.command(name="lam_nhiem_vu", description="Bắt đầu thực hiện nhiệm vụ")
     @app_commands.describe(mission_id="ID của nhiệm vụ trong danh sách của ngươi")
@@ -947,7 +890,7 @@ class Cultivation(commands.Cog):
             else:
                 # Nhiệm vụ đã xong nhưng chưa được xử lý (bot restart giữa chừng)
                 # Xử lý kết quả ngay
-                await self.finalize_mission(interaction, uid, user, curr['id'])
+                await self.finalize_mission(interaction, uid, int(curr['id']))
                 return
 
         await interaction.response.defer(ephemeral=True)
@@ -955,7 +898,9 @@ class Cultivation(commands.Cog):
         # Bắt đầu làm
         start_t = time.time()
         end_time = int(start_t + mission['time'])
-        await self.db.update_user(uid, current_mission={"id": mission['id'], "end_time": end_time})
+        await self.db.start_mission(uid, mission['id'], end_time)
+        # Kết quả do hàng đợi hẹn giờ chốt đúng end_time (kể cả khi bot khởi động lại), lệnh trả về ngay
+        self.mission_timers.schedule(uid, mission['id'], end_time)
         
         # Để tránh việc hiện "2 phút trước" khi máy chủ lệch giờ, ta dùng text thủ công bên dưới kết hợp timestamp
         embed = txa_embed(f"⚔️ Tiếp Nhận: {mission['title']}", f"{self.NARRATIVE_STAGES[0][1]}\n⏳ Ước tính hoàn tất: <t:{end_time}:t> (<t:{end_time}:R>)", Color.purple())
@@ -964,94 +909,10 @@ class Cultivation(commands.Cog):
         embed.add_field(name="✨ Tiến Độ", value=f"`{bar}` ({TXAFormat.pad2(0)}%) - {rem_str}")
         msg = await interaction.followup.send(embed=embed, ephemeral=True)
         
-        # Cập nhật progress mỗi 1 giây (real-time)
-        last_stage_msg = self.NARRATIVE_STAGES[0][1]
-        while True:
-            now_t = time.time()
-            elapsed = now_t - start_t
-            remaining = max(0, int(end_time - now_t))
-            percent = min(100, int((elapsed / mission['time']) * 100))
-            
-            if percent >= 100: break
-            
-            # Chọn narrative text theo %
-            stage_msg = self.NARRATIVE_STAGES[0][1]
-            for threshold, text in self.NARRATIVE_STAGES:
-                if percent >= threshold:
-                    stage_msg = text
-            
-            bar = TXAFormat.progress_bar(percent, 15)
-            rem_str = TXAFormat.remaining_detail(remaining)
-            
-            # Chỉ cập nhật nếu có sự thay đổi đáng kể hoặc tin nhắn mới
-            embed.description = f"{stage_msg}\n⏳ Ước tính hoàn tất: <t:{end_time}:t> (<t:{end_time}:R>)"
-            embed.set_field_at(0, name="✨ Tiến Độ", value=f"`{bar}` ({TXAFormat.pad2(percent)}%) - {rem_str}")
-            
-            try: await msg.edit(embed=embed)
-            except: pass
-            
-            if percent >= 100: break
-            await asyncio.sleep(1)
-
-        # Xử lý kết quả
-        user = await self.db.get_user(uid) # Re-fetch
-        success = random.randint(1, 100) <= mission['success_rate']
-        
-        # Xóa current_mission
-        await self.db.update_user(uid, current_mission=None)
-        
-        if success:
-            # ... (giữ nguyên logic thành công) ...
-            # Mark done in list
-            new_missions = user['missions']
-            for m in new_missions:
-                if m['id'] == mission['id']: m['done'] = True
-            
-            reward = mission['reward']
-
-            can_add, limit = await self.check_daily_xp_limit(user, reward)
-            if not can_add:
-                 return await interaction.followup.send(f"🛑 Ngươi đã đạt giới hạn tích lũy linh lực trong ngày (**{limit} EXP**). Hãy nghỉ ngơi, tham gia hoạt động giải trí (như nghe nhạc) để thư giãn!", ephemeral=True)
-            
-            # Sect Bonus XP
-            if user.get('sect_id'):
-                sect_bonus_xp = random.randint(50, 100)
-                reward += sect_bonus_xp
-            
-            # Bonus streak
-            bonus_msg = ""
-            if user['daily_streak'] >= 3:
-                bonus_pct = min(0.5, (user['daily_streak'] // 3) * 0.05)
-                bonus_xp = int(reward * bonus_pct)
-                reward += bonus_xp
-                bonus_msg = f"\n🔥 **Hào Quang Streak:** +{bonus_xp} EXP"
-
-            exp = user['exp'] + reward
-            layer = user['layer']
-            goal = user['goal']
-            leveled_up = False
-            while exp >= goal:
-                exp -= goal
-                layer += 1
-                goal = max(layer * 1000, 200)
-                leveled_up = True
-            
-            await self.db.update_user(uid, missions=new_missions, missions_completed=user['missions_completed'] + 1, exp=exp, layer=layer, goal=goal)
-            if leveled_up: await self.check_auto_role(interaction.user, layer) # Call new auto role check
-            
-            res_embed = txa_embed("✅ Cơ Duyên Viên Mãn", f"Chúc mừng! Ngươi đã hoàn thành **{mission['title']}**.\n📈 Nhận được: **{reward} EXP** linh lực.{bonus_msg}", Color.green())
-            if leveled_up: res_embed.add_field(name="🔥 ĐỘT PHÁ CẢNH GIỚI", value=f"Ngươi đã đạt tới **Tầng {layer}**!")
-        else:
-            # Ghi lại thời gian thất bại (3 phút)
-            new_missions = user['missions']
-            for m in new_missions:
-                if m['id'] == mission['id']:
-                    m['retry_time'] = int(time.time() + 180)
-            await self.db.update_user(uid, missions=new_missions)
-            
-            res_embed = txa_embed("❌ Tâm Ma Xâm Nhập", f"Đáng tiếc! Ngươi đã thất bại trong nhiệm vụ **{mission['title']}**.\n⏱️ Cần tịnh tâm trong **3 phút** để có thể thử lại.", Color.red())
-
-        await msg.edit(embed=res_embed)
+        self.active_missions[uid] = (mission['id'], msg)
+        self.bot.live_views.register(LiveView(
+            f"lam_nhiem_vu:{uid}", self.progress_renderer(embed, start_t, end_time), self.bot.rest.editor(msg), until=end_time
+        ))
 
     @lam_nhiem_vu.autocomplete("mission_id")
     async def _mission_autocomplete(self, interaction: discord.Interaction, current: str):
@@ -1082,26 +943,17 @@ class Cultivation(commands.Cog):
                 choices.append(app_commands.Choice(name=title, value=m['id']))
         return choices[:25]
 
-    @app_commands.command(name="bxh", description="Bảng xếp hạng Thiên Lam Tông")
-    async def bxh(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-        uid = str(interaction.user.id)
-        user = await self.db.get_user(uid)
-        if not user:
-            embed = txa_embed("⛩️ Thiên Lam Cấm Chế", "Ngươi chưa ghi danh! Hãy dùng `/start` để nhập môn.", discord.Color.red())
-            return await interaction.followup.send(embed=embed, ephemeral=True)
-            
-        top = await self.db.get_top_users(10)
-        
+    def render_leaderboard(self, rows, page, page_count):
+        """Bảng ANSI của một trang thiên bảng (được Leaderboard cache tới khi thứ tự trang đổi)"""
         desc = "```ansi\n"
         desc += "\u001b[1;33m┏━━━━┳━━━━━━━━━━━━━━━━━━━━━┳━━━━━━━━━━━┳━━━━━━━━━━━┓\u001b[0m\n"
         desc += "\u001b[1;33m┃ HẠNG ┃      ĐẠO HỮU      ┃ CẢNH GIỚI ┃   TU VI   ┃\u001b[0m\n"
         desc += "\u001b[1;33m┣━━━━╋━━━━━━━━━━━━━━━━━━━━━╋━━━━━━━━━━━╋━━━━━━━━━━━┫\u001b[0m\n"
         
-        for i, u in enumerate(top, 1):
-            rank_name, info = get_rank_info(u['layer'])
+        for i, _, name, layer, exp in rows:
             # Cắt ngắn tên nếu quá dài
-            name = (u['name'][:15] + '..') if len(u['name']) > 17 else u['name']
+            name = name or "Vô Danh"
+            name = (name[:15] + '..') if len(name) > 17 else name
             
             # Emojis và màu sắc cho Top 3
             if i == 1: medal, color = "🥇", "\u001b[1;33m" # Gold
@@ -1109,17 +961,33 @@ class Cultivation(commands.Cog):
             elif i == 3: medal, color = "🥉", "\u001b[1;31m" # Bronze
             else: medal, color = f"{i:2}", "\u001b[0;37m"
             
-            exp_str = f"{u['exp']:,}"
-            desc += f"┃ {medal} ┃ {color}{name:<19}\u001b[0m ┃ Tầng {u['layer']:3} ┃ {exp_str:>9} ┃\n"
+            exp_str = f"{exp:,}"
+            desc += f"┃ {medal} ┃ {color}{name:<19}\u001b[0m ┃ Tầng {layer:3} ┃ {exp_str:>9} ┃\n"
             
         desc += "\u001b[1;33m┗━━━━┻━━━━━━━━━━━━━━━━━━━━━┻━━━━━━━━━━━┻━━━━━━━━━━━┛\u001b[0m\n"
         desc += "```"
             
-        embed = txa_embed("📊 Thiên Lam Tu Vi Bảng", desc or "Chư thiên chưa có ai ghi danh!", Color.gold())
+        embed = txa_embed("📊 Thiên Lam Tu Vi Bảng", desc if rows else "Chư thiên chưa có ai ghi danh!", Color.gold())
         embed.set_thumbnail(url="https://hoathinh3d.moi/wp-content/uploads/2023/02/luyen-khi-10-van-nam-300x450.jpg")
         embed.add_field(name="✨ Pháp Tắc", value="Đạo hữu có tu vi thâm hậu nhất sẽ đứng đầu thiên bảng.", inline=False)
-        embed.set_footer(text="Thần bảng phong vân - Thiên Lam Tông.")
-        await interaction.followup.send(embed=embed, ephemeral=True)
+        embed.set_footer(text=f"Thần bảng phong vân - Thiên Lam Tông. • Trang {page + 1}/{page_count}")
+        return embed
+
+    @app_commands.command(name="bxh", description="Bảng xếp hạng Thiên Lam Tông")
+    @app_commands.describe(trang="Trang cần xem (mỗi trang 10 đạo hữu)")
+    async def bxh(self, interaction: discord.Interaction, trang: int = 1):
+        uid = str(interaction.user.id)
+        board = self.bot.leaderboard
+        # Thiên bảng nằm sẵn trong RAM: không đọc DB, trang không đổi thì dùng lại embed đã render
+        my_rank = board.rank_of(uid)
+        if my_rank is None:
+            embed = txa_embed("⛩️ Thiên Lam Cấm Chế", "Ngươi chưa ghi danh! Hãy dùng `/start` để nhập môn.", discord.Color.red())
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+
+        embed, page = board.page_embed(trang - 1, self.render_leaderboard)
+        embed = embed.copy()
+        embed.add_field(name="🧭 Vị Trí Của Ngươi", value=f"Hạng **{my_rank:,}** / {board.total:,} (trang {(my_rank - 1) // board.page_size + 1})", inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
     def get_active_inventory(self, user):
         """Lấy danh sách vật phẩm có thể sử dụng (trong kho) hoặc đang kích hoạt (buff)"""
@@ -1151,11 +1019,37 @@ class Cultivation(commands.Cog):
                 changed = True
         
         if changed:
-            await self.db.update_user(uid, inventory=new_inv)
+            await self.db.prune_inventory(uid, now)
             user['inventory'] = new_inv
             rainbow_log(f"🧹 [Inventory] Đã dọn dẹp vật phẩm hết hạn/hết số lượng của {user['name']}.")
         return new_inv
 
+    LEDGER_LABELS = {
+        'daily': "🎁 Điểm danh", 'tu_luyen': "🧘 Tu luyện", 'mission': "📜 Nhiệm vụ", 'combat': "⚔️ Đấu pháp",
+        'music': "🎵 Tiên nhạc", 'buy': "🛒 Vạn Bảo Các", 'use_item': "💊 Vật phẩm", 'admin': "🌀 Lão Tổ ban thưởng",
+    }
+
+    @app_commands.command(name="thu_nhap", description="Xem sổ thu chi EXP & Linh Thạch trong 7 ngày qua")
+    async def thu_nhap(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        uid = str(interaction.user.id)
+        if not await self.db.get_user(uid, children=False):
+            embed = txa_embed("⛩️ Thiên Lam Cấm Chế", "Ngươi chưa ghi danh! Hãy dùng `/start` để nhập môn.", discord.Color.red())
+            return await interaction.followup.send(embed=embed, ephemeral=True)
+
+        summary = await self.db.ledger_summary(uid, since=ledger_day_start(time.time() - 6 * 86400))
+        embed = txa_embed("🧾 Sổ Thu Chi 7 Ngày", "", Color.gold())
+        if not summary:
+            embed.description = "Bảy ngày qua ngươi chưa có biến động linh lực hay linh thạch nào."
+        else:
+            lines = []
+            for reason, r in sorted(summary.items(), key=lambda x: -abs(x[1]['spirit_stones'])):
+                lines.append(f"{self.LEDGER_LABELS.get(reason, reason)}: **{r['exp']:+,} EXP** | **{r['spirit_stones']:+,} 💎** ({r['entries']} lần)")
+            embed.description = "\n".join(lines)
+            embed.add_field(name="📈 Tổng EXP", value=f"**{sum(r['exp'] for r in summary.values()):+,}**", inline=True)
+            embed.add_field(name="💰 Tổng Linh Thạch", value=f"**{sum(r['spirit_stones'] for r in summary.values()):+,} 💎**", inline=True)
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
     @app_commands.command(name="inventory", description="Xem túi thần thông (Cập nhật Real-time & Hạn dùng)")
     async def inventory(self, interaction: discord.Interaction):
         uid = str(interaction.user.id)
@@ -1164,14 +1058,13 @@ class Cultivation(commands.Cog):
             embed = txa_embed("⛩️ Thiên Lam Cấm Chế", "Ngươi chưa ghi danh! Hãy dùng `/start` để nhìn thấu túi thần thông.", discord.Color.red())
             return await interaction.response.send_message(embed=embed, ephemeral=True)
             
-        msg = await interaction.response.send_message("🌀 Đang kiểm vật trong túi...", ephemeral=True)
+        await interaction.response.send_message("🌀 Đang kiểm vật trong túi...", ephemeral=True)
         
-        start_time = time.time()
-        while time.time() - start_time < 120:
+        # Cập nhật 5s/lần trong 2 phút qua bộ lập lịch chung, hết hạn thì xóa
+        async def render(now):
             user = await self.db.get_user(uid)
-            if not user: break
+            if not user: return None
             
-            now = time.time()
             # Dọn dẹp real-time
             inv = await self.ensure_active_inventory(uid, user)
             
@@ -1195,13 +1088,16 @@ class Cultivation(commands.Cog):
             
             embed = txa_embed("👋 Túi Thần Thông", content, discord.Color.blue())
             embed.set_footer(text=f"Linh Thạch: {user['spirit_stones']} 💎 | Tự hủy sau 2 phút")
-            
-            try: await interaction.edit_original_response(content=None, embed=embed)
-            except: break
-            await asyncio.sleep(5)
-            
-        try: await interaction.delete_original_response()
-        except: pass
+            return {"content": None, "embed": embed}
+
+        async def expire():
+            try: await interaction.delete_original_response()
+            except: pass
+
+        self.bot.live_views.register(LiveView(
+            f"inventory:{uid}", render, self.bot.rest.editor(interaction),
+            until=time.time() + 120, interval=5, on_expire=expire
+        ))
 
     @app_commands.command(name="shop", description="Vạn Bảo Các - Xem danh sách bảo vật")
     async def shop(self, interaction: discord.Interaction):
@@ -1233,23 +1129,16 @@ class Cultivation(commands.Cog):
             return await interaction.response.send_message(f"❌ Cần thêm {info['price'] - user['spirit_stones']} 💎 để mua!", ephemeral=True)
             
         # Dọn dẹp đồ hết hạn trước
-        inv = await self.ensure_active_inventory(uid, user)
-        found = False
-        for item in inv:
-            if item['id'] == item_id:
-                item['count'] = item.get('count', 0) + 1
-                found = True
-                break
-        if not found:
-            inv.append({"id": item_id, "count": 1, "expiry": 0})
-        
-        await self.db.update_user(uid, spirit_stones=user['spirit_stones'] - info['price'], inventory=inv)
+        await self.ensure_active_inventory(uid, user)
+        # Trừ tiền (có điều kiện đủ số dư) và cất vật phẩm trong cùng một transaction
+        if await self.db.buy_item(uid, item_id, info['price']) is None:
+            return await interaction.response.send_message(f"❌ Không đủ linh thạch! Cần {info['price']} 💎 để mua.", ephemeral=True)
         rainbow_log(f"🛒 [Shop] {user['name']} đã mua {info['name']}, vật phẩm đã vào túi.")
         await interaction.response.send_message(f"✅ Đã mua thành công **{info['emoji']} {info['name']}**! Vật phẩm đã được cất vào túi thần thông. Hãy dùng `/use_item` để kích hoạt.", ephemeral=True)
 
     @buy.autocomplete("item_id")
     async def buy_autocomplete(self, interaction: discord.Interaction, current: str):
-        user = await self.db.get_user(str(interaction.user.id))
+        user = await self.db.get_user(str(interaction.user.id), children=False)
         if not user: return []
         
         choices = []
@@ -1283,36 +1172,20 @@ class Cultivation(commands.Cog):
         item_info = CultivationData.ITEMS.get(item_id)
         if not item_info: return
         
-        # 1. Trừ số lượng trong kho
-        inv[item_idx]['count'] -= 1
+        # 1 + 2. Trừ số lượng trong kho, cộng dồn thời hạn buff nếu đang active (tính từ now nếu không)
         now = time.time()
-        
-        # 2. Xử lý thời hạn (Buff)
         duration = item_info.get('duration', 0)
-        has_buff = False
-        if duration > 0:
-            # Cộng dồn thời gian nếu đang có buff active, nếu không thì tính từ now
-            inv[item_idx]['expiry'] = max(inv[item_idx].get('expiry', 0), now) + duration
-            has_buff = True
+        if not await self.db.consume_item(uid, item_id, duration, now):
+            return await interaction.response.send_message("❌ Ngươi không có vật phẩm này!", ephemeral=True)
+        has_buff = duration > 0
             
         # 3. Xử lý hiệu ứng tức thì (EXP)
         effect = item_info.get('effect', {})
         exp_gain = effect.get('exp', 0)
-        leveled_up = False
-        new_layer = user['layer']
-        new_goal = user['goal']
-        new_exp = user['exp']
-        
-        if exp_gain > 0:
-            new_exp += exp_gain
-            while new_exp >= new_goal:
-                new_exp -= new_goal
-                new_layer += 1
-                new_goal = max(new_layer * 1000, 200)
-                leveled_up = True
                 
         # Lưu thay đổi
-        await self.db.update_user(uid, exp=new_exp, layer=new_layer, goal=new_goal, inventory=inv)
+        user = await self.db.apply_delta(uid, reason='use_item', level_up=True, exp=exp_gain)
+        leveled_up, new_layer = level_up_result(user)
         
         # Thông báo
         desc = f"Ngươi đã sử dụng **{item_info['emoji']} {item_info['name']}**.\n"
@@ -1332,11 +1205,11 @@ class Cultivation(commands.Cog):
 
     @use_item.autocomplete("item_id")
     async def use_item_autocomplete(self, interaction: discord.Interaction, current: str):
-        user = await self.db.get_user(str(interaction.user.id))
-        if not user: return []
+        inv = await self.db.get_inventory(str(interaction.user.id))
+        if not inv: return []
         
         # Chỉ hiển thị đồ còn hạn
-        inv = self.get_active_inventory(user)
+        inv = self.get_active_inventory({'inventory': inv})
         
         choices = []
         for it in inv:
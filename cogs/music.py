@@ -14,6 +14,7 @@ from pytubefix import YouTube, Search
 from pytubefix.cli import on_progress
 from core.helpers import rainbow_log, txa_embed
 from core.format import TXAFormat
+from core.rest_broker import PRIORITY_RESULT, PRIORITY_PROGRESS
 
 DOWNLOADS_DIR = "downloads"
 # Optimization for playing local files (no stream options needed)
@@ -296,7 +297,7 @@ class Music(commands.Cog):
                         f"**{url}**\n\n`{bar}` **{p:.2f}%**\n*{speed_note}*",
                         Color.blue()
                     )
-                    try: await status_msg.edit(embed=embed)
+                    try: await self.bot.rest.edit(status_msg, PRIORITY_PROGRESS, embed=embed)
                     except: pass
             
             update_task = asyncio.create_task(update_progress())
@@ -312,7 +313,7 @@ class Music(commands.Cog):
                     f"Đã nạp xong linh khí: **{title}**\n`100.00%` - Sẵn sàng thi triển.",
                     Color.green()
                 )
-                try: await status_msg.edit(embed=embed)
+                try: await self.bot.rest.edit(status_msg, PRIORITY_RESULT, embed=embed)
                 except: pass
                 
         except Exception as e:
@@ -321,7 +322,7 @@ class Music(commands.Cog):
             if status_msg:
                 try:
                     embed = txa_embed("❌ Vỡ Trận Triệu Hồi", f"Lỗi nạp linh khí: `{str(e)}`", Color.red())
-                    await status_msg.edit(embed=embed)
+                    await self.bot.rest.edit(status_msg, PRIORITY_RESULT, embed=embed)
                 except: pass
             raise e
 
@@ -432,9 +433,10 @@ class Music(commands.Cog):
         msg = self.now_playing_msgs.get(guild_id)
         
         # Rate limit handling: Try to edit, if stale/not found, recreate
+        # Tick định kỳ là edit tiến độ (có thể bị gộp/bỏ), còn thao tác của người dùng đi trước
         try:
             if msg:
-                await msg.edit(embed=embed, view=view)
+                await self.bot.rest.edit(msg, PRIORITY_RESULT if create_new else PRIORITY_PROGRESS, embed=embed, view=view)
                 return
         except discord.errors.NotFound:
              pass 
@@ -462,7 +464,7 @@ class Music(commands.Cog):
             if guild_id in self.now_playing_msgs:
                 try:
                     embed = txa_embed("🎵 Tiên Nhạc Kết Thúc", "Hàng chờ đã cạn, hãy thêm bài mới!", Color.orange())
-                    await self.now_playing_msgs[guild_id].edit(embed=embed, view=None)
+                    await self.bot.rest.edit(self.now_playing_msgs[guild_id], PRIORITY_RESULT, embed=embed, view=None)
                 except: pass
             return
 
@@ -552,11 +554,9 @@ class Music(commands.Cog):
         money = meta.get('accumulated_money', 0)
         
         if xp > 0 or money > 0:
-            user_data = await self.bot.db.get_user(str(user_id))
+            # Đột phá luôn trong cùng transaction cộng thưởng
+            user_data = await self.bot.db.apply_delta(str(user_id), reason='music', level_up=True, exp=xp, spirit_stones=money)
             if user_data:
-                new_exp = user_data.get('exp', 0) + xp
-                new_stones = user_data.get('spirit_stones', 0) + money
-                await self.bot.db.update_user(str(user_id), exp=new_exp, spirit_stones=new_stones)
                 rainbow_log(f"🎁 Reward saved for {user_id}: +{xp} XP, +{money} Stones")
 
     async def _cleanup_transients(self, guild_id, current_msg):
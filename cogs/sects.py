@@ -4,14 +4,15 @@ import random
 from discord import app_commands
 from discord.ext import commands
 from core.helpers import txa_embed, rainbow_log
-from core.database import Database
+from core.storage import Storage
+from core.rest_broker import PRIORITY_PROGRESS
 from core.game_data import CultivationData
 import json
 
 class Sects(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.db: Database = bot.db
+        self.db: Storage = bot.db
         self.sect_list_msgs = set() # Set of message objects to update
 
     async def _build_sect_list_embed(self):
@@ -21,22 +22,18 @@ class Sects(commands.Cog):
             
         embed = txa_embed("📜 Danh Sách Tông Môn (SQL Mode)", f"Tổng số: {len(sects)} phái", discord.Color.gold())
         
-        async with self.db.aiosqlite.connect(self.db.db_path) as db:
-            db.row_factory = self.db.aiosqlite.Row
-            for sect in sects:
-                # Query members
-                async with db.execute("SELECT user_id FROM users WHERE sect_id = ?", (sect['sect_id'],)) as cursor:
-                    rows = await cursor.fetchall()
-                    member_ids = [r['user_id'] for r in rows]
-                
-                leader = f"<@{sect['leader_id']}>"
-                member_count = len(member_ids)
-                member_mentions = ", ".join([f"<@{mid}>" for mid in member_ids[:10]])
-                if member_count > 10:
-                    member_mentions += f" và {member_count - 10} đệ tử khác..."
-                
-                content = f"👑 **Tông Chủ:** {leader}\n👥 **Đệ Tử ({member_count}):** {member_mentions if member_ids else 'Chưa có'}"
-                embed.add_field(name=f"⛩️ {sect['name']} (Cấp {sect['level']})", value=content, inline=False)
+        for sect in sects:
+            # Query members
+            member_ids = [m['user_id'] for m in await self.db.get_sect_members(sect['sect_id'])]
+            
+            leader = f"<@{sect['leader_id']}>"
+            member_count = len(member_ids)
+            member_mentions = ", ".join([f"<@{mid}>" for mid in member_ids[:10]])
+            if member_count > 10:
+                member_mentions += f" và {member_count - 10} đệ tử khác..."
+            
+            content = f"👑 **Tông Chủ:** {leader}\n👥 **Đệ Tử ({member_count}):** {member_mentions if member_ids else 'Chưa có'}"
+            embed.add_field(name=f"⛩️ {sect['name']} (Cấp {sect['level']})", value=content, inline=False)
         return embed
 
     async def update_sect_list_displays(self):
@@ -49,7 +46,7 @@ class Sects(commands.Cog):
         valid_msgs = set()
         for msg in self.sect_list_msgs:
             try:
-                await msg.edit(embed=embed)
+                await self.bot.rest.edit(msg, PRIORITY_PROGRESS, embed=embed)
                 valid_msgs.add(msg)
             except discord.NotFound:
                 # Message đã bị xóa
@@ -86,10 +83,7 @@ class Sects(commands.Cog):
         sect = await self.check_user_sect(uid)
         if not sect: return []
         
-        async with self.db.aiosqlite.connect(self.db.db_path) as db:
-            db.row_factory = self.db.aiosqlite.Row
-            async with db.execute("SELECT user_id, name FROM users WHERE sect_id = ?", (sect['sect_id'],)) as cursor:
-                members = await cursor.fetchall()
+        members = await self.db.get_sect_members(sect['sect_id'])
         
         choices = []
         for m in members:
@@ -104,19 +98,15 @@ class Sects(commands.Cog):
         user = await self.db.get_user(user_id)
         if user and user.get('sect_id'):
             # Nếu có sect_id, lấy thông tin sect
-            async with self.db.aiosqlite.connect(self.db.db_path) as db:
-                db.row_factory = self.db.aiosqlite.Row
-                async with db.execute("SELECT * FROM sects WHERE sect_id = ?", (user['sect_id'],)) as cursor:
-                    row = await cursor.fetchone()
-                    if row: return dict(row)
+            sect = await self.db.get_sect(user['sect_id'])
+            if sect: return sect
         
         # Fallback: Check leader status (Tông chủ luôn thuộc tông của mình)
-        sects = await self.db.get_all_sects()
-        for sect in sects:
-            if sect['leader_id'] == user_id:
-                # Nếu chưa sync sect_id cho leader, sync luôn
-                await self.db.update_user(user_id, sect_id=sect['sect_id'])
-                return sect
+        sect = await self.db.get_sect_by_leader(user_id)
+        if sect:
+            # Nếu chưa sync sect_id cho leader, sync luôn
+            await self.db.update_user(user_id, sect_id=sect['sect_id'])
+            return sect
         return None
 
     @app_commands.command(name="sect_create", description="Sáng lập Tông Môn (Cần Tầng 50+)")
@@ -152,10 +142,7 @@ class Sects(commands.Cog):
             return await interaction.followup.send(embed=embed, ephemeral=True)
         
         try:
-            async with self.db.aiosqlite.connect(self.db.db_path) as db:
-                cursor = await db.execute("INSERT INTO sects (name, leader_id) VALUES (?, ?)", (name, uid))
-                sect_id = cursor.lastrowid
-                await db.commit()
+            sect_id = await self.db.create_sect(name, uid)
             
             # Cập nhật sect_id cho tông chủ và reset nhiệm vụ để nhận công khóa tông môn
             await self.db.update_user(uid, sect_id=sect_id, missions=[])
@@ -191,10 +178,7 @@ class Sects(commands.Cog):
             return await interaction.followup.send(embed=embed)
         
         # Đếm số lượng đệ tử từ bảng users
-        async with self.db.aiosqlite.connect(self.db.db_path) as db:
-            async with db.execute("SELECT COUNT(*) FROM users WHERE sect_id = ?", (sect['sect_id'],)) as count_cursor:
-                count_row = await count_cursor.fetchone()
-                member_count = count_row[0] if count_row else 0
+        member_count = await self.db.count_sect_members(sect['sect_id'])
 
         embed = txa_embed(f"⛩️ Tông Môn: {sect['name']}", sect.get('description', "Dấu tích cổ xưa."), discord.Color.gold())
         embed.add_field(name="👑 Tông Chủ", value=f"<@{sect['leader_id']}>", inline=True)
@@ -222,15 +206,11 @@ class Sects(commands.Cog):
         if existing_sect:
             return await interaction.followup.send(embed=txa_embed("🚫 Nhất Tâm Bất Nhị Dụng", f"Đã là đệ tử của **{existing_sect['name']}**, sao còn đứng núi này trông núi nọ?", discord.Color.red()))
 
-        async with self.db.aiosqlite.connect(self.db.db_path) as db:
-            db.row_factory = self.db.aiosqlite.Row
-            async with db.execute("SELECT * FROM sects WHERE name = ?", (name,)) as cursor:
-                row = await cursor.fetchone()
-                if not row: return await interaction.followup.send("❌ Tông môn hư ảo, không tồn tại.")
-                sect = dict(row)
-            
-            # Update user's sect_id and reset missions
-            await self.db.update_user(uid, sect_id=sect['sect_id'], missions=[])
+        sect = await self.db.get_sect_by_name(name)
+        if not sect: return await interaction.followup.send("❌ Tông môn hư ảo, không tồn tại.")
+
+        # Update user's sect_id and reset missions
+        await self.db.update_user(uid, sect_id=sect['sect_id'], missions=[])
             
         await interaction.followup.send(embed=txa_embed("✅ Bái Sư Thành Công", f"Chúc mừng đạo hữu gia nhập **{name}**!\nHãy cống hiến hết mình cho tông môn!", discord.Color.green()))
         rainbow_log(f"🤝 [Sect] {interaction.user.name} gia nhập tông môn: {name}")
@@ -258,17 +238,13 @@ class Sects(commands.Cog):
             return await interaction.followup.send("⚠️ Không thể tự truyền ngôi cho chính mình.")
 
         # Verify member is in sect
-        async with self.db.aiosqlite.connect(self.db.db_path) as db:
-            db.row_factory = self.db.aiosqlite.Row
-            async with db.execute("SELECT * FROM users WHERE user_id = ? AND sect_id = ?", (member_id, sect['sect_id'])) as cursor:
-                target_user = await cursor.fetchone()
-                
-            if not target_user:
-                return await interaction.followup.send(f"❌ Kẻ này (`{member_id}`) không phải đệ tử trong tông.")
+        target_user = await self.db.get_user(member_id, children=False)
+
+        if not target_user or target_user.get('sect_id') != sect['sect_id']:
+            return await interaction.followup.send(f"❌ Kẻ này (`{member_id}`) không phải đệ tử trong tông.")
 
-            # Transfer
-            await db.execute("UPDATE sects SET leader_id = ? WHERE sect_id = ?", (member_id, sect['sect_id']))
-            await db.commit()
+        # Transfer
+        await self.db.set_sect_leader(sect['sect_id'], member_id)
             
         await interaction.followup.send(embed=txa_embed("👑 Truyền Ngôi", f"Ngai vị Tông Chủ của **{sect['name']}** đã được truyền lại cho <@{member_id}>!", discord.Color.gold()))
         rainbow_log(f"👑 [Sect] {interaction.user.name} truyền ngôi tông chủ {sect['name']} cho {member_id}")
@@ -295,12 +271,8 @@ class Sects(commands.Cog):
         
         # Nếu là tông chủ
         if sect['leader_id'] == uid:
-            async with self.db.aiosqlite.connect(self.db.db_path) as db:
-                db.row_factory = self.db.aiosqlite.Row
-                # Lấy danh sách thành viên khác (không bao gồm tông chủ)
-                async with db.execute("SELECT user_id FROM users WHERE sect_id = ? AND user_id != ?", (sect['sect_id'], uid)) as cursor:
-                    rows = await cursor.fetchall()
-                    members = [r['user_id'] for r in rows]
+            # Lấy danh sách thành viên khác (không bao gồm tông chủ)
+            members = [m['user_id'] for m in await self.db.get_sect_members(sect['sect_id'], exclude_user=uid)]
             
             if not members:
                  return await interaction.followup.send(embed=txa_embed("🚫 Tông Chủ Đơn Độc", "Tông môn chỉ còn mỗi ngươi. Hãy dùng `/sect_delete` để giải tán (Cần Admin) hoặc tìm người gia nhập để truyền ngôi.", discord.Color.red()))
@@ -309,9 +281,7 @@ class Sects(commands.Cog):
             new_leader_id = random.choice(members)
             
             # Update DB: Đổi leader và set sect_id của user hiện tại về NULL
-            async with self.db.aiosqlite.connect(self.db.db_path) as db:
-                await db.execute("UPDATE sects SET leader_id = ? WHERE sect_id = ?", (new_leader_id, sect['sect_id']))
-                await db.commit()
+            await self.db.set_sect_leader(sect['sect_id'], new_leader_id)
             
             await self.db.update_user(uid, sect_id=None)
             
@@ -407,9 +377,11 @@ class Sects(commands.Cog):
             return await interaction.response.send_message("🚫 Chỉ có Thiên Đạo (Admin) mới có quyền này!", ephemeral=True)
         
         await interaction.response.defer(ephemeral=True)
-        async with self.db.aiosqlite.connect(self.db.db_path) as db:
-            await db.execute("DELETE FROM sects WHERE name = ?", (name,))
-            await db.commit()
+        sect = await self.db.get_sect_by_name(name)
+        if not sect:
+            return await interaction.followup.send("❌ Tông môn hư ảo, không tồn tại.")
+        # Xóa tông và trả các đệ tử về tán tu
+        await self.db.delete_sect(sect['sect_id'])
         
         await interaction.followup.send(embed=txa_embed("🔥 Diệt Môn", f"Tông môn **{name}** đã bị xóa sổ khỏi thế gian!", discord.Color.dark_red()))
         asyncio.create_task(self.update_sect_list_displays())
@@ -0,0 +1,188 @@
+"""
+Sao lưu nóng data/tu_tien.db bằng SQLite online backup API.
+Chạy: python -m core.backup {backup|list|prune|restore <file>} [--db ...] [--dir ...]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import time
+from datetime import datetime
+from core.database import Database, DB_PATH
+from core.schema import run_migrations
+from core.helpers import rainbow_log
+
+BACKUP_DIR = os.getenv("DB_BACKUP_DIR", "data/backups")
+BACKUP_INTERVAL_MINUTES = float(os.getenv("DB_BACKUP_INTERVAL_MINUTES", "60"))  # 0 = tắt task nền
+BACKUP_KEEP = int(os.getenv("DB_BACKUP_KEEP", "24"))
+BACKUP_MAX_AGE_DAYS = float(os.getenv("DB_BACKUP_MAX_AGE_DAYS", "7"))
+# Mỗi bước chép bao nhiêu trang rồi nhả khóa đọc, nghỉ bao lâu giữa các bước
+BACKUP_PAGES_PER_STEP = int(os.getenv("DB_BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP = 0.005
+# Nguồn bị ghi liên tục làm backup chép lại từ đầu quá số lần này -> chuyển sang chép một lượt
+BACKUP_MAX_RESTARTS = 3
+
+class _TooManyRestarts(Exception):
+    pass
+
+def _copy_database(src_path, dst_path, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    """Chép src -> dst bằng backup API (chạy trong thread), trả về số lần phải chép lại"""
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        # remaining tăng lại nghĩa là nguồn vừa bị ghi và SQLite chép lại từ đầu
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS: raise _TooManyRestarts()
+        last_remaining = remaining
+
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.execute("PRAGMA busy_timeout = 5000")
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+        except _TooManyRestarts:
+            # WAL: chép một lượt trong cùng transaction đọc, người ghi vẫn không bị chặn
+            src.backup(dst, pages=-1)
+    finally:
+        dst.close()
+        src.close()
+    return restarts
+
+def list_backups(dest_dir=BACKUP_DIR):
+    """Danh sách bản sao lưu, mới nhất trước: [(path, mtime, size)]"""
+    if not os.path.isdir(dest_dir): return []
+    res = []
+    for name in os.listdir(dest_dir):
+        if name.endswith(".db"):
+            path = os.path.join(dest_dir, name)
+            st = os.stat(path)
+            res.append((path, st.st_mtime, st.st_size))
+    return sorted(res, key=lambda x: x[1], reverse=True)
+
+def prune_backups(dest_dir=BACKUP_DIR, keep=BACKUP_KEEP, max_age_days=BACKUP_MAX_AGE_DAYS):
+    """Xóa bản cũ hơn max_age_days hoặc vượt quá keep bản (luôn giữ bản mới nhất)"""
+    removed = []
+    cutoff = time.time() - max_age_days * 86400
+    for i, (path, mtime, _) in enumerate(list_backups(dest_dir)):
+        if i == 0: continue
+        if i >= keep or mtime < cutoff:
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+async def backup_database(db_path=DB_PATH, dest_dir=BACKUP_DIR, label="", prune=True):
+    """Chụp snapshot nhất quán của DB đang chạy, trả về dict thống kê"""
+    os.makedirs(dest_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    name = f"{os.path.splitext(os.path.basename(db_path))[0]}-{stamp}{'-' + label if label else ''}.db"
+    final = os.path.join(dest_dir, name)
+    tmp = final + ".tmp"
+
+    started = time.perf_counter()
+    try:
+        copy = asyncio.ensure_future(asyncio.to_thread(_copy_database, db_path, tmp))
+        try:
+            restarts = await asyncio.shield(copy)
+        except asyncio.CancelledError:
+            # Thread chép không hủy được: chờ nó xong rồi mới dọn file tạm / để DB đóng
+            await asyncio.wait([copy])
+            raise
+        os.replace(tmp, final)  # Chỉ xuất hiện file .db khi đã chép xong
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(final)
+    stats = {
+        "path": final,
+        "size": size,
+        "seconds": elapsed,
+        "mb_per_s": size / 1048576 / max(elapsed, 1e-6),
+        "restarts": restarts,
+        "pruned": prune_backups(dest_dir) if prune else [],
+    }
+    rainbow_log(f"💾 [Backup] {name}: {size / 1048576:.2f} MB trong {elapsed:.2f}s ({stats['mb_per_s']:.1f} MB/s, chép lại {restarts} lần).")
+    return stats
+
+async def restore_database(db: Database, backup_path):
+    """
+    Khôi phục DB đang chạy từ một bản sao lưu: chụp bản an toàn trước, giữ khóa ghi của pool
+    trong lúc chép một lượt (người đọc thấy trọn bản cũ hoặc trọn bản mới), chạy migration
+    rồi báo cho các index trong RAM (Storage.add_restore_listener) nạp lại.
+    """
+    if not os.path.exists(backup_path):
+        raise FileNotFoundError(backup_path)
+    safety = await backup_database(db.db_path, os.path.dirname(backup_path) or BACKUP_DIR, label="truoc-khoi-phuc", prune=False)
+    await db.flush()
+    async with db.pool.exclusive():
+        await asyncio.to_thread(_copy_database, backup_path, db.db_path, -1, 0)
+    db.cache.invalidate()
+    await run_migrations(db)
+    await db.notify_restored()  # Bảng xếp hạng, hẹn giờ nhiệm vụ... nạp lại từ dữ liệu mới
+    rainbow_log(f"♻️ [Backup] Đã khôi phục {db.db_path} từ {backup_path}.")
+    return safety
+
+class BackupService:
+    """Task nền chụp snapshot định kỳ"""
+
+    def __init__(self, db: Database, interval_minutes=BACKUP_INTERVAL_MINUTES, dest_dir=BACKUP_DIR):
+        self.db = db
+        self.interval = interval_minutes * 60
+        self.dest_dir = dest_dir
+        self.last = None
+        self._task = None
+
+    def start(self):
+        if self.interval <= 0 or self._task: return
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Hủy task sao lưu và chờ nó dừng hẳn: bản chép đang chạy xong trước khi bot đóng DB"""
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            try: await task
+            except asyncio.CancelledError: pass
+
+    async def run_once(self, label=""):
+        self.last = await backup_database(self.db.db_path, self.dest_dir, label)
+        return self.last
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                rainbow_log(f"⚠️ [Backup] Sao lưu định kỳ thất bại: {e}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Sao lưu / khôi phục Thiên Thư (SQLite)")
+    parser.add_argument("action", choices=["backup", "list", "prune", "restore"])
+    parser.add_argument("file", nargs="?", help="Bản sao lưu cần khôi phục")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--dir", default=BACKUP_DIR)
+    args = parser.parse_args()
+
+    if args.action == "backup":
+        await backup_database(args.db, args.dir)
+    elif args.action == "list":
+        for path, mtime, size in list_backups(args.dir):
+            print(f"{datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M:%S}  {size / 1048576:8.2f} MB  {path}")
+    elif args.action == "prune":
+        for path in prune_backups(args.dir):
+            print(f"Đã xóa {path}")
+    elif args.action == "restore":
+        if not args.file: parser.error("restore cần đường dẫn bản sao lưu")
+        db = Database(args.db)
+        await db.initialize()
+        try:
+            await restore_database(db, args.file)
+        finally:
+            await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
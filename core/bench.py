@@ -0,0 +1,219 @@
+"""
+Benchmark tầng lưu trữ với dữ liệu giả (không cần Discord).
+Chạy: python -m core.bench [--sizes 1000 100000] [--with-1m] [--backend sqlite|memory] [--out file.json]
+Mỗi kích thước được seed vào một DB mới trong thư mục tạm, đo ops/s và độ trễ p50/p95/p99
+của từng workload dưới tải asyncio đồng thời, rồi ghi kết quả ra JSON để so sánh giữa các lần đổi storage.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from core.database import Database, UserCache
+from core.storage import MemoryStorage, USER_DEFAULTS
+from core.helpers import rainbow_log
+
+DEFAULT_SIZES = (1000, 100000)
+SEED_BATCH = 20000
+ITEM_IDS = ("dan_duoc", "kiem_ri_set", "linh_thao", "bua_ho_menh")
+
+def _fake_user(i, rng, sect_count):
+    layer = rng.randint(1, 120)
+    return {
+        "user_id": str(100000000000000000 + i),
+        "name": f"Đệ tử {i}",
+        "layer": layer,
+        "exp": rng.randint(0, layer * 1000),
+        "goal": max(layer * 1000, 200),
+        "spirit_stones": rng.randint(0, 50000),
+        "daily_streak": rng.randint(0, 30),
+        "sect_id": rng.randint(1, sect_count) if rng.random() < 0.6 else None,
+    }
+
+async def _seed_sqlite(db: Database, size, rng, sect_count):
+    cols = ("user_id", "name", "layer", "exp", "goal", "spirit_stones", "daily_streak", "sect_id")
+    async with db.write(invalidate=False) as conn:
+        await conn.executemany(
+            "INSERT INTO sects (sect_id, name, leader_id, exp) VALUES (?, ?, ?, ?)",
+            [(s, f"Tông {s}", str(100000000000000000 + s), rng.randint(0, 100000)) for s in range(1, sect_count + 1)]
+        )
+    for start in range(0, size, SEED_BATCH):
+        users, items = [], []
+        for i in range(start, min(size, start + SEED_BATCH)):
+            u = _fake_user(i, rng, sect_count)
+            users.append(tuple(u[c] for c in cols))
+            if rng.random() < 0.2:
+                for item_id in rng.sample(ITEM_IDS, rng.randint(1, 3)):
+                    items.append((u['user_id'], item_id, rng.randint(1, 5), 0))
+        async with db.write(invalidate=False) as conn:
+            await conn.executemany(f"INSERT INTO users ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", users)
+            await conn.executemany("INSERT INTO user_items (user_id, item_id, count, expiry) VALUES (?, ?, ?, ?)", items)
+
+async def _seed_memory(db: MemoryStorage, size, rng, sect_count):
+    for s in range(1, sect_count + 1):
+        await db.create_sect(f"Tông {s}", str(100000000000000000 + s))
+    for i in range(size):
+        u = _fake_user(i, rng, sect_count)
+        db._users[u['user_id']] = {"user_id": u['user_id'], **USER_DEFAULTS, **u}
+        if rng.random() < 0.2:
+            for item_id in rng.sample(ITEM_IDS, rng.randint(1, 3)):
+                await db.add_item(u['user_id'], item_id, rng.randint(1, 5))
+
+def _percentile(sorted_ms, q):
+    if not sorted_ms: return 0.0
+    return sorted_ms[min(len(sorted_ms) - 1, int(q * len(sorted_ms)))]
+
+async def _run_workload(op, ops, concurrency, rng):
+    """Chạy `ops` lần op(rng) với `concurrency` worker, trả về thống kê độ trễ"""
+    latencies = []
+    remaining = ops
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            await op(rng)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, ops))))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "seconds": round(elapsed, 4),
+        "ops_per_s": round(len(latencies) / max(elapsed, 1e-9), 1),
+        "p50_ms": round(_percentile(latencies, 0.50), 3),
+        "p95_ms": round(_percentile(latencies, 0.95), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+    }
+
+def _workloads(db, size, sect_count, ops):
+    """(tên, op, số lần chạy) - get_all_users đọc cả bảng nên chạy ít lần"""
+    def uid(rng): return str(100000000000000000 + rng.randrange(size))
+
+    async def get_user(rng):
+        await db.get_user(uid(rng))
+
+    async def update_user(rng):
+        await db.update_user(uid(rng), name=f"Đệ tử {rng.randrange(1 << 30)}")
+
+    async def get_top_users(rng):
+        await db.get_top_users(10)
+
+    async def get_all_users(rng):
+        await db.get_all_users()
+
+    async def sect_members(rng):
+        await db.get_sect_members(rng.randint(1, sect_count))
+
+    async def reward_rmw(rng):
+        # Mẫu phát thưởng của cog: đọc user -> cộng delta -> đột phá nếu đủ EXP
+        user_id = uid(rng)
+        user = await db.get_user(user_id)
+        if not user: return
+        user = await db.apply_delta(user_id, reason='bench', exp=rng.randint(50, 500), daily_exp=100, spirit_stones=rng.randint(5, 15))
+        if user['exp'] >= user['goal']:
+            await db.apply_delta(user_id, assign={'goal': (user['layer'] + 1) * 1000}, exp=-user['goal'], layer=1)
+
+    return [
+        ("get_user", get_user, ops),
+        ("update_user", update_user, ops),
+        ("get_top_users", get_top_users, ops),
+        ("get_all_users", get_all_users, max(1, min(ops, 200000 // size))),
+        ("sect_members", sect_members, max(1, ops // 10)),
+        ("reward_rmw", reward_rmw, ops),
+    ]
+
+async def bench_size(backend, size, ops, concurrency, seed, workdir, no_cache=False):
+    rng = random.Random(seed)
+    sect_count = max(1, size // 100)
+    if backend == "memory":
+        db = MemoryStorage()
+    else:
+        db = Database(os.path.join(workdir, f"bench-{size}.db"))
+        if no_cache: db.cache = UserCache(max_size=0)
+    await db.initialize()
+    results = []
+    try:
+        started = time.perf_counter()
+        if backend == "memory":
+            await _seed_memory(db, size, rng, sect_count)
+        else:
+            await _seed_sqlite(db, size, rng, sect_count)
+        seed_s = time.perf_counter() - started
+        rainbow_log(f"🌱 [Bench] Seed {size:,} đệ tử / {sect_count:,} tông môn ({backend}) trong {seed_s:.1f}s")
+
+        for name, op, n in _workloads(db, size, sect_count, ops):
+            stats = await _run_workload(op, n, concurrency, rng)
+            await db.flush()
+            results.append({"backend": backend, "users": size, "workload": name, "concurrency": concurrency, **stats})
+            rainbow_log(
+                f"   ⏱️ {name:<14} {stats['ops_per_s']:>10,.1f} ops/s | p50 {stats['p50_ms']:.3f}ms "
+                f"p95 {stats['p95_ms']:.3f}ms p99 {stats['p99_ms']:.3f}ms"
+            )
+    finally:
+        await db.close()
+    return seed_s, results
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark tầng lưu trữ Thiên Lam Tông")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Số đệ tử cần seed")
+    parser.add_argument("--with-1m", action="store_true", help="Thêm bộ 1.000.000 đệ tử (chậm)")
+    parser.add_argument("--backend", choices=["sqlite", "memory"], default="sqlite")
+    parser.add_argument("--ops", type=int, default=2000, help="Số thao tác mỗi workload")
+    parser.add_argument("--concurrency", type=int, default=32, help="Số task asyncio chạy song song")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-cache", action="store_true", help="Tắt cache đệ tử (đo thẳng SQLite)")
+    parser.add_argument("--dir", default=None, help="Thư mục chứa DB seed (mặc định: thư mục tạm, xóa sau khi chạy)")
+    parser.add_argument("--out", default=None, help="File JSON kết quả")
+    args = parser.parse_args()
+
+    sizes = list(args.sizes) + ([1000000] if args.with_1m and 1000000 not in args.sizes else [])
+    workdir = args.dir or tempfile.mkdtemp(prefix="txa-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        "meta": {
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "backend": args.backend,
+            "ops": args.ops,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "user_cache": not args.no_cache,
+        },
+        "seed_seconds": {},
+        "results": [],
+    }
+    try:
+        for size in sizes:
+            seed_s, results = await bench_size(args.backend, size, args.ops, args.concurrency, args.seed, workdir, args.no_cache)
+            report["seed_seconds"][str(size)] = round(seed_s, 3)
+            report["results"].extend(results)
+    finally:
+        if not args.dir: shutil.rmtree(workdir, ignore_errors=True)
+
+    out = args.out or f"bench-{args.backend}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    rainbow_log(f"📄 [Bench] Đã ghi kết quả vào {out}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -140,7 +140,7 @@ class CombatSystem:
             stones_win *= 3
         
         # Update Database
-        await self.bot.db.update_user(str(winner.id), spirit_stones=winner_data['spirit_stones'] + stones_win)
+        await self.bot.db.apply_delta(str(winner.id), reason='combat', spirit_stones=stones_win)
         rainbow_log(f"🏆 [Combat] {winner.display_name} thắng! Nhận {stones_win} 💎. Sau {self.turn} hiệp.")
         
         final_embed = txa_embed(
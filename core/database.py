@@ -1,169 +1,964 @@
 import aiosqlite
+import asyncio
+import copy
 import json
 import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from core.helpers import rainbow_log
+from core.metrics import metrics, instrument, TimedConnection
+from core.schema import run_migrations
+from core.progression import batch_level_up, level_up as calc_level_up
+from core.storage import Storage, USER_DEFAULTS, USER_COLUMNS, DELTA_COLUMNS, CHILD_FIELDS, check_user_columns, pick_pool_rows, ledger_entry, ledger_day, DAILY_RESET_STATE
+from core.lucky_draw import LUCKY_ALIAS_STATE, alias_rows, pick_winners
 
 DB_PATH = "data/tu_tien.db"
+READ_POOL_SIZE = 4
 
-class Database:
-    def __init__(self):
-        self.db_path = DB_PATH
+# Write-behind (opt-in qua DB_WRITE_BEHIND=1): gom update_user theo user rồi ghi một lượt
+WRITE_BEHIND_INTERVAL = float(os.getenv("DB_WRITE_BEHIND_INTERVAL", "0.5"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("DB_WRITE_BEHIND_MAX_PENDING", "200"))
 
-    async def initialize(self):
-        os.makedirs("data", exist_ok=True)
-        async with aiosqlite.connect(self.db_path) as db:
-            # Table for users
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id TEXT PRIMARY KEY,
-                    name TEXT,
-                    layer INTEGER DEFAULT 1,
-                    exp INTEGER DEFAULT 0,
-                    goal INTEGER DEFAULT 200,
-                    last_mission_reset REAL DEFAULT 0,
-                    missions_completed INTEGER DEFAULT 0,
-                    last_daily REAL DEFAULT 0,
-                    last_daily_date TEXT,
-                    daily_streak INTEGER DEFAULT 0,
-                    spirit_stones INTEGER DEFAULT 0,
-                    inventory TEXT DEFAULT '[]',
-                    missions TEXT DEFAULT '[]',
-                    current_mission TEXT DEFAULT NULL,
-                    sect_id INTEGER DEFAULT NULL,
-                    daily_exp INTEGER DEFAULT 0,
-                    last_daily_exp_reset REAL DEFAULT 0,
-                    buffs TEXT DEFAULT '{}'
-                )
-            """)
-            
-            # Migration check: Add sect_id if not exists
-            try:
-                await db.execute("ALTER TABLE users ADD COLUMN sect_id INTEGER DEFAULT NULL")
-            except: pass
-            
-            # Migration check: Add daily_exp stats
-            try:
-                await db.execute("ALTER TABLE users ADD COLUMN daily_exp INTEGER DEFAULT 0")
-                await db.execute("ALTER TABLE users ADD COLUMN last_daily_exp_reset REAL DEFAULT 0")
-            except: pass
+# Cache user đã parse trong RAM (LRU + TTL), DB_USER_CACHE_SIZE=0 để tắt
+USER_CACHE_SIZE = int(os.getenv("DB_USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("DB_USER_CACHE_TTL", "30"))
+
+# Ledger: gom dòng trong RAM, ghi kèm transaction ghi kế tiếp hoặc khi task xả chạy
+LEDGER_MAX_PENDING = int(os.getenv("DB_LEDGER_MAX_PENDING", "500"))
+LEDGER_INSERT_SQL = "INSERT INTO ledger (user_id, ts, reason, exp, spirit_stones) VALUES (?, ?, ?, ?, ?)"
+# 25200 = UTC+7, khớp với ledger_day()
+LEDGER_COMPACT_SQL = """
+    INSERT INTO ledger_daily (day, user_id, reason, exp, spirit_stones, entries)
+    SELECT date(ts + 25200, 'unixepoch'), user_id, reason, SUM(exp), SUM(spirit_stones), COUNT(*)
+    FROM ledger WHERE ts < ? GROUP BY 1, 2, 3
+    ON CONFLICT(day, user_id, reason) DO UPDATE SET
+        exp = exp + excluded.exp, spirit_stones = spirit_stones + excluded.spirit_stones, entries = entries + excluded.entries
+"""
+
+MISSION_INSERT_SQL = (
+    "INSERT OR REPLACE INTO user_missions (user_id, mission_id, title, description, difficulty, time, reward, stones, success_rate, done, retry_time, end_time) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# Câu lệnh dùng chung với core/query_plans.py để EXPLAIN đúng câu bot chạy.
+# Phần trong {} do hàm gọi ghép: {assignments} = "cột = ?, ...", {marks} = "?, ?, ...", {cond}/{where} = điều kiện lọc
+USER_SELECT_SQL = "SELECT * FROM users WHERE user_id = ?"
+USER_INSERT_SQL = "INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)"
+USER_UPDATE_SQL = "UPDATE users SET {assignments} WHERE user_id = ?"
+USER_DELTA_SQL = "UPDATE users SET {assignments} WHERE user_id = ? RETURNING *"
+USER_LEVEL_SQL = "UPDATE users SET layer = ?, exp = ?, goal = ? WHERE user_id = ?"
+TOP_USERS_SQL = "SELECT * FROM users ORDER BY layer DESC, exp DESC LIMIT ?"
+ALL_USERS_SQL = "SELECT * FROM users"
+ITER_USERS_SQL = "SELECT {columns} FROM users WHERE user_id > ?{cond} ORDER BY user_id LIMIT ?"
+COUNT_USERS_SQL = "SELECT COUNT(*) FROM users{cond}"
+LEVEL_UP_SWEEP_SQL = "SELECT user_id, layer, exp, goal FROM users WHERE exp >= goal"
+
+ITEMS_OF_USER_SQL = "SELECT * FROM user_items WHERE user_id = ? ORDER BY item_id"
+ITEMS_OF_USERS_SQL = "SELECT * FROM user_items WHERE user_id IN ({marks}) ORDER BY user_id, item_id"
+MISSIONS_OF_USERS_SQL = "SELECT * FROM user_missions WHERE user_id IN ({marks}) ORDER BY user_id, mission_id"
+BUFFS_OF_USERS_SQL = "SELECT * FROM user_buffs WHERE user_id IN ({marks})"
+ITEM_ADD_SQL = (
+    "INSERT INTO user_items (user_id, item_id, count, expiry) VALUES (?, ?, ?, 0) "
+    "ON CONFLICT(user_id, item_id) DO UPDATE SET count = count + excluded.count"
+)
+ITEM_SET_SQL = "INSERT OR REPLACE INTO user_items (user_id, item_id, count, expiry) VALUES (?, ?, ?, ?)"
+BUY_DEBIT_SQL = "UPDATE users SET spirit_stones = spirit_stones - ? WHERE user_id = ? AND spirit_stones >= ? RETURNING spirit_stones"
+ITEM_CONSUME_SQL = (
+    "UPDATE user_items SET count = count - 1, "
+    "expiry = CASE WHEN ? > 0 THEN MAX(expiry, ?) + ? ELSE expiry END "
+    "WHERE user_id = ? AND item_id = ? AND count > 0 RETURNING *"
+)
+ITEM_PRUNE_SQL = "DELETE FROM user_items WHERE user_id = ? AND count <= 0 AND expiry <= ?"
+ITEM_EXPIRE_SQL = "UPDATE user_items SET expiry = 0 WHERE user_id = ? AND expiry > 0 AND expiry <= ?"
+MISSION_UPDATE_SQL = "UPDATE user_missions SET {assignments} WHERE user_id = ? AND mission_id = ?"
+MISSION_CLEAR_SQL = "UPDATE user_missions SET end_time = NULL WHERE user_id = ? AND end_time IS NOT NULL"
+MISSION_CLAIM_SQL = "UPDATE user_missions SET end_time = NULL WHERE user_id = ? AND mission_id = ? AND end_time IS NOT NULL"
+MISSION_TIMERS_SQL = "SELECT user_id, mission_id, end_time FROM user_missions WHERE end_time IS NOT NULL"
+BUFF_SET_SQL = "INSERT OR REPLACE INTO user_buffs (user_id, buff_id, expiry) VALUES (?, ?, ?)"
+
+DAILY_RESET_MISSIONS_SQL = (
+    "DELETE FROM user_missions WHERE end_time IS NULL "
+    "AND user_id IN (SELECT user_id FROM users WHERE last_mission_reset < ?)"
+)
+DAILY_RESET_USERS_SQL = (
+    "UPDATE users SET daily_exp = 0, missions_completed = 0, last_daily_exp_reset = ?, last_mission_reset = ? "
+    "WHERE last_daily_exp_reset < ? OR last_mission_reset < ?"
+)
+
+LEDGER_SUMMARY_SQL = "SELECT reason, SUM(exp), SUM(spirit_stones), COUNT(*) FROM ledger {where} GROUP BY reason"
+LEDGER_DAILY_SUMMARY_SQL = "SELECT reason, SUM(exp), SUM(spirit_stones), SUM(entries) FROM ledger_daily {where} GROUP BY reason"
+LEDGER_PURGE_SQL = "DELETE FROM ledger WHERE ts < ?"
+
+POOL_COUNTS_SQL = "SELECT tier, COUNT(*) FROM mission_pool GROUP BY tier"
+POOL_CANDIDATES_SQL = (
+    "SELECT id AS pool_id, tier, title, description, difficulty, time, reward, uses FROM mission_pool "
+    "WHERE tier = ? AND id NOT IN (SELECT pool_id FROM mission_seen WHERE user_id = ?)"
+)
+POOL_USE_SQL = "UPDATE mission_pool SET uses = uses + 1 WHERE id = ?"
+POOL_SEEN_PRUNE_SQL = "DELETE FROM mission_seen WHERE ts < ?"
+
+LUCKY_WEIGHTS_SQL = "SELECT user_id, {weight} FROM users"
+LUCKY_SLOTS_SQL = "SELECT slot, user_id, prob, alias_id FROM lucky_alias WHERE slot IN ({marks})"
+LUCKY_GRANT_SQL = (
+    "INSERT OR REPLACE INTO user_buffs (user_id, buff_id, expiry) "
+    "SELECT user_id, ?, ? FROM users WHERE user_id IN ({marks}) RETURNING user_id"
+)
+
+ALL_SECTS_SQL = "SELECT * FROM sects ORDER BY exp DESC"
+SECT_WHERE_SQL = "SELECT * FROM sects WHERE {cond}"
+SECT_INSERT_SQL = "INSERT INTO sects (name, leader_id) VALUES (?, ?)"
+SECT_UPDATE_SQL = "UPDATE sects SET {assignments} WHERE sect_id = ?"
+SECT_ADD_EXP_SQL = "UPDATE sects SET exp = exp + ? WHERE sect_id = ?"
+SECT_DELETE_SQL = "DELETE FROM sects WHERE sect_id = ?"
+SECT_RELEASE_MEMBERS_SQL = "UPDATE users SET sect_id = NULL WHERE sect_id = ?"
+SECT_MEMBERS_SQL = "SELECT user_id, name FROM users WHERE sect_id = ? AND user_id IS NOT ?"
+SECT_COUNT_MEMBERS_SQL = "SELECT COUNT(*) FROM users WHERE sect_id = ?"
+
+# Pragma áp dụng cho mọi kết nối (WAL: đọc không chặn ghi, ghi không chặn đọc)
+CONNECTION_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+class ConnectionPool:
+    """Giữ kết nối SQLite lâu dài: 1 kết nối ghi (tuần tự) + vài kết nối chỉ đọc"""
 
-            # Migration check: Add buffs to users
+    def __init__(self, db_path: str, read_size: int = READ_POOL_SIZE):
+        self.db_path = db_path
+        self.read_size = read_size
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        self._all = []
+
+    async def _connect(self, read_only=False):
+        # isolation_level=None: tự quản lý transaction bằng BEGIN/COMMIT
+        conn = await aiosqlite.connect(self.db_path, isolation_level=None)
+        conn.row_factory = aiosqlite.Row
+        # execute_fetchall: đọc hết kết quả để statement không giữ khóa
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute_fetchall(pragma)
+        if read_only:
+            await conn.execute_fetchall("PRAGMA query_only = ON")
+        self._all.append(conn)
+        return conn
+
+    async def open(self):
+        if self._writer: return
+        self._writer = await self._connect()
+        # WAL là thuộc tính của file DB, chỉ cần đặt một lần từ kết nối ghi
+        await self._writer.execute_fetchall("PRAGMA journal_mode = WAL")
+        for _ in range(self.read_size):
+            self._readers.put_nowait(await self._connect(read_only=True))
+
+    async def close(self):
+        if not self._writer: return
+        async with self._write_lock:
+            for conn in self._all:
+                try: await conn.close()
+                except Exception: pass
+            self._all.clear()
+            self._writer = None
+            self._readers = asyncio.Queue()
+
+    @asynccontextmanager
+    async def read(self):
+        """Mượn một kết nối đọc trong pool"""
+        conn = await self._readers.get()
+        try:
+            yield TimedConnection(conn) if metrics.enabled else conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def exclusive(self):
+        """Giữ khóa ghi mà không mở transaction (dùng khi chép đè cả file DB, ví dụ khôi phục backup)"""
+        async with self._write_lock:
+            yield self._writer
+
+    @asynccontextmanager
+    async def write(self):
+        """Kết nối ghi duy nhất, mỗi khối là một transaction (tự rollback khi lỗi)"""
+        async with self._write_lock:
+            await self._writer.execute("BEGIN IMMEDIATE")
             try:
-                await db.execute("ALTER TABLE users ADD COLUMN buffs TEXT DEFAULT '{}'")
-            except: pass
-
-            # Table for sects (Updated)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS sects (
-                    sect_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT UNIQUE,
-                    leader_id TEXT,
-                    level INTEGER DEFAULT 1,
-                    exp INTEGER DEFAULT 0,
-                    description TEXT,
-                    kung_fu TEXT DEFAULT '[]'
-                )
-            """)
+                yield TimedConnection(self._writer) if metrics.enabled else self._writer
+            except BaseException:
+                await self._writer.execute("ROLLBACK")
+                raise
+            else:
+                await self._writer.execute("COMMIT")
+
+class UserCache:
+    """LRU có TTL cho dict user; mọi đường ghi phải gọi invalidate"""
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # user_id -> (hết hạn lúc, dict user)
+        # Tăng mỗi lần invalidate: bản đọc bắt đầu trước một lần ghi sẽ không được cache
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None: del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def put(self, key, value, generation=None):
+        if self.max_size <= 0: return
+        if generation is not None and generation != self.generation: return
+        self._data[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Xóa một user, hoặc toàn bộ cache nếu key=None"""
+        self.generation += 1
+        if key is None: self._data.clear()
+        else: self._data.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+@instrument
+class Database(Storage):
+    """Backend SQLite (mặc định) của Storage, mọi method public được đo bởi core.metrics"""
+
+    def __init__(self, db_path: str = DB_PATH, write_behind: bool = None):
+        self.db_path = db_path
+        self.pool = ConnectionPool(self.db_path)
+        if write_behind is None:
+            write_behind = os.getenv("DB_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+        self.write_behind = write_behind
+        self._pending = {}   # user_id -> {column: giá trị đã serialize}
+        self._flushing = {}  # Đang ghi dở trong transaction, vẫn phải hiện ra khi đọc
+        self._flush_event = asyncio.Event()
+        self._flush_task = None
+        self._ledger = []    # Dòng ledger chờ ghi
+        self.cache = UserCache()
 
-            # Migration check: Add kung_fu to sects
+    def read(self):
+        return self.pool.read()
+
+    @asynccontextmanager
+    async def write(self, invalidate=True):
+        """
+        Transaction ghi; luôn xả hàng đợi write-behind trước để giữ đúng thứ tự ghi.
+        invalidate: user_id cần xóa khỏi cache, True = xóa hết (mặc định cho SQL tự viết ở cog), False = không đụng users.
+        """
+        drained, ledger = {}, []
+        try:
+            async with self.pool.write() as db:
+                drained = await self._drain_pending(db)
+                ledger = await self._drain_ledger(db)
+                yield db
+        except BaseException:
+            self._restore_pending(drained)
+            self._ledger[:0] = ledger
+            raise
+        finally:
+            self._flushing = {}
+            if invalidate is True: self.cache.invalidate()
+            elif invalidate: self.cache.invalidate(invalidate)
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def metrics_snapshot(self):
+        return metrics.snapshot() if metrics.enabled else None
+
+    async def _drain_pending(self, db):
+        if not self._pending: return {}
+        drained, self._pending = self._pending, {}
+        self._flushing = drained
+        # Gom các user có cùng tập cột để ghi bằng một executemany
+        groups = {}
+        for user_id, cols in drained.items():
+            keys = tuple(sorted(cols))
+            groups.setdefault(keys, []).append(tuple(cols[k] for k in keys) + (user_id,))
+        for keys, rows in groups.items():
+            assignments = ", ".join(f"{k} = ?" for k in keys)
+            await db.executemany(USER_UPDATE_SQL.format(assignments=assignments), rows)
+        return drained
+
+    async def _drain_ledger(self, db):
+        if not self._ledger: return []
+        ledger, self._ledger = self._ledger, []
+        await db.executemany(LEDGER_INSERT_SQL, ledger)
+        return ledger
+
+    def _restore_pending(self, drained):
+        # Transaction lỗi: trả lại hàng đợi, giá trị mới hơn (nếu có) được ưu tiên
+        for user_id, cols in drained.items():
+            self._pending[user_id] = {**cols, **self._pending.get(user_id, {})}
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=WRITE_BEHIND_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
             try:
-                await db.execute("ALTER TABLE sects ADD COLUMN kung_fu TEXT DEFAULT '[]'")
-            except: pass
-            
-            await db.commit()
+                await self.flush()
+            except Exception as e:
+                rainbow_log(f"⚠️ [DB] Write-behind flush thất bại: {e}")
+
+    async def flush(self):
+        """Ghi ngay mọi thay đổi đang chờ (kể cả ledger), trả về số user được ghi"""
+        count = len(self._pending)
+        if not count and not self._ledger: return 0
+        async with self.write(invalidate=False):
+            pass
+        return count
+
+    async def initialize(self):
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        await self.pool.open()
+        # Task xả chạy cả khi tắt write-behind để ghi các dòng ledger đang gom
+        if not self._flush_task:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        await run_migrations(self)
+
+    async def _migrate_json_blobs(self, db):
+        """Chuyển dữ liệu JSON cũ trong users sang bảng con (chạy nhiều lần vẫn an toàn)"""
+        async with db.execute("""
+            SELECT user_id, inventory, missions, current_mission, buffs FROM users
+            WHERE COALESCE(inventory, '[]') != '[]' OR COALESCE(missions, '[]') != '[]'
+               OR current_mission IS NOT NULL OR COALESCE(buffs, '{}') != '{}'
+        """) as cursor:
+            rows = await cursor.fetchall()
+        if not rows: return
+
+        for row in rows:
+            def load(raw, default):
+                try: return json.loads(raw) if raw else default
+                except Exception: return default
+            fields = {
+                'inventory': load(row['inventory'], []),
+                'missions': load(row['missions'], []),
+                'current_mission': load(row['current_mission'], None),
+                'buffs': load(row['buffs'], {}),
+            }
+            await self._write_child_fields(db, row['user_id'], fields)
+        await db.execute(
+            "UPDATE users SET inventory = '[]', missions = '[]', current_mission = NULL, buffs = '{}' "
+            f"WHERE user_id IN ({', '.join('?' * len(rows))})",
+            tuple(r['user_id'] for r in rows)
+        )
+        rainbow_log(f"📦 [DB] Đã chuyển inventory/missions/buffs của {len(rows)} user sang bảng riêng.")
+
+    async def close(self):
+        """Đóng toàn bộ kết nối khi bot tắt (xả write-behind trước)"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self.pool.close()
+        self.cache.invalidate()
 
     def _parse_user_row(self, row):
         if not row: return None
         data = dict(row)
-        data['inventory'] = json.loads(data.get('inventory', '[]'))
-        data['missions'] = json.loads(data.get('missions', '[]'))
-        data['current_mission'] = json.loads(data['current_mission']) if data.get('current_mission') else None
-        data['buffs'] = json.loads(data.get('buffs', '{}'))
+        # Các cột JSON cũ chỉ còn để tương thích schema, dữ liệu thật nằm ở bảng con
+        data['inventory'] = []
+        data['missions'] = []
+        data['current_mission'] = None
+        data['buffs'] = {}
         return data
 
-    async def get_user(self, user_id: str):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)) as cursor:
+    def _item_from_row(self, r):
+        return {"id": r['item_id'], "count": r['count'], "expiry": r['expiry']}
+
+    def _mission_from_row(self, r):
+        m = {
+            "id": r['mission_id'],
+            "title": r['title'],
+            "desc": r['description'],
+            "difficulty": r['difficulty'],
+            "time": r['time'],
+            "reward": r['reward'],
+            "stones": r['stones'],
+            "success_rate": r['success_rate'],
+            "done": bool(r['done'])
+        }
+        if r['retry_time'] is not None: m['retry_time'] = r['retry_time']
+        return m
+
+    async def _attach_children(self, db, users):
+        """Gắn inventory/missions/current_mission/buffs từ bảng con vào các dict user"""
+        by_id = {u['user_id']: u for u in users}
+        ids = list(by_id)
+        # Chia nhỏ để không vượt giới hạn số tham số của SQLite
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ", ".join("?" * len(chunk))
+            async with db.execute(ITEMS_OF_USERS_SQL.format(marks=marks), chunk) as cursor:
+                for r in await cursor.fetchall():
+                    by_id[r['user_id']]['inventory'].append(self._item_from_row(r))
+            async with db.execute(MISSIONS_OF_USERS_SQL.format(marks=marks), chunk) as cursor:
+                for r in await cursor.fetchall():
+                    u = by_id[r['user_id']]
+                    u['missions'].append(self._mission_from_row(r))
+                    if r['end_time'] is not None:
+                        u['current_mission'] = {"id": r['mission_id'], "end_time": r['end_time']}
+            async with db.execute(BUFFS_OF_USERS_SQL.format(marks=marks), chunk) as cursor:
+                for r in await cursor.fetchall():
+                    by_id[r['user_id']]['buffs'][r['buff_id']] = r['expiry']
+        return users
+
+    async def get_user(self, user_id: str, children: bool = True):
+        """
+        Lấy user kèm inventory/missions/buffs.
+        children=False chỉ đọc bảng users (dùng cho autocomplete, kiểm tra nhanh).
+        Kết quả được cache (LRU + TTL), luôn trả về bản sao nên bên gọi sửa thoải mái.
+        """
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            return cached
+        generation = self.cache.generation
+        async with self.read() as db:
+            async with db.execute(USER_SELECT_SQL, (user_id,)) as cursor:
                 row = await cursor.fetchone()
-                return self._parse_user_row(row)
+            if row and (user_id in self._flushing or user_id in self._pending):
+                # Read-your-writes: phủ các giá trị chưa kịp ghi xuống
+                row = {**dict(row), **self._flushing.get(user_id, {}), **self._pending.get(user_id, {})}
+            user = self._parse_user_row(row)
+            if user and children:
+                await self._attach_children(db, [user])
+                self.cache.put(user_id, user, generation)
+        return user
+
+    async def get_inventory(self, user_id: str):
+        async with self.read() as db:
+            async with db.execute(ITEMS_OF_USER_SQL, (user_id,)) as cursor:
+                return [self._item_from_row(r) for r in await cursor.fetchall()]
 
     async def create_user(self, user_id: str, name: str):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)",
-                (user_id, name)
+        async with self.write(invalidate=user_id) as db:
+            cursor = await db.execute(USER_INSERT_SQL, (user_id, name))
+        if cursor.rowcount:
+            self._notify_user(user_id, {"name": name, "layer": USER_DEFAULTS['layer'], "exp": USER_DEFAULTS['exp']})
+
+    def _split_child_fields(self, kwargs):
+        """Tách các field thuộc bảng con ra khỏi các cột của bảng users"""
+        children = {k: kwargs.pop(k) for k in CHILD_FIELDS if k in kwargs}
+        return kwargs, children
+
+    async def _write_child_fields(self, db, user_id, children):
+        """Ghi đè toàn bộ inventory/missions/current_mission/buffs (dùng cho update_user kiểu cũ)"""
+        if 'inventory' in children:
+            await db.execute("DELETE FROM user_items WHERE user_id = ?", (user_id,))
+            await db.executemany(
+                ITEM_SET_SQL,
+                [(user_id, it['id'], it.get('count', 0), it.get('expiry', 0)) for it in children['inventory'] or []]
+            )
+        if 'missions' in children:
+            await db.execute("DELETE FROM user_missions WHERE user_id = ?", (user_id,))
+            await db.executemany(MISSION_INSERT_SQL, [self._mission_params(user_id, m) for m in children['missions'] or []])
+        if 'current_mission' in children:
+            cm = children['current_mission']
+            await db.execute(MISSION_CLEAR_SQL, (user_id,))
+            if cm:
+                await db.execute(
+                    "UPDATE user_missions SET end_time = ? WHERE user_id = ? AND mission_id = ?",
+                    (cm['end_time'], user_id, int(cm['id']))
+                )
+        if 'buffs' in children:
+            await db.execute("DELETE FROM user_buffs WHERE user_id = ?", (user_id,))
+            await db.executemany(
+                "INSERT INTO user_buffs (user_id, buff_id, expiry) VALUES (?, ?, ?)",
+                [(user_id, k, v) for k, v in (children['buffs'] or {}).items()]
             )
-            await db.commit()
+
+    def _mission_params(self, user_id, m, end_time=None):
+        """Tham số cho MISSION_INSERT_SQL từ dict nhiệm vụ"""
+        return (user_id, int(m['id']), m.get('title'), m.get('desc'), m.get('difficulty', 1), m.get('time', 0),
+                m.get('reward', 0), m.get('stones', 0), m.get('success_rate', 100), int(bool(m.get('done'))),
+                m.get('retry_time'), end_time)
 
     async def update_user(self, user_id: str, **kwargs):
         if not kwargs:
             return
-        
-        # Prepare data
-        if 'inventory' in kwargs:
-            kwargs['inventory'] = json.dumps(kwargs['inventory'], ensure_ascii=False)
-        if 'missions' in kwargs:
-            kwargs['missions'] = json.dumps(kwargs['missions'], ensure_ascii=False)
-        if 'current_mission' in kwargs:
-            kwargs['current_mission'] = json.dumps(kwargs['current_mission'], ensure_ascii=False) if kwargs['current_mission'] else None
-        if 'buffs' in kwargs:
-            kwargs['buffs'] = json.dumps(kwargs['buffs'], ensure_ascii=False)
+
+        check_user_columns(kwargs)
+        kwargs, children = self._split_child_fields(kwargs)
+        if children:
+            # Bảng con luôn ghi ngay (write-behind chỉ áp dụng cho cột của users)
+            async with self.write(invalidate=user_id) as db:
+                await self._write_child_fields(db, user_id, children)
+        if not kwargs:
+            return
+
+        if self.write_behind:
+            self._pending.setdefault(user_id, {}).update(kwargs)
+            self.cache.invalidate(user_id)
+            self._notify_user(user_id, kwargs)
+            if len(self._pending) >= WRITE_BEHIND_MAX_PENDING:
+                self._flush_event.set()
+            return
 
         keys = ", ".join(f"{k} = ?" for k in kwargs.keys())
         values = list(kwargs.values())
         values.append(user_id)
 
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(f"UPDATE users SET {keys} WHERE user_id = ?", tuple(values))
-            await db.commit()
+        async with self.write(invalidate=user_id) as db:
+            cursor = await db.execute(USER_UPDATE_SQL.format(assignments=keys), tuple(values))
+        if cursor.rowcount: self._notify_user(user_id, kwargs)
+
+    async def apply_delta(self, user_id: str, assign: dict = None, reason: str = None, level_up: bool = False, **deltas):
+        """
+        Cộng/trừ nguyên tử trong SQL (SET x = x + ?) và trả về user sau cập nhật.
+        `assign` là các cột gán thẳng giá trị trong cùng transaction (vd: goal, missions).
+        `reason` có thì exp/spirit_stones được gom vào ledger (ghi theo lô).
+        Trả về None nếu user không tồn tại.
+        """
+        unknown = set(deltas) - set(DELTA_COLUMNS)
+        if unknown:
+            raise ValueError(f"apply_delta không hỗ trợ cột: {', '.join(sorted(unknown))}")
+        assign = dict(assign or {})
+        check_user_columns(assign)
+        assign, children = self._split_child_fields(assign)
+
+        sets = [f"{k} = {k} + ?" for k in deltas] + [f"{k} = ?" for k in assign]
+        values = list(deltas.values()) + list(assign.values()) + [user_id]
+
+        async with self.write(invalidate=user_id) as db:
+            if sets:
+                async with db.execute(USER_DELTA_SQL.format(assignments=", ".join(sets)), tuple(values)) as cursor:
+                    row = await cursor.fetchone()
+            else:
+                async with db.execute(USER_SELECT_SQL, (user_id,)) as cursor:
+                    row = await cursor.fetchone()
+            if not row: return None
+            gained = 0
+            if level_up:
+                # Đột phá từ chính dòng vừa cộng, trong cùng transaction ghi (không dựa vào bản đọc trước đó)
+                layer, exp, goal = calc_level_up(row['layer'], row['exp'], row['goal'])
+                if layer != row['layer']:
+                    gained = layer - row['layer']
+                    async with db.execute(USER_LEVEL_SQL + " RETURNING *", (layer, exp, goal, user_id)) as cursor:
+                        row = await cursor.fetchone()
+            if children:
+                await self._write_child_fields(db, user_id, children)
+            user = self._parse_user_row(row)
+            if level_up: user['layer_gained'] = gained
+            await self._attach_children(db, [user])
+        entry = ledger_entry(user_id, reason, deltas)
+        if entry:
+            self._ledger.append(entry)
+            if len(self._ledger) >= LEDGER_MAX_PENDING:
+                self._flush_event.set()
+        self._notify_user(user_id, user)
+        return user
+
+    # --- Thao tác từng dòng trên bảng con ---
+
+    async def add_item(self, user_id: str, item_id: str, count: int = 1):
+        """Cộng thêm số lượng vật phẩm (tạo dòng mới nếu chưa có)"""
+        async with self.write(invalidate=user_id) as db:
+            await db.execute(ITEM_ADD_SQL, (user_id, item_id, count))
+
+    async def buy_item(self, user_id: str, item_id: str, price: int, count: int = 1):
+        async with self.write(invalidate=user_id) as db:
+            # Điều kiện spirit_stones >= ? nằm ngay trong UPDATE: hai lệnh mua song song không thể cùng trừ quá số dư
+            async with db.execute(BUY_DEBIT_SQL, (price, user_id, price)) as cursor:
+                row = await cursor.fetchone()
+            if not row: return None
+            await db.execute(ITEM_ADD_SQL, (user_id, item_id, count))
+        self._ledger.append(ledger_entry(user_id, 'buy', {'spirit_stones': -price}))
+        if len(self._ledger) >= LEDGER_MAX_PENDING:
+            self._flush_event.set()
+        return row[0]
+
+    async def set_item(self, user_id: str, item_id: str, count: int, expiry: float = 0):
+        async with self.write(invalidate=user_id) as db:
+            await db.execute(ITEM_SET_SQL, (user_id, item_id, count, expiry))
+
+    async def consume_item(self, user_id: str, item_id: str, duration: float = 0, now: float = 0):
+        """
+        Dùng 1 vật phẩm: trừ count và cộng dồn thời hạn buff trong cùng một câu lệnh.
+        Trả về dict vật phẩm sau khi dùng, None nếu không còn vật phẩm.
+        """
+        async with self.write(invalidate=user_id) as db:
+            async with db.execute(ITEM_CONSUME_SQL, (duration, now, duration, user_id, item_id)) as cursor:
+                row = await cursor.fetchone()
+        return self._item_from_row(row) if row else None
+
+    async def prune_inventory(self, user_id: str, now: float):
+        """Xóa vật phẩm đã hết số lượng lẫn thời hạn, reset expiry đã qua về 0"""
+        async with self.write(invalidate=user_id) as db:
+            await db.execute(ITEM_PRUNE_SQL, (user_id, now))
+            await db.execute(ITEM_EXPIRE_SQL, (user_id, now))
+
+    async def update_mission(self, user_id: str, mission_id: int, **fields):
+        """Cập nhật một nhiệm vụ (done, retry_time, end_time...)"""
+        if not fields: return
+        if 'desc' in fields: fields['description'] = fields.pop('desc')
+        if 'done' in fields: fields['done'] = int(bool(fields['done']))
+        keys = ", ".join(f"{k} = ?" for k in fields)
+        async with self.write(invalidate=user_id) as db:
+            await db.execute(
+                MISSION_UPDATE_SQL.format(assignments=keys),
+                tuple(fields.values()) + (user_id, int(mission_id))
+            )
+
+    async def start_mission(self, user_id: str, mission_id: int, end_time: float):
+        """Đánh dấu nhiệm vụ đang làm (mỗi user chỉ một nhiệm vụ có end_time)"""
+        await self.update_user(user_id, current_mission={"id": mission_id, "end_time": end_time})
+
+    async def clear_current_mission(self, user_id: str, mission_id: int = None):
+        """
+        Bỏ nhiệm vụ đang làm, trả về số dòng bị ảnh hưởng.
+        Có mission_id thì chỉ bỏ đúng nhiệm vụ đó: rowcount = 1 nghĩa là người gọi "giành" được quyền chốt kết quả.
+        """
+        async with self.write(invalidate=user_id) as db:
+            if mission_id is None:
+                cursor = await db.execute(MISSION_CLEAR_SQL, (user_id,))
+            else:
+                cursor = await db.execute(MISSION_CLAIM_SQL, (user_id, int(mission_id)))
+            return cursor.rowcount
+
+    async def get_mission_timers(self):
+        """Mọi nhiệm vụ đang làm dở: [(user_id, mission_id, end_time)] - nạp lại hàng đợi hẹn giờ khi khởi động"""
+        async with self.read() as db:
+            rows = await db.execute_fetchall(MISSION_TIMERS_SQL)
+        return [(r[0], r[1], r[2]) for r in rows]
+
+    async def set_buff(self, user_id: str, buff_id: str, expiry: float):
+        async with self.write(invalidate=user_id) as db:
+            await db.execute(BUFF_SET_SQL, (user_id, buff_id, expiry))
+
+    async def get_state(self, key: str, default=None):
+        """Đọc giá trị trong app_state (đã decode JSON)"""
+        async with self.read() as db:
+            rows = await db.execute_fetchall("SELECT value FROM app_state WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    async def set_state(self, key: str, value, db=None):
+        """Ghi app_state; truyền db để ghi chung transaction đang mở"""
+        sql = "INSERT OR REPLACE INTO app_state (key, value) VALUES (?, ?)"
+        params = (key, json.dumps(value, ensure_ascii=False))
+        if db is not None:
+            return await db.execute(sql, params)
+        async with self.write(invalidate=False) as conn:
+            await conn.execute(sql, params)
+
+    async def delete_state(self, key: str):
+        async with self.write(invalidate=False) as db:
+            await db.execute("DELETE FROM app_state WHERE key = ?", (key,))
+
+    async def apply_daily_reset(self, epoch: float):
+        async with self.write() as db:
+            # Nhiệm vụ đang làm dở (end_time khác NULL) được giữ lại để còn nhận thưởng
+            await db.execute(DAILY_RESET_MISSIONS_SQL, (epoch,))
+            cursor = await db.execute(DAILY_RESET_USERS_SQL, (epoch, epoch, epoch, epoch))
+            count = cursor.rowcount
+            await self.set_state(DAILY_RESET_STATE, epoch, db=db)
+        return count
+
+    async def apply_level_ups(self):
+        # Đọc và ghi trong cùng transaction ghi nên không lẫn với delta cộng song song
+        async with self.write() as db:
+            rows = await db.execute_fetchall(LEVEL_UP_SWEEP_SQL)
+            changed = batch_level_up(rows)
+            if changed:
+                await db.executemany(
+                    USER_LEVEL_SQL,
+                    [(layer, exp, goal, uid) for uid, layer, exp, goal in changed]
+                )
+        for uid, layer, exp, goal in changed:
+            self._notify_user(uid, {"layer": layer, "exp": exp})
+        return changed
+
+    # --- Ledger ---
+
+    async def ledger_summary(self, user_id: str = None, since: float = None, until: float = None):
+        if self._ledger: await self.flush()
+        raw_cond, daily_cond, raw_params, daily_params = [], [], [], []
+        if user_id is not None:
+            raw_cond.append("user_id = ?"); raw_params.append(user_id)
+            daily_cond.append("user_id = ?"); daily_params.append(user_id)
+        if since is not None:
+            raw_cond.append("ts >= ?"); raw_params.append(since)
+            daily_cond.append("day >= ?"); daily_params.append(ledger_day(since))
+        if until is not None:
+            raw_cond.append("ts < ?"); raw_params.append(until)
+            daily_cond.append("day <= ?"); daily_params.append(ledger_day(until - 1e-3))
+        raw_where = f"WHERE {' AND '.join(raw_cond)}" if raw_cond else ""
+        daily_where = f"WHERE {' AND '.join(daily_cond)}" if daily_cond else ""
+
+        res = {}
+        async with self.read() as db:
+            raw = await db.execute_fetchall(LEDGER_SUMMARY_SQL.format(where=raw_where), raw_params)
+            daily = await db.execute_fetchall(LEDGER_DAILY_SUMMARY_SQL.format(where=daily_where), daily_params)
+        for reason, exp, stones, entries in list(raw) + list(daily):
+            r = res.setdefault(reason, {"exp": 0, "spirit_stones": 0, "entries": 0})
+            r['exp'] += exp or 0; r['spirit_stones'] += stones or 0; r['entries'] += entries or 0
+        return res
+
+    async def compact_ledger(self, before: float):
+        async with self.write(invalidate=False) as db:
+            await db.execute(LEDGER_COMPACT_SQL, (before,))
+            cursor = await db.execute(LEDGER_PURGE_SQL, (before,))
+            count = cursor.rowcount
+        if count:
+            rainbow_log(f"🧾 [DB] Đã nén {count} dòng ledger vào bảng tổng hợp theo ngày.")
+        return count
+
+    # --- Kho nhiệm vụ ---
+
+    async def mission_pool_counts(self):
+        async with self.read() as db:
+            rows = await db.execute_fetchall(POOL_COUNTS_SQL)
+        return {r[0]: r[1] for r in rows}
+
+    async def add_pool_missions(self, missions: list):
+        now = time.time()
+        async with self.write(invalidate=False) as db:
+            before = db.total_changes
+            await db.executemany(
+                "INSERT OR IGNORE INTO mission_pool (tier, title, description, difficulty, time, reward, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(m['tier'], m['title'], m['desc'], m['difficulty'], m['time'], m['reward'], now) for m in missions]
+            )
+            return db.total_changes - before
+
+    async def take_pool_missions(self, user_id: str, tier_counts: dict):
+        picked = []
+        async with self.write(invalidate=False) as db:
+            for tier, n in tier_counts.items():
+                rows = await db.execute_fetchall(POOL_CANDIDATES_SQL, (tier, user_id))
+                picked += pick_pool_rows(rows, n)
+            if picked:
+                now = time.time()
+                await db.executemany(
+                    "INSERT OR REPLACE INTO mission_seen (user_id, pool_id, ts) VALUES (?, ?, ?)",
+                    [(user_id, r['pool_id'], now) for r in picked]
+                )
+                await db.executemany(POOL_USE_SQL, [(r['pool_id'],) for r in picked])
+        return [{
+            "pool_id": r['pool_id'], "tier": r['tier'], "title": r['title'], "desc": r['description'],
+            "difficulty": r['difficulty'], "time": r['time'], "reward": r['reward']
+        } for r in picked]
+
+    async def prune_mission_pool(self, max_uses: int, seen_before: float):
+        async with self.write(invalidate=False) as db:
+            await db.execute(
+                "DELETE FROM mission_seen WHERE pool_id IN (SELECT id FROM mission_pool WHERE uses >= ?)", (max_uses,)
+            )
+            retired = (await db.execute("DELETE FROM mission_pool WHERE uses >= ?", (max_uses,))).rowcount
+            stale = (await db.execute(POOL_SEEN_PRUNE_SQL, (seen_before,))).rowcount
+        return retired, stale
+
+    # --- Rút thăm buff ---
+
+    async def rebuild_lucky_alias(self, weight_column: str = None):
+        if weight_column: check_user_columns([weight_column])
+        # Quét cả bảng users một lần mỗi ngày; các lượt rút hàng giờ chỉ đọc lucky_alias theo slot
+        async with self.read() as db:
+            users = await db.execute_fetchall(LUCKY_WEIGHTS_SQL.format(weight=weight_column or "NULL"))
+        rows = alias_rows([(r[0], r[1]) for r in users])
+        async with self.write(invalidate=False) as db:
+            await db.execute("DELETE FROM lucky_alias")
+            await db.executemany("INSERT INTO lucky_alias (slot, user_id, prob, alias_id) VALUES (?, ?, ?, ?)", rows)
+            await self.set_state(LUCKY_ALIAS_STATE, {"n": len(rows), "built": time.time(), "weight": weight_column}, db=db)
+        return len(rows)
+
+    async def draw_lucky_users(self, count: int, buff_id: str, expiry: float):
+        state = await self.get_state(LUCKY_ALIAS_STATE)
+        if not state or not state['n']: return []
+
+        async def fetch(slots):
+            found = {}
+            async with self.read() as db:
+                for i in range(0, len(slots), 500):
+                    chunk = slots[i:i + 500]
+                    rows = await db.execute_fetchall(LUCKY_SLOTS_SQL.format(marks=", ".join("?" * len(chunk))), chunk)
+                    for r in rows: found[r[0]] = (r[1], r[2], r[3])
+            return found
+
+        winners = await pick_winners(state['n'], count, fetch)
+        granted = set()
+        # Chỉ ban cho người còn trong bảng users (bảng alias dựng theo ngày), RETURNING để biết ai đã nhận
+        async with self.write(invalidate=False) as db:
+            for i in range(0, len(winners), 500):
+                chunk = winners[i:i + 500]
+                rows = await db.execute_fetchall(
+                    LUCKY_GRANT_SQL.format(marks=", ".join("?" * len(chunk))), (buff_id, expiry, *chunk)
+                )
+                granted.update(r[0] for r in rows)
+        for uid in granted: self.cache.invalidate(uid)
+        return [uid for uid in winners if uid in granted]
 
     async def get_top_users(self, limit=10):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM users ORDER BY layer DESC, exp DESC LIMIT ?", 
-                (limit,)
-            ) as cursor:
+        async with self.read() as db:
+            async with db.execute(TOP_USERS_SQL, (limit,)) as cursor:
                 rows = await cursor.fetchall()
-                return [self._parse_user_row(row) for row in rows]
+            users = [self._parse_user_row(row) for row in rows]
+            return await self._attach_children(db, users)
 
     async def get_all_users(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM users") as cursor:
+        """Nạp toàn bộ user kèm bảng con vào RAM - task chạy trên cả bảng nên dùng iter_users"""
+        async with self.read() as db:
+            async with db.execute(ALL_USERS_SQL) as cursor:
                 rows = await cursor.fetchall()
-                return [self._parse_user_row(row) for row in rows]
+            users = [self._parse_user_row(row) for row in rows]
+            return await self._attach_children(db, users)
+
+    def _user_filter(self, where, exclude):
+        """Dựng điều kiện SQL từ dict where/exclude (IS / IS NOT để so được cả NULL)"""
+        where, exclude = where or {}, exclude or {}
+        check_user_columns(list(where) + list(exclude))
+        conds = [f"{k} IS ?" for k in where] + [f"{k} IS NOT ?" for k in exclude]
+        return conds, list(where.values()) + list(exclude.values())
+
+    async def iter_users(self, columns=None, where: dict = None, exclude: dict = None, batch_size: int = 500):
+        """
+        Duyệt user theo từng lô (keyset theo user_id), chỉ đọc các cột cần dùng.
+        columns có thể gồm inventory/missions/current_mission/buffs, khi đó bảng con được nạp theo lô.
+        Kết nối đọc được trả lại pool trước khi yield nên bên gọi có thể await lâu giữa các dòng.
+        """
+        columns = list(columns or USER_COLUMNS)
+        check_user_columns(columns)
+        children = [c for c in columns if c in CHILD_FIELDS]
+        cols = [c for c in columns if c not in CHILD_FIELDS]
+        if "user_id" not in cols:
+            cols.insert(0, "user_id")
+        select = ", ".join(cols)
+        conds, params = self._user_filter(where, exclude)
+        cond = "".join(f" AND {c}" for c in conds)
+
+        last_id = ""
+        while True:
+            async with self.read() as db:
+                async with db.execute(
+                    ITER_USERS_SQL.format(columns=select, cond=cond),
+                    (last_id, *params, batch_size)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+                if not rows: return
+                batch = []
+                for row in rows:
+                    data = dict(row)
+                    uid = data['user_id']
+                    if uid in self._flushing or uid in self._pending:
+                        overlay = {**self._flushing.get(uid, {}), **self._pending.get(uid, {})}
+                        data.update({k: v for k, v in overlay.items() if k in data})
+                    batch.append(data)
+                if children:
+                    for u in batch:
+                        u.update({'inventory': [], 'missions': [], 'current_mission': None, 'buffs': {}})
+                    await self._attach_children(db, batch)
+                    for u in batch:
+                        for k in CHILD_FIELDS:
+                            if k not in children: u.pop(k, None)
+            for data in batch:
+                yield data
+            if len(rows) < batch_size: return
+            last_id = rows[-1]['user_id']
+
+    async def count_users(self, where: dict = None, exclude: dict = None):
+        conds, params = self._user_filter(where, exclude)
+        cond = f" WHERE {' AND '.join(conds)}" if conds else ""
+        async with self.read() as db:
+            rows = await db.execute_fetchall(COUNT_USERS_SQL.format(cond=cond), tuple(params))
+        return rows[0][0]
+
+    def _parse_sect_row(self, row):
+        if not row: return None
+        d = dict(row)
+        d['kung_fu'] = json.loads(d['kung_fu']) if d.get('kung_fu') else []
+        return d
 
     async def get_all_sects(self):
         """Lấy danh sách tất cả tông môn"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT * FROM sects ORDER BY exp DESC") as cursor:
+        async with self.read() as db:
+            async with db.execute(ALL_SECTS_SQL) as cursor:
+                rows = await cursor.fetchall()
+                return [self._parse_sect_row(r) for r in rows]
+
+    async def _get_sect_where(self, cond, params):
+        async with self.read() as db:
+            async with db.execute(SECT_WHERE_SQL.format(cond=cond), params) as cursor:
+                return self._parse_sect_row(await cursor.fetchone())
+
+    async def get_sect(self, sect_id: int):
+        return await self._get_sect_where("sect_id = ?", (sect_id,))
+
+    async def get_sect_by_name(self, name: str):
+        return await self._get_sect_where("name = ?", (name,))
+
+    async def get_sect_by_leader(self, leader_id: str):
+        return await self._get_sect_where("leader_id = ? LIMIT 1", (leader_id,))
+
+    async def create_sect(self, name: str, leader_id: str):
+        """Tạo tông môn, trả về sect_id; ValueError nếu trùng tên"""
+        try:
+            async with self.write(invalidate=False) as db:
+                cursor = await db.execute(SECT_INSERT_SQL, (name, leader_id))
+                return cursor.lastrowid
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Tông môn {name} đã tồn tại")
+
+    async def delete_sect(self, sect_id: int):
+        """Xóa tông môn và trả các đệ tử về tán tu"""
+        async with self.write() as db:
+            cursor = await db.execute(SECT_DELETE_SQL, (sect_id,))
+            if not cursor.rowcount: return False
+            await db.execute(SECT_RELEASE_MEMBERS_SQL, (sect_id,))
+        return True
+
+    async def get_sect_members(self, sect_id: int, exclude_user: str = None):
+        """Danh sách {user_id, name} của tông môn"""
+        async with self.read() as db:
+            async with db.execute(SECT_MEMBERS_SQL, (sect_id, exclude_user)) as cursor:
                 rows = await cursor.fetchall()
-                res = []
-                for r in rows:
-                    d = dict(r)
-                    d['kung_fu'] = json.loads(d['kung_fu']) if d.get('kung_fu') else []
-                    res.append(d)
-                return res
+        # Sắp xếp ở Python: tránh B-tree tạm, số đệ tử mỗi tông nhỏ
+        return sorted((dict(r) for r in rows), key=lambda r: r['user_id'])
+
+    async def count_sect_members(self, sect_id: int):
+        async with self.read() as db:
+            rows = await db.execute_fetchall(SECT_COUNT_MEMBERS_SQL, (sect_id,))
+        return rows[0][0]
 
     async def update_sect(self, sect_id: int, **kwargs):
         """Cập nhật thông tin tông môn"""
         if not kwargs: return
-        
+
         if 'kung_fu' in kwargs:
             kwargs['kung_fu'] = json.dumps(kwargs['kung_fu'], ensure_ascii=False)
-            
+
         keys = ", ".join(f"{k} = ?" for k in kwargs.keys())
         values = list(kwargs.values())
         values.append(sect_id)
 
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(f"UPDATE sects SET {keys} WHERE sect_id = ?", tuple(values))
-            await db.commit()
+        async with self.write(invalidate=False) as db:
+            await db.execute(SECT_UPDATE_SQL.format(assignments=keys), tuple(values))
 
     async def update_sect_exp(self, sect_id: int, exp: int):
         """Cộng thêm EXP cho tông môn"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("UPDATE sects SET exp = exp + ? WHERE sect_id = ?", (exp, sect_id))
-            await db.commit()
+        async with self.write(invalidate=False) as db:
+            await db.execute(SECT_ADD_EXP_SQL, (exp, sect_id))
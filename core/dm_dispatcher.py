@@ -0,0 +1,127 @@
+"""
+Gửi DM hàng loạt (nhắc điểm danh, thông báo buff...) với số luồng giới hạn và nhịp gửi chung.
+Mở thẳng kênh DM theo ID (không fetch_user), bỏ trùng trong cùng một đợt / cùng dedupe_key,
+nhớ những người đóng DM (lưu trong app_state, hết hạn sau DM_CLOSED_TTL_DAYS) để lần sau bỏ qua.
+"""
+import asyncio
+import os
+import time
+import discord
+from core.helpers import rainbow_log
+from core.rest_broker import TokenBucket
+
+DM_CONCURRENCY = int(os.getenv("DM_CONCURRENCY", "8"))
+DM_SENDS_PER_SEC = float(os.getenv("DM_SENDS_PER_SEC", "10"))
+DM_CLOSED_TTL_DAYS = float(os.getenv("DM_CLOSED_TTL_DAYS", "7"))
+DM_CLOSED_STATE = "dm_closed"
+DM_DEDUPE_KEYS = 16  # Số dedupe_key gần nhất được nhớ
+
+# Mã lỗi Discord nghĩa là không bao giờ gửi được (đóng DM / user không tồn tại)
+_CLOSED_CODES = (50007, 10013)
+
+class DMDispatcher:
+    def __init__(self, bot, concurrency=DM_CONCURRENCY, sends_per_sec=DM_SENDS_PER_SEC):
+        self.bot = bot
+        self.concurrency = concurrency
+        self._bucket = TokenBucket(sends_per_sec, max(1.0, sends_per_sec))
+        self._pace = asyncio.Lock()
+        self._closed = None  # user_id -> thời điểm phát hiện đóng DM
+        self._closed_dirty = False
+        self._dedupe = {}    # dedupe_key -> set(user_id) đã gửi
+
+    async def _load_closed(self):
+        if self._closed is None:
+            cutoff = time.time() - DM_CLOSED_TTL_DAYS * 86400
+            stored = await self.bot.db.get_state(DM_CLOSED_STATE, {}) or {}
+            self._closed = {uid: ts for uid, ts in stored.items() if ts >= cutoff}
+        return self._closed
+
+    async def _save_closed(self):
+        if self._closed_dirty:
+            self._closed_dirty = False
+            await self.bot.db.set_state(DM_CLOSED_STATE, self._closed)
+
+    async def _wait_turn(self):
+        """Nhịp gửi chung cho mọi luồng (token bucket)"""
+        async with self._pace:
+            while True:
+                wait = self._bucket.wait_time(time.monotonic())
+                if not wait: break
+                await asyncio.sleep(wait)
+            self._bucket.take()
+
+    async def _deliver(self, user_id, kwargs):
+        """Gửi một DM, trả về 'sent' / 'skipped' / 'failed'"""
+        if user_id in self._closed: return "skipped"
+        await self._wait_turn()
+        try:
+            channel = await self.bot.create_dm(discord.Object(id=int(user_id)))
+            await channel.send(**kwargs)
+            return "sent"
+        except (discord.Forbidden, discord.NotFound) as e:
+            if e.code in _CLOSED_CODES:
+                self._closed[user_id] = time.time()
+                self._closed_dirty = True
+                return "skipped"
+            return "failed"
+        except Exception:
+            return "failed"
+
+    async def send(self, user_id, **kwargs):
+        """Gửi DM cho một người (không qua đợt), trả về 'sent' / 'skipped' / 'failed'"""
+        await self._load_closed()
+        result = await self._deliver(str(user_id), kwargs)
+        await self._save_closed()
+        return result
+
+    async def broadcast(self, jobs, label, dedupe_key=None):
+        """
+        jobs: iterable / async iterable các (user_id, kwargs cho channel.send) - được đọc dần, không nạp hết vào RAM.
+        dedupe_key: chạy lại cùng key (vd: task chạy lại sau khi khởi động lại) sẽ bỏ những người đã nhận.
+        Trả về {sent, skipped, failed, seconds}.
+        """
+        await self._load_closed()
+        started = time.perf_counter()
+        stats = {"sent": 0, "skipped": 0, "failed": 0}
+        done = self._dedupe.setdefault(dedupe_key, set()) if dedupe_key else set()
+        if dedupe_key:
+            while len(self._dedupe) > DM_DEDUPE_KEYS: self._dedupe.pop(next(iter(self._dedupe)))
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                user_id, kwargs = await queue.get()
+                try:
+                    result = await self._deliver(user_id, kwargs)
+                    stats[result] += 1
+                    if result == "sent": done.add(user_id)
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            seen = set()
+            async for user_id, kwargs in _aiter(jobs):
+                user_id = str(user_id)
+                if user_id in seen or user_id in done:
+                    stats["skipped"] += 1
+                    continue
+                seen.add(user_id)
+                await queue.put((user_id, kwargs))
+            await queue.join()
+        finally:
+            for w in workers: w.cancel()
+            await self._save_closed()
+
+        stats["seconds"] = round(time.perf_counter() - started, 2)
+        rainbow_log(
+            f"📨 [DM] {label}: gửi {stats['sent']}, bỏ qua {stats['skipped']}, lỗi {stats['failed']} "
+            f"trong {stats['seconds']}s."
+        )
+        return stats
+
+async def _aiter(jobs):
+    if hasattr(jobs, "__aiter__"):
+        async for job in jobs: yield job
+    else:
+        for job in jobs: yield job
@@ -3,7 +3,8 @@ import json
 import random
 import pytz
 import asyncio
-from datetime import datetime
+from bisect import bisect_right
+from datetime import datetime, timedelta
 from colorama import Fore, Style
 from discord import Embed, Color
 from dotenv import load_dotenv
@@ -52,6 +53,7 @@ else:
 
 # --- CONFIG ---
 VN_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
+DAILY_RESET_HOUR = 7  # Thiên thời reset mỗi ngày lúc 7h sáng giờ Việt Nam
 ITALIC = "\033[3m"
 RESET = Style.RESET_ALL
 EMOJI_CACHE_FILE = "cache/emoji_cache.json"
@@ -62,11 +64,26 @@ from core.roles_config import DEFAULT_RANKS
 RANKS = DEFAULT_RANKS.copy()
 RANKS_CACHE_FILE = "cache/ranks_cache.json"
 
+# Bảng tra cảnh giới dựng sẵn từ RANKS: ngưỡng 'min' tăng dần để bisect, dựng lại mỗi khi RANKS đổi
+_RANK_MINS = []
+_RANK_ENTRIES = []
+_RANK_NAMES = frozenset()
+
+def rebuild_rank_table():
+    """Gọi sau mỗi lần thay đổi RANKS (nạp cache, AI tạo mới, fallback)"""
+    global _RANK_MINS, _RANK_ENTRIES, _RANK_NAMES
+    # Cùng ngưỡng thì cảnh đứng trước trong RANKS thắng (giống vòng sort giảm dần cũ) -> xếp nó về sau
+    order = {name: i for i, name in enumerate(RANKS)}
+    entries = sorted(RANKS.items(), key=lambda x: (x[1]['min'], -order[x[0]]))
+    _RANK_MINS = [info['min'] for _, info in entries]
+    _RANK_ENTRIES = entries
+    _RANK_NAMES = frozenset(DEFAULT_RANKS) | frozenset(RANKS)
+
 def get_all_rank_names():
     """Lấy tất cả tên rank khả dĩ (Active + Default) để dọn dẹp role"""
-    names = set(DEFAULT_RANKS.keys())
-    names.update(RANKS.keys())
-    return list(names)
+    return _RANK_NAMES
+
+rebuild_rank_table()
 
 # --- LOGGING ---
 def rainbow_log(msg, is_ascii=False, is_italic=False):
@@ -161,6 +178,7 @@ def load_ranks_cache():
                 cached = json.load(f)
                 if cached:
                     RANKS.update(cached)
+                    rebuild_rank_table()
                     rainbow_log(f"✨ [Đạo Pháp] Đã khôi phục {len(cached)} cảnh giới từ thiên thư cũ.")
                     return True
     except Exception as e:
@@ -226,6 +244,7 @@ async def generate_ranks_from_ai():
                         "permissions": closest_perms # Kế thừa quyền từ set mặc định
                     }
                 
+                rebuild_rank_table()
                 save_ranks_cache(RANKS)
                 rainbow_log(f"✅ [Đạo Pháp] AI đã tạo thành công {len(RANKS)} cảnh giới tu tiên!")
                 return RANKS
@@ -236,6 +255,7 @@ async def generate_ranks_from_ai():
     # Fallback
     rainbow_log("📜 [Đạo Pháp] Sử dụng cảnh giới thượng cổ (Fallback).")
     RANKS = DEFAULT_RANKS.copy()
+    rebuild_rank_table()
     return RANKS
 
 async def get_cached_emoji(key, prompt):
@@ -255,10 +275,17 @@ async def get_cached_emoji(key, prompt):
     return emoji
 
 # --- UTILS ---
+def current_reset(now: datetime = None):
+    """Mốc reset ngày gần nhất đã qua (7h sáng giờ VN)"""
+    now = now or datetime.now(VN_TZ)
+    reset = now.replace(hour=DAILY_RESET_HOUR, minute=0, second=0, microsecond=0)
+    if now < reset: reset -= timedelta(days=1)
+    return reset
+
 def get_rank_info(layer: int):
-    for rank_name, info in sorted(RANKS.items(), key=lambda x: x[1]['min'], reverse=True):
-        if layer >= info['min']:
-            return rank_name, info
+    """(tên cảnh giới, info) của tầng `layer` - bisect trên bảng dựng sẵn, O(log n)"""
+    i = bisect_right(_RANK_MINS, layer)
+    if i: return _RANK_ENTRIES[i - 1]
     return "Phàm Nhân", RANKS["Phàm Nhân"]
 
 def txa_embed(title: str, desc: str, color: Color = Color.from_rgb(47, 49, 54), thumbnail: str = None, image: str = None, footer: str = None):
@@ -0,0 +1,113 @@
+"""
+Bảng xếp hạng tu vi trong RAM.
+Nạp toàn bộ (layer, exp, user_id) một lần khi khởi động, sau đó cập nhật từng người qua
+Storage.add_user_listener mỗi khi đường phát thưởng ghi layer/exp (apply_delta, update_user, đột phá...).
+Khóa được giữ trong một list đã sắp xếp nên tra hạng của một người là bisect O(log n).
+Embed từng trang được cache tới khi thứ tự trong trang đó thay đổi.
+"""
+import os
+import time
+from bisect import bisect_left
+from core.helpers import rainbow_log
+
+LEADERBOARD_PAGE_SIZE = int(os.getenv("LEADERBOARD_PAGE_SIZE", "10"))
+
+def _key(user_id, layer, exp):
+    """Sắp tăng dần theo khóa này = layer giảm dần, exp giảm dần, cùng tu vi thì theo user_id"""
+    return (-layer, -exp, user_id)
+
+class Leaderboard:
+    def __init__(self, db, page_size=LEADERBOARD_PAGE_SIZE):
+        self.db = db
+        self.page_size = page_size
+        self._keys = []    # Khóa đã sắp xếp, vị trí i = hạng i + 1
+        self._users = {}   # user_id -> [name, layer, exp]
+        self._pages = {}   # trang -> embed đã render
+        self.loaded = False
+        self.hits = 0
+        self.renders = 0
+
+    async def load(self):
+        """Nạp cả bảng users (lúc khởi động hoặc sau khi khôi phục backup) và bắt đầu nghe thay đổi"""
+        started = time.perf_counter()
+        users = {}
+        async for u in self.db.iter_users(columns=['user_id', 'name', 'layer', 'exp']):
+            users[u['user_id']] = [u['name'], u['layer'] or 0, u['exp'] or 0]
+        self._users = users
+        self._keys = sorted(_key(uid, layer, exp) for uid, (_, layer, exp) in users.items())
+        self._pages.clear()
+        if not self.loaded:
+            self.db.add_user_listener(self.on_user_change)
+            self.db.add_restore_listener(self.load)
+        self.loaded = True
+        rainbow_log(f"📊 [Thiên Bảng] Nạp {len(users)} đạo hữu vào bảng xếp hạng trong {(time.perf_counter() - started) * 1000:.1f}ms.")
+
+    def on_user_change(self, user_id, fields):
+        entry = self._users.get(user_id)
+        if entry is None:
+            # User mới: chỉ thêm khi biết đủ tu vi (create_user / apply_delta)
+            if 'layer' not in fields or 'exp' not in fields: return
+            entry = self._users[user_id] = [fields.get('name'), fields['layer'] or 0, fields['exp'] or 0]
+            pos = bisect_left(self._keys, _key(user_id, entry[1], entry[2]))
+            self._keys.insert(pos, _key(user_id, entry[1], entry[2]))
+            self._pages.clear()  # Tổng số trang đổi
+            return
+
+        old = _key(user_id, entry[1], entry[2])
+        if 'name' in fields: entry[0] = fields['name']
+        if 'layer' in fields: entry[1] = fields['layer'] or 0
+        if 'exp' in fields: entry[2] = fields['exp'] or 0
+        new = _key(user_id, entry[1], entry[2])
+        if new == old:
+            if 'name' in fields: self._invalidate(bisect_left(self._keys, old), None)
+            return
+        i = bisect_left(self._keys, old)
+        del self._keys[i]
+        j = bisect_left(self._keys, new)
+        self._keys.insert(j, new)
+        self._invalidate(i, j)
+
+    def _invalidate(self, i, j):
+        """Bỏ cache các trang chứa vị trí từ i tới j (những người ở giữa bị đẩy lên / xuống một bậc)"""
+        if not self._pages: return
+        if j is None: j = i
+        first, last = min(i, j) // self.page_size, max(i, j) // self.page_size
+        for page in [p for p in self._pages if first <= p <= last]:
+            del self._pages[page]
+
+    @property
+    def total(self):
+        return len(self._keys)
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self._keys) // self.page_size))
+
+    def rank_of(self, user_id):
+        """Hạng (bắt đầu từ 1) của user, None nếu chưa ghi danh"""
+        entry = self._users.get(user_id)
+        if entry is None: return None
+        return bisect_left(self._keys, _key(user_id, entry[1], entry[2])) + 1
+
+    def page(self, page):
+        """[(hạng, user_id, name, layer, exp)] của trang `page` (bắt đầu từ 0)"""
+        start = page * self.page_size
+        rows = []
+        for i, (_, _, user_id) in enumerate(self._keys[start:start + self.page_size], start + 1):
+            name, layer, exp = self._users[user_id]
+            rows.append((i, user_id, name, layer, exp))
+        return rows
+
+    def page_embed(self, page, render):
+        """Embed của trang từ cache, chưa có thì render(rows, page, page_count) rồi lưu lại"""
+        page = min(max(0, page), self.page_count - 1)
+        embed = self._pages.get(page)
+        if embed is not None:
+            self.hits += 1
+            return embed, page
+        self.renders += 1
+        embed = self._pages[page] = render(self.page(page), page, self.page_count)
+        return embed, page
+
+    def stats(self):
+        return {"users": len(self._keys), "cached_pages": len(self._pages), "hits": self.hits, "renders": self.renders}
@@ -0,0 +1,154 @@
+"""
+Bộ lập lịch dùng chung cho các tin nhắn cập nhật "real-time" (thanh tiến độ, /info, /inventory...).
+Thay vì mỗi lệnh tự chạy vòng `while: edit(); sleep(1)`, lệnh đăng ký một LiveView và
+một vòng lặp duy nhất sẽ render + edit khi tới hạn. Nội dung không đổi thì bỏ qua edit,
+nhiều view cùng lúc thì giãn chu kỳ để tổng số edit/giây không vượt ngân sách.
+"""
+import asyncio
+import os
+import time
+from core.helpers import rainbow_log
+
+# Tổng số edit Discord mỗi giây cho toàn bộ view (view nhiều thì mỗi view được cập nhật thưa hơn)
+LIVE_VIEW_EDITS_PER_SEC = float(os.getenv("LIVE_VIEW_EDITS_PER_SEC", "20"))
+LIVE_VIEW_MAX_CONCURRENT = 8
+LIVE_VIEW_MIN_SLEEP = 0.01
+
+def _signature(kwargs):
+    """So sánh nội dung sẽ edit: embed -> dict (bỏ timestamp vì txa_embed luôn gắn giờ hiện tại), còn lại giữ nguyên"""
+    sig = []
+    for k, v in sorted(kwargs.items()):
+        if hasattr(v, "to_dict"):
+            v = v.to_dict()
+            v.pop("timestamp", None)
+        sig.append((k, repr(v)))
+    return tuple(sig)
+
+class LiveView:
+    """
+    Một tin nhắn được cập nhật định kỳ tới `until`.
+    render(now) -> dict tham số cho edit (embed=..., content=...) hoặc None để dừng sớm.
+    edit(**kwargs): thường là msg.edit hoặc interaction.edit_original_response.
+    final: khi hết hạn render + edit thêm một lần (trạng thái cuối); on_expire: dọn dẹp (xóa tin nhắn...).
+    """
+
+    def __init__(self, key, render, edit, until, interval=1.0, final=False, on_expire=None):
+        self.key = key
+        self.render = render
+        self.edit = edit
+        self.until = until
+        self.interval = interval
+        self.final = final
+        self.on_expire = on_expire
+        self.next_due = 0.0
+        self.busy = False
+        self.closed = False
+        self._last_sig = None
+        self._done = asyncio.get_running_loop().create_future()
+
+    async def wait(self):
+        """Chờ tới khi view kết thúc (hết hạn, bị thay thế hoặc lỗi edit)"""
+        await asyncio.shield(self._done)
+
+    async def _apply(self, now):
+        """Render và edit nếu nội dung đổi, trả về False nếu view phải dừng"""
+        kwargs = await self.render(now)
+        if kwargs is None: return False
+        sig = _signature(kwargs)
+        if sig == self._last_sig: return True
+        # RestBroker trả None khi bỏ edit (quá tải, lỗi thời, đã có edit ưu tiên hơn): không nhớ chữ ký để lượt sau gửi lại
+        if await self.edit(**kwargs) is not None:
+            self._last_sig = sig
+        return True
+
+class LiveViewScheduler:
+    def __init__(self, edits_per_sec=LIVE_VIEW_EDITS_PER_SEC, max_concurrent=LIVE_VIEW_MAX_CONCURRENT):
+        self.edits_per_sec = edits_per_sec
+        self._views = {}
+        self._sem = asyncio.Semaphore(max_concurrent)
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self.edits = 0
+        self.skipped = 0
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for view in list(self._views.values()):
+            await self._close(view, run_final=False)
+
+    def register(self, view: LiveView):
+        """Đăng ký view; view cũ cùng key (vd: gõ /info lần nữa) bị hủy"""
+        old = self._views.get(view.key)
+        if old: asyncio.create_task(self._close(old, run_final=False))
+        self._views[view.key] = view
+        self.start()
+        self._wakeup.set()
+        return view
+
+    def cancel(self, key):
+        view = self._views.get(key)
+        if view: asyncio.create_task(self._close(view, run_final=False))
+
+    def effective_interval(self, view):
+        """Chu kỳ thực tế: không nhanh hơn view.interval và không vượt ngân sách edit toàn cục"""
+        return max(view.interval, len(self._views) / self.edits_per_sec)
+
+    def stats(self):
+        return {"views": len(self._views), "edits": self.edits, "skipped": self.skipped,
+                "interval": len(self._views) / self.edits_per_sec}
+
+    async def _loop(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            deadline = None
+            for view in list(self._views.values()):
+                if view.busy or view.closed: continue
+                if now >= view.until:
+                    view.busy = True
+                    asyncio.create_task(self._close(view, run_final=view.final))
+                    continue
+                if now >= view.next_due:
+                    view.busy = True
+                    view.next_due = now + self.effective_interval(view)
+                    asyncio.create_task(self._update(view, now))
+                    continue
+                due = min(view.next_due, view.until)
+                deadline = due if deadline is None else min(deadline, due)
+            # Ngủ tới hạn gần nhất; không còn view rảnh thì chờ register() / _update() xong đánh thức
+            timeout = max(deadline - now, LIVE_VIEW_MIN_SLEEP) if deadline is not None else None
+            try: await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError: pass
+
+    async def _update(self, view, now):
+        try:
+            async with self._sem:
+                before = view._last_sig
+                keep = await view._apply(now)
+                if view._last_sig is before: self.skipped += 1
+                else: self.edits += 1
+        except Exception:
+            keep = False  # Tin nhắn bị xóa / hết hạn interaction
+        view.busy = False
+        self._wakeup.set()  # Vòng lặp bỏ qua view đang bận khi tính hạn kế tiếp
+        if not keep:
+            await self._close(view, run_final=False)
+
+    async def _close(self, view, run_final):
+        if view.closed: return
+        view.closed = True
+        if self._views.get(view.key) is view:
+            del self._views[view.key]
+        try:
+            if run_final: await view._apply(time.time())
+            if view.on_expire: await view.on_expire()
+        except Exception as e:
+            if not isinstance(e, asyncio.CancelledError):
+                rainbow_log(f"⚠️ [LiveView] Lỗi khi đóng {view.key}: {e}", is_italic=True)
+        if not view._done.done(): view._done.set_result(None)
@@ -0,0 +1,79 @@
+"""
+Rút thăm "Hào Quang Thái Dương" mỗi giờ ngay trong DB.
+Mỗi ngày dựng lại một bảng alias (Vose) trên toàn bộ đệ tử, lưu vào bảng lucky_alias theo slot 0..n-1.
+Mỗi lượt rút chỉ đọc đúng các slot được bốc (tra theo khóa chính) rồi ban buff cho người thắng
+bằng một câu INSERT ... SELECT, nên task hàng giờ tốn O(số người thắng) chứ không phải O(số đệ tử).
+Trọng số: uniform (như cũ), streak (chuỗi điểm danh) hoặc layer (cảnh giới), đặt qua LUCKY_DRAW_WEIGHT.
+"""
+import os
+import random
+import time
+from core.helpers import rainbow_log
+
+LUCKY_ALIAS_STATE = "lucky_alias"
+LUCKY_DRAW_WEIGHT = os.getenv("LUCKY_DRAW_WEIGHT", "uniform")
+LUCKY_DRAW_FRACTION = float(os.getenv("LUCKY_DRAW_FRACTION", "0.1"))  # Tỉ lệ đệ tử trúng mỗi giờ
+LUCKY_ALIAS_MAX_AGE = 86400  # Dựng lại bảng alias mỗi ngày (đệ tử mới, chuỗi điểm danh thay đổi)
+WEIGHT_CAP = 30              # Trọng số tối đa = 1 + 30, tránh một người gần như chắc trúng
+DRAW_ROUNDS = 8
+
+# Tên trọng số -> cột users dùng làm trọng số (None = đều nhau)
+WEIGHT_COLUMNS = {"uniform": None, "streak": "daily_streak", "layer": "layer"}
+
+def build_alias(weights):
+    """Bảng alias Vose: (prob, alias) sao cho bốc slot i đều nhau rồi giữ i với xác suất prob[i], không thì lấy alias[i]"""
+    n = len(weights)
+    total = float(sum(weights))
+    scaled = [w * n / total for w in weights]
+    prob, alias = [1.0] * n, list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s], alias[s] = scaled[s], l
+        scaled[l] += scaled[s] - 1
+        (small if scaled[l] < 1 else large).append(l)
+    return prob, alias
+
+def alias_rows(users):
+    """users: [(user_id, giá trị trọng số hoặc None)] -> [(slot, user_id, prob, alias_id)] để lưu vào lucky_alias"""
+    if not users: return []
+    weights = [1 + min(max(value or 0, 0), WEIGHT_CAP) for _, value in users]
+    prob, alias = build_alias(weights)
+    return [(i, users[i][0], prob[i], users[alias[i]][0]) for i in range(len(users))]
+
+async def pick_winners(n, count, fetch_slots):
+    """
+    Rút `count` người khác nhau từ bảng alias n slot. fetch_slots(slots) -> {slot: (user_id, prob, alias_id)}.
+    Trọng số lệch có thể bốc trùng nên rút thêm vài vòng, không đủ thì trả về ít hơn.
+    """
+    winners, seen = [], set()
+    count = min(count, n)
+    for _ in range(DRAW_ROUNDS):
+        need = count - len(winners)
+        if need <= 0: break
+        slots = random.sample(range(n), min(n, need * 2))
+        rows = await fetch_slots(slots)
+        for slot in slots:
+            row = rows.get(slot)
+            if row is None: continue
+            user_id, prob, alias_id = row
+            uid = user_id if random.random() < prob else alias_id
+            if uid in seen: continue
+            seen.add(uid)
+            winners.append(uid)
+            if len(winners) >= count: break
+    return winners
+
+async def lucky_draw(db, buff_id, expiry, weight=LUCKY_DRAW_WEIGHT, fraction=LUCKY_DRAW_FRACTION):
+    """Rút thăm và ban buff_id tới expiry cho khoảng `fraction` số đệ tử, trả về danh sách user_id trúng"""
+    column = WEIGHT_COLUMNS.get(weight)
+    state = await db.get_state(LUCKY_ALIAS_STATE)
+    if not state or state.get('weight') != column or time.time() - state.get('built', 0) > LUCKY_ALIAS_MAX_AGE:
+        started = time.perf_counter()
+        n = await db.rebuild_lucky_alias(column)
+        rainbow_log(f"🎲 [Thiên Đạo] Dựng bảng rút thăm ({weight}) cho {n} đệ tử trong {(time.perf_counter() - started) * 1000:.1f}ms.")
+    else:
+        n = state['n']
+    if not n: return []
+    return await db.draw_lucky_users(max(1, int(n * fraction)), buff_id, expiry)
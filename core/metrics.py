@@ -0,0 +1,176 @@
+"""
+Đo thời gian các thao tác DB: histogram độ trễ theo từng method / câu SQL (p50/p95/p99),
+số dòng trả về và log truy vấn chậm. Chi phí mỗi lần đo chỉ là 2 lần perf_counter + bisect.
+"""
+import functools
+import inspect
+import os
+import re
+import time
+from bisect import bisect_left
+from core.helpers import rainbow_log
+
+METRICS_ENABLED = os.getenv("DB_METRICS", "1").lower() not in ("0", "false", "no")
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "100"))
+
+# Biên trên các bucket (ms), tăng theo cấp số nhân 1.5 từ 0.02ms tới ~10 phút
+BUCKET_BOUNDS = [0.02 * 1.5 ** i for i in range(43)]
+
+class LatencyHistogram:
+    __slots__ = ("buckets", "count", "total", "max", "rows")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+    def add(self, ms, rows=0):
+        self.buckets[bisect_left(BUCKET_BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.rows += rows
+        if ms > self.max: self.max = ms
+
+    def percentile(self, q):
+        """Giá trị xấp xỉ (biên trên của bucket) tại phân vị q (0..1)"""
+        if not self.count: return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return min(BUCKET_BOUNDS[i], self.max) if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total,
+            "avg_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max,
+            "rows": self.rows,
+        }
+
+class Metrics:
+    """Sổ đo dùng chung: tên thao tác -> LatencyHistogram"""
+
+    def __init__(self, enabled=METRICS_ENABLED, slow_ms=SLOW_QUERY_MS):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.started = time.time()
+        self.slow_count = 0
+        self._hist = {}
+
+    def record(self, name, ms, rows=0):
+        hist = self._hist.get(name)
+        if hist is None:
+            hist = self._hist[name] = LatencyHistogram()
+        hist.add(ms, rows)
+
+    def record_query(self, sql, params, ms, rows=0):
+        key = query_key(sql)
+        self.record(key, ms, rows)
+        if ms >= self.slow_ms:
+            self.slow_count += 1
+            shown = repr(params)
+            if len(shown) > 200: shown = shown[:200] + "..."
+            rainbow_log(f"🐢 [DB] Truy vấn chậm {ms:.1f}ms: {key[5:]} | params={shown}")
+
+    def snapshot(self):
+        """{tên: thống kê}, sắp theo tổng thời gian giảm dần"""
+        snap = {name: h.snapshot() for name, h in self._hist.items()}
+        return dict(sorted(snap.items(), key=lambda x: -x[1]['total_ms']))
+
+    def reset(self):
+        self._hist.clear()
+        self.slow_count = 0
+        self.started = time.time()
+
+metrics = Metrics()
+
+_IN_LIST = re.compile(r"\(\?(?:,\s*\?)*\)")
+
+@functools.lru_cache(maxsize=512)
+def query_key(sql):
+    """Gom các câu SQL cùng dạng: bỏ khoảng trắng thừa, IN (?, ?, ...) -> IN (?...)"""
+    return "sql: " + _IN_LIST.sub("(?...)", " ".join(sql.split()))
+
+def _row_count(result):
+    return len(result) if isinstance(result, (list, tuple)) else 0
+
+class _TimedResult:
+    """Bọc kết quả conn.execute(): vẫn dùng được cả `await` lẫn `async with`"""
+
+    def __init__(self, result, sql, params, metrics):
+        self._result = result
+        self._sql = sql
+        self._params = params
+        self._metrics = metrics
+        self._cursor = None
+
+    async def _run(self):
+        started = time.perf_counter()
+        cursor = await self._result
+        # rowcount chỉ có nghĩa với INSERT/UPDATE/DELETE (SELECT là -1)
+        self._metrics.record_query(self._sql, self._params, (time.perf_counter() - started) * 1000, max(cursor.rowcount, 0))
+        return cursor
+
+    def __await__(self):
+        return self._run().__await__()
+
+    async def __aenter__(self):
+        self._cursor = await self._run()
+        return self._cursor
+
+    async def __aexit__(self, *exc):
+        await self._cursor.close()
+
+class TimedConnection:
+    """Proxy kết nối aiosqlite: đo execute / executemany / execute_fetchall, phần còn lại chuyển thẳng"""
+
+    def __init__(self, conn, metrics=metrics):
+        self._conn = conn
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def execute(self, sql, parameters=None):
+        return _TimedResult(self._conn.execute(sql, parameters), sql, parameters, self._metrics)
+
+    async def executemany(self, sql, parameters):
+        parameters = list(parameters)
+        started = time.perf_counter()
+        cursor = await self._conn.executemany(sql, parameters)
+        self._metrics.record_query(sql, f"<{len(parameters)} dòng>", (time.perf_counter() - started) * 1000, len(parameters))
+        return cursor
+
+    async def execute_fetchall(self, sql, parameters=None):
+        started = time.perf_counter()
+        rows = await self._conn.execute_fetchall(sql, parameters)
+        self._metrics.record_query(sql, parameters, (time.perf_counter() - started) * 1000, len(rows))
+        return rows
+
+def instrument(cls):
+    """Class decorator: đo mọi coroutine method public của cls dưới tên `Class.method`"""
+    for name, fn in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(fn):
+            continue
+        setattr(cls, name, _timed(f"{cls.__name__}.{name}", fn))
+    return cls
+
+def _timed(label, fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return await fn(*args, **kwargs)
+        started = time.perf_counter()
+        result = await fn(*args, **kwargs)
+        metrics.record(label, (time.perf_counter() - started) * 1000, _row_count(result))
+        return result
+    return wrapper
@@ -1,42 +1,157 @@
+import argparse
+import asyncio
 import json
 import os
-from core.database import Database
+import time
+from core.database import Database, DB_PATH, MISSION_INSERT_SQL
 from core.helpers import rainbow_log
 
-async def migrate_data(db: Database):
-    json_path = "tu_tien_v5.json"
+LEGACY_JSON_PATH = "tu_tien_v5.json"
+IMPORT_BATCH_SIZE = 5000
+READ_CHUNK_SIZE = 1 << 20
+
+USER_UPSERT_SQL = """
+    INSERT INTO users (user_id, name, layer, exp, goal, last_mission_reset, missions_completed, last_daily, last_daily_date, daily_streak)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        name = excluded.name, layer = excluded.layer, exp = excluded.exp, goal = excluded.goal,
+        last_mission_reset = excluded.last_mission_reset, missions_completed = excluded.missions_completed,
+        last_daily = excluded.last_daily, last_daily_date = excluded.last_daily_date, daily_streak = excluded.daily_streak
+"""
+
+def iter_legacy_users(path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Đọc dần file JSON cũ dạng {"user_id": {...}, ...} và yield (user_id, dict).
+    Chỉ giữ trong RAM một đoạn file cùng user đang parse, không json.load cả file.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buf, pos, eof = "", 0, False
+        started = False
+
+        def skip(p, chars=" \t\r\n"):
+            while p < len(buf) and buf[p] in chars: p += 1
+            return p
+
+        while True:
+            pos = skip(pos, " \t\r\n," if started else " \t\r\n")
+            item = None
+            if pos < len(buf):
+                if not started:
+                    if buf[pos] != "{": raise ValueError("File JSON cũ phải là một object {user_id: data}")
+                    started = True
+                    pos += 1
+                    continue
+                if buf[pos] == "}": return
+                try:
+                    key, end = decoder.raw_decode(buf, pos)
+                    end = skip(end)
+                    if end < len(buf):
+                        if buf[end] != ":": raise ValueError(f"Thiếu ':' sau khóa {key!r}")
+                        value, end = decoder.raw_decode(buf, skip(end + 1))
+                        item = (key, value)
+                except json.JSONDecodeError:
+                    if eof: raise
+            elif eof:
+                raise ValueError("File JSON cũ bị cắt ngang")
+
+            if item:
+                pos = end
+                yield item
+                continue
+            # Chưa đủ dữ liệu: bỏ phần đã parse, đọc thêm một đoạn
+            chunk = f.read(chunk_size)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+
+def _user_params(uid, u):
+    return (
+        uid, u.get('name', 'Ẩn danh'), u.get('layer', 1), u.get('exp', 0), u.get('goal', 200),
+        u.get('last_mission_reset', 0), u.get('missions_completed', 0), u.get('last_daily', 0),
+        u.get('last_daily_date', ''), u.get('daily_streak', 0)
+    )
+
+async def _write_batch(db: Database, batch, state_key, checkpoint):
+    """Ghi một lô user + checkpoint trong cùng một transaction"""
+    user_rows, mission_rows = [], []
+    for uid, u in batch:
+        user_rows.append(_user_params(uid, u))
+        cm = u.get('current_mission') or {}
+        for m in u.get('missions') or []:
+            end_time = cm.get('end_time') if cm.get('id') == m.get('id') else None
+            mission_rows.append(db._mission_params(uid, m, end_time))
+    async with db.write() as conn:
+        await conn.executemany(USER_UPSERT_SQL, user_rows)
+        await conn.executemany("DELETE FROM user_missions WHERE user_id = ?", [(uid,) for uid, _ in batch])
+        await conn.executemany(MISSION_INSERT_SQL, mission_rows)
+        await db.set_state(state_key, checkpoint, db=conn)
+
+async def import_legacy_json(db: Database, json_path=LEGACY_JSON_PATH, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Nhập file JSON cũ theo lô (executemany). Mỗi lô là một transaction kèm checkpoint
+    trong app_state, bị ngắt giữa chừng thì lần sau chạy tiếp từ lô kế tiếp.
+    Trả về số đệ tử đã nhập trong lần chạy này.
+    """
+    state_key = f"import:{os.path.basename(json_path)}"
+    size = os.path.getsize(json_path)
+    checkpoint = await db.get_state(state_key) or {}
+    skip = checkpoint.get('done', 0) if checkpoint.get('size') == size else 0
+    if skip:
+        rainbow_log(f"⏩ Tiếp tục di cư từ đệ tử thứ {skip + 1} (checkpoint).")
+
+    started = time.perf_counter()
+    done, imported, batch = 0, 0, []
+    for uid, u in iter_legacy_users(json_path):
+        done += 1
+        if done <= skip: continue
+        batch.append((uid, u))
+        if len(batch) >= batch_size:
+            await _write_batch(db, batch, state_key, {"done": done, "size": size})
+            imported += len(batch)
+            batch = []
+            rate = imported / max(time.perf_counter() - started, 1e-6)
+            rainbow_log(f"   📥 Đã di cư {done} đệ tử ({rate:,.0f} dòng/s)")
+    if batch:
+        await _write_batch(db, batch, state_key, {"done": done, "size": size})
+        imported += len(batch)
+
+    elapsed = time.perf_counter() - started
+    rainbow_log(f"✅ Di cư thành công {imported} đệ tử trong {elapsed:.1f}s ({imported / max(elapsed, 1e-6):,.0f} dòng/s)!")
+    await db.delete_state(state_key)
+    return imported
+
+async def migrate_data(db: Database, json_path=LEGACY_JSON_PATH):
+    if not isinstance(db, Database):
+        return  # Backend RAM: không có gì để di cư
     if not os.path.exists(json_path):
         rainbow_log("📂 Không tìm thấy file JSON cũ, bỏ qua migration.")
         return
 
     rainbow_log("🔄 Phát hiện database cũ, đang tiến hành di cư sang SQLite...")
     try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        
-        count = 0
-        for uid, u in data.items():
-            # Basic mapping
-            await db.create_user(uid, u.get('name', 'Ẩn danh'))
-            await db.update_user(
-                uid,
-                layer=u.get('layer', 1),
-                exp=u.get('exp', 0),
-                goal=u.get('goal', 200),
-                last_mission_reset=u.get('last_mission_reset', 0),
-                missions_completed=u.get('missions_completed', 0),
-                last_daily=u.get('last_daily', 0),
-                last_daily_date=u.get('last_daily_date', ''),
-                daily_streak=u.get('daily_streak', 0),
-                missions=u.get('missions', []),
-                current_mission=u.get('current_mission')
-            )
-            count += 1
-        
-        rainbow_log(f"✅ Di cư thành công {count} đệ tử!")
+        await import_legacy_json(db, json_path)
         # Rename file to avoid double migration
-        os.rename(json_path, f"tu_tien_v5.json.bak")
-        rainbow_log(f"💾 File cũ đã được lưu thành tu_tien_v5.json.bak")
+        os.rename(json_path, f"{json_path}.bak")
+        rainbow_log(f"💾 File cũ đã được lưu thành {json_path}.bak")
 
     except Exception as e:
         rainbow_log(f"❌ Di cư thất bại: {e}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Di cư file JSON cũ vào SQLite (chạy được khi bot đang tắt)")
+    parser.add_argument("json_path", nargs="?", default=LEGACY_JSON_PATH)
+    parser.add_argument("--db", default=DB_PATH, help="Đường dẫn file SQLite")
+    parser.add_argument("--batch", type=int, default=IMPORT_BATCH_SIZE, help="Số đệ tử mỗi lô")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    await db.initialize()
+    try:
+        if not os.path.exists(args.json_path):
+            rainbow_log(f"📂 Không tìm thấy {args.json_path}.")
+            return
+        await import_legacy_json(db, args.json_path, args.batch)
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,191 @@
+"""
+Kho nhiệm vụ AI sinh sẵn.
+Task nền thỉnh thị AI theo từng bậc độ khó vào giờ vắng (hoặc ngay khi một bậc tụt dưới ngưỡng thấp),
+kiểm tra kết quả rồi lưu vào bảng mission_pool. /nhiem_vu chỉ còn đọc kho: mỗi đợt lấy đều các bậc,
+bỏ những nhiệm vụ người đó đã nhận, kho thiếu thì bù bằng bí tịch Fallback.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime
+from core.helpers import rainbow_log, ask_ancestor, VN_TZ
+from core.game_data import CultivationData
+
+# Độ khó 1-10 chia thành 5 bậc: (1-2), (3-4), ... (9-10)
+POOL_TIERS = 5
+POOL_TARGET = int(os.getenv("MISSION_POOL_TARGET", "40"))             # Số nhiệm vụ mỗi bậc muốn giữ
+POOL_LOW_WATERMARK = int(os.getenv("MISSION_POOL_LOW_WATERMARK", "10"))  # Dưới mức này thì sinh ngay, không chờ giờ vắng
+POOL_MAX_USES = int(os.getenv("MISSION_POOL_MAX_USES", "30"))           # Phát đủ bấy nhiêu lần thì bỏ để kho luôn mới
+POOL_QUIET_HOURS = os.getenv("MISSION_POOL_QUIET_HOURS", "1-6")         # Giờ vắng (giờ VN), dạng "bắt đầu-kết thúc"
+POOL_SEEN_DAYS = 7
+POOL_BATCH = 15
+POOL_CHECK_SECONDS = 600
+
+def tier_of(difficulty: int) -> int:
+    return min(POOL_TIERS, max(1, (int(difficulty) + 1) // 2))
+
+def _clamp(value, low, high, default):
+    try: return min(high, max(low, int(value)))
+    except (TypeError, ValueError): return default
+
+def validate_mission(raw, tier):
+    """Chuẩn hóa một nhiệm vụ AI trả về cho bậc `tier`, None nếu không dùng được"""
+    if not isinstance(raw, dict): return None
+    title, desc = raw.get('title'), raw.get('desc')
+    if not isinstance(title, str) or not isinstance(desc, str): return None
+    title, desc = title.strip(), desc.strip()
+    if not 3 <= len(title) <= 80 or not desc or len(desc) > 300: return None
+    diff = _clamp(raw.get('diff'), 2 * tier - 1, 2 * tier, 2 * tier - 1)
+    return {
+        "tier": tier,
+        "title": title,
+        "desc": desc,
+        "difficulty": diff,
+        "time": _clamp(raw.get('time'), 30, 300, diff * 30),
+        "reward": _clamp(raw.get('reward'), 500, 10000, diff * 500 + random.randint(100, 300)),
+    }
+
+def to_user_mission(i, m):
+    """Nhiệm vụ trong kho -> nhiệm vụ của đệ tử (linh thạch, tỉ lệ thành công tính theo độ khó)"""
+    diff = m['difficulty']
+    return {
+        "id": i,
+        "title": m['title'],
+        "desc": m['desc'],
+        "difficulty": diff,
+        "time": m['time'],
+        "reward": m['reward'],
+        "stones": random.randint(5, 15) + (diff * 2), # Base stones
+        "success_rate": max(10, 100 - (diff * 8)),
+        "done": False
+    }
+
+def fallback_mission(i, diff):
+    """Bí tịch Fallback độ khó 1-5 như bản gốc (thấp nhất 40% thành công, tối đa 200s) để đệ tử luôn làm xong được"""
+    diff = min(POOL_TIERS, max(1, diff))
+    mission_title = CultivationData.get_random_mission()
+    return {
+        "id": i,
+        "title": mission_title,
+        "desc": f"Thực hiện {mission_title} để tích lũy kinh nghiệm.",
+        "difficulty": diff,
+        "time": diff * 40,
+        "reward": diff * 350 + random.randint(10, 50), # Random XP base
+        "stones": random.randint(5, 10) + diff, # Fallback stones
+        "success_rate": 100 - (diff * 12),
+        "done": False
+    }
+
+def tier_counts(count):
+    """Chia đều `count` nhiệm vụ cho các bậc: 5 -> mỗi bậc 1, 10 -> mỗi bậc 2"""
+    return {t: count // POOL_TIERS + (1 if t <= count % POOL_TIERS else 0) for t in range(1, POOL_TIERS + 1)}
+
+def _quiet_hours():
+    try:
+        start, end = (int(x) for x in POOL_QUIET_HOURS.split("-"))
+    except ValueError:
+        return set()
+    return {h % 24 for h in range(start, end if end > start else end + 24)}
+
+class MissionPool:
+    def __init__(self, db):
+        self.db = db
+        self.quiet_hours = _quiet_hours()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.handed_out = 0
+        self.fallbacks = 0
+        self.generated = 0
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Hủy task nạp kho và chờ nó dừng hẳn (không để refill chạy dở khi cog unload / DB đóng)"""
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            try: await task
+            except asyncio.CancelledError: pass
+
+    def stats(self):
+        return {"handed_out": self.handed_out, "fallbacks": self.fallbacks, "generated": self.generated}
+
+    async def take(self, user_id: str, count: int):
+        """Một đợt `count` nhiệm vụ cho user, sắp theo độ khó - chỉ đọc kho, bậc nào cạn thì bù Fallback"""
+        wanted = tier_counts(count)
+        rows = await self.db.take_pool_missions(user_id, wanted)
+        got = {}
+        for r in rows: got[r['tier']] = got.get(r['tier'], 0) + 1
+        missing = [(t, n - got.get(t, 0)) for t, n in wanted.items() if n > got.get(t, 0)]
+
+        # Fallback của bậc `tier` đứng cạnh nhiệm vụ kho cùng bậc nhưng giữ độ khó gốc 1-5 (bậc 5 mà lấy độ khó 9 thì tỉ lệ âm)
+        batch = [(r['difficulty'], r, None) for r in rows]
+        for tier, n in missing:
+            for _ in range(n):
+                batch.append((2 * tier - 1, None, tier))
+        batch.sort(key=lambda x: x[0])
+        missions = [to_user_mission(i + 1, r) if r else fallback_mission(i + 1, tier) for i, (_, r, tier) in enumerate(batch)]
+
+        self.handed_out += len(rows)
+        if missing:
+            self.fallbacks += sum(n for _, n in missing)
+            self._wakeup.set()
+        return missions
+
+    async def _generate(self, tier, n):
+        """Thỉnh thị AI sinh n nhiệm vụ cho một bậc, trả về số nhiệm vụ mới vào kho (None nếu AI không trả lời)"""
+        low, high = 2 * tier - 1, 2 * tier
+        prompt = (
+            f"Tạo {n} nhiệm vụ tu tiên ngắn gọn, thâm sâu, tiêu đề không trùng nhau. "
+            f"Độ khó (diff) từ {low} đến {high} trên thang 1 (Dễ) đến 10 (Cực khó). "
+            f"Phần thưởng (reward) từ {low * 500} đến {min(10000, high * 1000)}. "
+            "Thời gian thực hiện (time) từ 30 đến 300 giây. "
+            "Format JSON: {'missions': [{'title': '...', 'desc': '...', 'diff': int, 'reward': int, 'time': int}]}"
+        )
+        ai_res = await ask_ancestor("Người tạo nhiệm vụ tu tiên.", prompt, json_mode=True)
+        if not ai_res: return None
+        try:
+            raw = json.loads(ai_res)
+        except ValueError as e:
+            rainbow_log(f"⚠️ [Kho Nhiệm Vụ] AI trả về JSON hỏng (bậc {tier}): {e}")
+            return 0
+        if isinstance(raw, dict): raw = raw.get('missions', [])
+        missions = [m for m in (validate_mission(r, tier) for r in raw if r) if m] if isinstance(raw, list) else []
+        added = await self.db.add_pool_missions(missions) if missions else 0
+        self.generated += added
+        return added
+
+    async def refill(self, quiet=False):
+        """Nạp bậc nào dưới ngưỡng thấp (hoặc dưới mục tiêu nếu đang giờ vắng), trả về số nhiệm vụ mới"""
+        counts = await self.db.mission_pool_counts()
+        total = 0
+        for tier in range(1, POOL_TIERS + 1):
+            have = counts.get(tier, 0)
+            if have >= POOL_TARGET or (have >= POOL_LOW_WATERMARK and not quiet): continue
+            # Mỗi vòng chỉ sinh một lượt cho mỗi bậc để không dồn request AI
+            added = await self._generate(tier, min(POOL_BATCH, POOL_TARGET - have))
+            if added is None: return total  # Không có AI -> dùng Fallback
+            total += added
+        if total:
+            rainbow_log(f"🔮 [Kho Nhiệm Vụ] Tổ Sư Từ Dương ban thêm {total} công khóa vào kho.")
+        return total
+
+    async def _loop(self):
+        last_prune = 0
+        while True:
+            # Clear trước khi nạp: wakeup() tới trong lúc refill vẫn được giữ cho vòng sau
+            self._wakeup.clear()
+            try:
+                quiet = datetime.now(VN_TZ).hour in self.quiet_hours
+                await self.refill(quiet)
+                if time.time() - last_prune > 86400:
+                    await self.db.prune_mission_pool(POOL_MAX_USES, time.time() - POOL_SEEN_DAYS * 86400)
+                    last_prune = time.time()
+            except Exception as e:
+                rainbow_log(f"⚠️ [Kho Nhiệm Vụ] Nạp kho thất bại: {e}")
+            try: await asyncio.wait_for(self._wakeup.wait(), POOL_CHECK_SECONDS)
+            except asyncio.TimeoutError: pass
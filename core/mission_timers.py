@@ -0,0 +1,76 @@
+"""
+Hàng đợi hẹn giờ chốt nhiệm vụ phía máy chủ.
+Nguồn sự thật là cột user_missions.end_time trong DB; khi khởi động mọi nhiệm vụ đang làm dở
+được nạp vào một heap trong RAM, một task duy nhất ngủ tới end_time sớm nhất rồi gọi on_due.
+Bot tắt giữa chừng thì lần khởi động sau nhiệm vụ quá hạn được chốt ngay.
+"""
+import asyncio
+import heapq
+import time
+from core.helpers import rainbow_log
+
+class MissionTimers:
+    def __init__(self, db, on_due):
+        """on_due(user_id, mission_id) là coroutine chốt kết quả (tự giành quyền chốt qua clear_current_mission)"""
+        self.db = db
+        self.on_due = on_due
+        self._heap = []     # (end_time, user_id, mission_id)
+        self._latest = {}   # user_id -> (mission_id, end_time) đang hẹn, mục cũ hơn trong heap bị bỏ qua
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.fired = 0
+
+    async def load(self):
+        """Nạp lại các nhiệm vụ đang làm dở từ DB, trả về số hẹn giờ"""
+        timers = await self.db.get_mission_timers()
+        for user_id, mission_id, end_time in timers:
+            self.schedule(user_id, mission_id, end_time)
+        return len(timers)
+
+    async def reload(self):
+        """Bỏ toàn bộ hẹn giờ rồi nạp lại từ DB (sau khi khôi phục backup)"""
+        self._heap.clear()
+        self._latest.clear()
+        self._wakeup.set()
+        return await self.load()
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def schedule(self, user_id, mission_id, end_time):
+        user_id = str(user_id)
+        self._latest[user_id] = (int(mission_id), end_time)
+        heapq.heappush(self._heap, (end_time, user_id, int(mission_id)))
+        self._wakeup.set()
+
+    def cancel(self, user_id):
+        self._latest.pop(str(user_id), None)
+
+    def stats(self):
+        return {"scheduled": len(self._latest), "heap": len(self._heap), "fired": self.fired}
+
+    async def _loop(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                end_time, user_id, mission_id = heapq.heappop(self._heap)
+                if self._latest.get(user_id) != (mission_id, end_time): continue  # Đã bị hủy / thay thế
+                del self._latest[user_id]
+                self.fired += 1
+                asyncio.create_task(self._fire(user_id, mission_id))
+            timeout = self._heap[0][0] - now if self._heap else None
+            try: await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError: pass
+
+    async def _fire(self, user_id, mission_id):
+        try:
+            await self.on_due(user_id, mission_id)
+        except Exception as e:
+            rainbow_log(f"⚠️ [Nhiệm Vụ] Chốt nhiệm vụ {mission_id} của {user_id} thất bại: {e}")
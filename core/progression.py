@@ -0,0 +1,46 @@
+"""
+Công thức đột phá cảnh giới dùng chung cho mọi đường phát thưởng.
+Ngưỡng tầng L là goal_for(L) = max(L * 1000, 200); riêng tầng hiện tại dùng goal đang lưu trong DB
+(đệ tử mới có goal 200). Số tầng đột phá được tính trực tiếp bằng công thức tổng cấp số cộng,
+không lặp từng tầng nên một lần ban thưởng lớn cũng chỉ tốn O(1).
+"""
+from math import isqrt
+
+GOAL_PER_LAYER = 1000
+MIN_GOAL = 200
+
+def goal_for(layer: int) -> int:
+    """EXP cần để đột phá khỏi tầng `layer`"""
+    return max(layer * GOAL_PER_LAYER, MIN_GOAL)
+
+def level_up(layer: int, exp: int, goal: int):
+    """
+    Tương đương vòng `while exp >= goal: exp -= goal; layer += 1; goal = goal_for(layer)`.
+    Trả về (layer, exp, goal) sau khi đột phá hết mức có thể.
+    """
+    if goal <= 0: goal = goal_for(layer)
+    if exp < goal: return layer, exp, goal
+    exp -= goal
+    layer += 1
+    # Từ đây ngưỡng là a*1000, (a+1)*1000, ... (a >= 2 nên MIN_GOAL không còn tác dụng):
+    # k tầng tốn 1000 * (k*a + k(k-1)/2) -> k lớn nhất thỏa k^2 + (2a-1)k <= 2*(exp // 1000)
+    a = layer
+    budget = exp // GOAL_PER_LAYER
+    b = 2 * a - 1
+    k = (isqrt(b * b + 8 * budget) - b) // 2
+    exp -= GOAL_PER_LAYER * (k * a + k * (k - 1) // 2)
+    layer += k
+    return layer, exp, goal_for(layer)
+
+def batch_level_up(rows):
+    """rows: [(user_id, layer, exp, goal)] -> [(user_id, layer, exp, goal)] mới của những người có đột phá"""
+    changed = []
+    for user_id, layer, exp, goal in rows:
+        new = level_up(layer, exp, goal)
+        if new[0] != layer:
+            changed.append((user_id, *new))
+    return changed
+
+def level_up_result(user: dict):
+    """(có đột phá không, tầng hiện tại) từ user trả về bởi apply_delta(..., level_up=True)"""
+    return user.get('layer_gained', 0) > 0, user['layer']
@@ -0,0 +1,114 @@
+"""
+Kiểm tra EXPLAIN QUERY PLAN cho các câu lệnh bot chạy thường xuyên.
+Chạy: python -m core.query_plans [đường_dẫn_db]
+Thoát với mã 1 nếu có truy vấn "nóng" phải quét cả bảng hoặc sort bằng B-tree tạm.
+"""
+import asyncio
+import sys
+from core import database as sql
+from core.database import Database, DB_PATH
+
+def _marks(n):
+    return ", ".join("?" * n)
+
+# (tên, SQL, tham số mẫu, hot) - hot=False là truy vấn chủ ý đọc cả bảng (task nền, migration).
+# Câu lệnh lấy từ hằng *_SQL trong core/database.py; phần {} được ghép như hàm gọi thật.
+QUERIES = [
+    # core/database.py - users
+    ("get_user", sql.USER_SELECT_SQL, ("1",), True),
+    ("update_user", sql.USER_UPDATE_SQL.format(assignments="exp = ?"), (1, "1"), True),
+    ("apply_delta", sql.USER_DELTA_SQL.format(assignments="exp = exp + ?"), (1, "1"), True),
+    ("level_up", sql.USER_LEVEL_SQL, (1, 1, 1, "1"), True),
+    ("create_user", sql.USER_INSERT_SQL, ("1", "a"), True),
+    ("get_top_users", sql.TOP_USERS_SQL, (10,), True),
+    ("get_all_users", sql.ALL_USERS_SQL, (), False),
+    ("iter_users", sql.ITER_USERS_SQL.format(columns="user_id, layer, name", cond=""), ("", 500), True),
+    ("iter_users_reminder", sql.ITER_USERS_SQL.format(columns="user_id, daily_streak", cond=" AND last_daily_date IS NOT ?"),
+     ("", "2026-01-01", 500), True),
+    ("count_users_daily", sql.COUNT_USERS_SQL.format(cond=" WHERE last_daily_date IS ?"), ("2026-01-01",), True),
+    # core/database.py - bảng con
+    ("items_of_user", sql.ITEMS_OF_USER_SQL, ("1",), True),
+    ("items_of_users", sql.ITEMS_OF_USERS_SQL.format(marks=_marks(2)), ("1", "2"), True),
+    ("missions_of_users", sql.MISSIONS_OF_USERS_SQL.format(marks=_marks(2)), ("1", "2"), True),
+    ("buffs_of_users", sql.BUFFS_OF_USERS_SQL.format(marks=_marks(2)), ("1", "2"), True),
+    ("add_item", sql.ITEM_ADD_SQL, ("1", "x", 1), True),
+    ("set_item", sql.ITEM_SET_SQL, ("1", "x", 1, 0), True),
+    ("buy_item", sql.BUY_DEBIT_SQL, (1, "1", 1), True),
+    ("consume_item", sql.ITEM_CONSUME_SQL, (0, 0, 0, "1", "x"), True),
+    ("prune_inventory", sql.ITEM_PRUNE_SQL, ("1", 0), True),
+    ("expire_inventory", sql.ITEM_EXPIRE_SQL, ("1", 0), True),
+    ("update_mission", sql.MISSION_UPDATE_SQL.format(assignments="done = ?"), (1, "1", 1), True),
+    ("clear_current_mission", sql.MISSION_CLEAR_SQL, ("1",), True),
+    ("claim_mission", sql.MISSION_CLAIM_SQL, ("1", 1), True),
+    ("mission_timers", sql.MISSION_TIMERS_SQL, (), False),
+    ("set_buff", sql.BUFF_SET_SQL, ("1", "x", 0), True),
+    # Quét users lúc khởi động / task nền để đột phá hàng loạt; điều kiện so hai cột nên index không giúp được
+    ("level_up_sweep", sql.LEVEL_UP_SWEEP_SQL, (), False),
+    # core/database.py - kho nhiệm vụ
+    ("mission_pool_counts", sql.POOL_COUNTS_SQL, (), False),
+    ("mission_pool_candidates", sql.POOL_CANDIDATES_SQL, (1, "1"), True),
+    ("mission_pool_use", sql.POOL_USE_SQL, (1,), True),
+    ("mission_seen_prune", sql.POOL_SEEN_PRUNE_SQL, (0,), True),
+    # core/database.py - rút thăm buff (dựng alias quét users một lần mỗi ngày, lượt rút chỉ tra slot)
+    ("lucky_alias_rebuild", sql.LUCKY_WEIGHTS_SQL.format(weight="daily_streak"), (), False),
+    ("lucky_alias_slots", sql.LUCKY_SLOTS_SQL.format(marks=_marks(2)), (1, 2), True),
+    ("lucky_grant_buff", sql.LUCKY_GRANT_SQL.format(marks=_marks(2)), ("x", 0, "1", "2"), True),
+    # core/database.py - reset ngày (task 7h sáng). Bỏ qua có chủ ý: lúc reset gần như mọi dòng users đều có
+    # last_mission_reset < mốc hôm nay nên index trên cột đó vẫn phải đọc cả bảng, lại tốn thêm một lần ghi index
+    # mỗi khi cột đổi; câu DELETE chỉ chạy một lần mỗi ngày trong transaction riêng.
+    ("daily_reset_missions", sql.DAILY_RESET_MISSIONS_SQL, (0,), False),
+    ("daily_reset_users", sql.DAILY_RESET_USERS_SQL, (0, 0, 0, 0), False),
+    # core/database.py - ledger (index phủ (user_id, reason, ...) cho GROUP BY reason không cần sort tạm)
+    ("ledger_insert", sql.LEDGER_INSERT_SQL, ("1", 0, "x", 1, 1), True),
+    ("ledger_summary_user", sql.LEDGER_SUMMARY_SQL.format(where="WHERE user_id = ? AND ts >= ?"), ("1", 0), True),
+    ("ledger_daily_user", sql.LEDGER_DAILY_SUMMARY_SQL.format(where="WHERE user_id = ? AND day >= ?"), ("1", "2026-01-01"), True),
+    ("ledger_compact_delete", sql.LEDGER_PURGE_SQL, (0,), True),
+    # core/database.py - sects
+    ("get_all_sects", sql.ALL_SECTS_SQL, (), True),
+    ("set_sect_leader", sql.SECT_UPDATE_SQL.format(assignments="leader_id = ?"), ("1", 1), True),
+    ("update_sect_exp", sql.SECT_ADD_EXP_SQL, (1, 1), True),
+    ("create_sect", sql.SECT_INSERT_SQL, ("a", "1"), True),
+    ("get_sect", sql.SECT_WHERE_SQL.format(cond="sect_id = ?"), (1,), True),
+    ("get_sect_by_name", sql.SECT_WHERE_SQL.format(cond="name = ?"), ("a",), True),
+    ("get_sect_by_leader", sql.SECT_WHERE_SQL.format(cond="leader_id = ? LIMIT 1"), ("1",), True),
+    ("delete_sect", sql.SECT_DELETE_SQL, (1,), True),
+    ("delete_sect_members", sql.SECT_RELEASE_MEMBERS_SQL, (1,), True),
+    ("get_sect_members", sql.SECT_MEMBERS_SQL, (1, None), True),
+    ("count_sect_members", sql.SECT_COUNT_MEMBERS_SQL, (1,), True),
+]
+
+def find_problems(plan_rows):
+    """Trả về các dòng plan bị xem là chậm: quét cả bảng (không qua index) hoặc sort tạm"""
+    bad = []
+    for row in plan_rows:
+        detail = row[-1]
+        if detail.startswith("SCAN") and "INDEX" not in detail:
+            bad.append(detail)
+        elif "USE TEMP B-TREE" in detail:
+            bad.append(detail)
+    return bad
+
+async def check(db_path=DB_PATH):
+    db = Database(db_path)
+    await db.initialize()  # Áp migration (index) trước khi kiểm tra
+    await db.close()
+    # Mở lại pool: EXPLAIN không tự nạp lại schema trên kết nối đọc mở trước migration
+    await db.pool.open()
+    failures = 0
+    try:
+        async with db.read() as conn:
+            for name, sql, params, hot in QUERIES:
+                rows = await conn.execute_fetchall(f"EXPLAIN QUERY PLAN {sql}", params)
+                plan = " | ".join(r[-1] for r in rows)
+                bad = find_problems(rows) if hot else []
+                status = "FAIL" if bad else ("ok" if hot else "skip")
+                print(f"[{status:>4}] {name:<24} {plan}")
+                if bad: failures += 1
+    finally:
+        await db.pool.close()
+    print(f"\n{len(QUERIES)} truy vấn, {failures} truy vấn nóng bị quét bảng.")
+    return failures
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else DB_PATH
+    sys.exit(1 if asyncio.run(check(path)) else 0)
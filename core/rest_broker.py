@@ -0,0 +1,261 @@
+"""
+Điều phối mọi lệnh edit tin nhắn gửi lên Discord REST.
+Mỗi kênh / webhook (interaction) có một token bucket riêng, cộng thêm một bucket toàn cục.
+Edit được xếp theo mức ưu tiên (phản hồi > kết quả > tiến độ) nên thanh tiến độ không
+chen ngang câu trả lời của người dùng. Edit chưa gửi mà bị edit mới hơn cùng tin nhắn thay thế
+thì được gộp làm một; edit tiến độ chờ quá lâu hoặc kênh quá tải thì bị bỏ.
+Mỗi tin nhắn chỉ có một edit đang gửi tại một thời điểm, edit sau chờ edit trước xong nên không bị đảo thứ tự.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+import discord
+
+# Mức ưu tiên: số nhỏ gửi trước
+PRIORITY_RESPONSE = 0  # Câu trả lời trực tiếp cho lệnh
+PRIORITY_RESULT = 1    # Kết quả cuối (tu luyện xong, nhiệm vụ xong...)
+PRIORITY_PROGRESS = 2  # Thanh tiến độ, bảng cập nhật định kỳ (có thể bỏ)
+
+# Discord cho phép khoảng 5 edit / 5s mỗi kênh và ~50 request/s toàn bot
+REST_ROUTE_RATE = float(os.getenv("REST_ROUTE_RATE", "1"))
+REST_ROUTE_BURST = float(os.getenv("REST_ROUTE_BURST", "5"))
+REST_GLOBAL_RATE = float(os.getenv("REST_GLOBAL_RATE", "40"))
+REST_MAX_IN_FLIGHT = 8
+# Edit tiến độ chờ quá lâu thì đã lỗi thời, bỏ luôn
+PROGRESS_MAX_AGE = 10.0
+# Mỗi route tối đa bấy nhiêu edit tiến độ chờ gửi, vượt thì bỏ edit mới
+PROGRESS_MAX_BACKLOG = 20
+BUCKET_IDLE_SECONDS = 300
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self, now):
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self):
+        self.tokens -= 1
+
+    def wait_time(self, now):
+        """Số giây tới khi có đủ 1 token"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+def _target_info(target):
+    """(khóa tin nhắn, route rate limit, hàm edit) của Message / WebhookMessage / Interaction"""
+    if isinstance(target, discord.Interaction):
+        return f"interaction:{target.id}", f"webhook:{hash(target.token)}", target.edit_original_response
+    # Tin nhắn followup / ephemeral được edit qua webhook của interaction chứ không qua kênh
+    hook = getattr(getattr(target, "_state", None), "_webhook", None)
+    if hook is not None and getattr(hook, "token", None):
+        return f"message:{target.id}", f"webhook:{hash(hook.token)}", target.edit
+    return f"message:{target.id}", f"channel:{target.channel.id}", target.edit
+
+class _Edit:
+    __slots__ = ("key", "route", "fn", "kwargs", "priority", "created", "futures", "seq")
+
+    def __init__(self, key, route, fn, kwargs, priority, seq):
+        self.key = key
+        self.route = route
+        self.fn = fn
+        self.kwargs = kwargs
+        self.priority = priority
+        self.created = time.monotonic()
+        self.futures = []
+        self.seq = seq
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class RestBroker:
+    def __init__(self, route_rate=REST_ROUTE_RATE, route_burst=REST_ROUTE_BURST, global_rate=REST_GLOBAL_RATE):
+        self.route_rate = route_rate
+        self.route_burst = route_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets = {}
+        self._heap = []
+        self._pending = {}  # khóa tin nhắn -> _Edit chưa gửi (để gộp)
+        self._sending = {}  # khóa tin nhắn -> mức ưu tiên của edit đang gửi
+        self._backlog = {}  # route -> số edit tiến độ đang chờ
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(REST_MAX_IN_FLIGHT)
+        self._task = None
+        self.counters = {"sent": 0, "merged": 0, "dropped": 0, "failed": 0}
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        # Edit còn lại: tiến độ bỏ luôn, còn lại gửi thẳng để không mất kết quả
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            self._pending.pop(item.key, None)
+            if item.priority >= PRIORITY_PROGRESS:
+                self._resolve(item, None)
+            else:
+                await self._send(item)
+        self._backlog.clear()
+
+    def edit(self, target, priority=PRIORITY_RESPONSE, **kwargs):
+        """Xếp một edit vào hàng đợi, trả về future (kết quả của hàm edit, None nếu bị bỏ)"""
+        key, route, fn = _target_info(target)
+        return self.submit(key, route, fn, kwargs, priority)
+
+    def editor(self, target, priority=PRIORITY_PROGRESS):
+        """Hàm edit(**kwargs) dùng thay msg.edit (vd: cho LiveView)"""
+        async def edit(**kwargs):
+            return await self.edit(target, priority, **kwargs)
+        return edit
+
+    def submit(self, key, route, fn, kwargs, priority):
+        future = asyncio.get_running_loop().create_future()
+        item = self._pending.get(key)
+        if not item and priority >= PRIORITY_PROGRESS and self._sending.get(key, PRIORITY_PROGRESS) < PRIORITY_PROGRESS:
+            # Kết quả cuối đang trên đường gửi -> tiến độ tới sau chỉ ghi đè nó, bỏ luôn
+            self.counters["dropped"] += 1
+            future.set_result(None)
+            return future
+        if item:
+            if item.priority < priority:
+                # Edit đang chờ quan trọng hơn (vd: kết quả cuối) -> bỏ edit tiến độ tới sau, không ghi đè
+                self.counters["dropped"] += 1
+                future.set_result(None)
+                return future
+            # Edit mới thay thế phần trùng của edit chưa gửi -> gửi một lần với trạng thái cuối
+            item.kwargs = {**item.kwargs, **kwargs}
+            item.fn = fn
+            item.futures.append(future)
+            if priority < item.priority:
+                if item.priority >= PRIORITY_PROGRESS: self._backlog[item.route] -= 1
+                item.priority = priority
+                heapq.heapify(self._heap)
+            self.counters["merged"] += 1
+            return future
+
+        if priority >= PRIORITY_PROGRESS:
+            if self._backlog.get(route, 0) >= PROGRESS_MAX_BACKLOG:
+                self.counters["dropped"] += 1
+                future.set_result(None)
+                return future
+            self._backlog[route] = self._backlog.get(route, 0) + 1
+
+        item = _Edit(key, route, fn, kwargs, priority, next(self._seq))
+        item.futures.append(future)
+        self._pending[key] = item
+        heapq.heappush(self._heap, item)
+        self.start()
+        self._wakeup.set()
+        return future
+
+    def stats(self):
+        return {**self.counters, "queued": len(self._heap), "routes": len(self._buckets)}
+
+    def _bucket(self, route):
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            bucket = self._buckets[route] = TokenBucket(self.route_rate, self.route_burst)
+        return bucket
+
+    def _resolve(self, item, result=None, error=None):
+        for future in item.futures:
+            if future.done(): continue
+            if error is not None: future.set_exception(error)
+            else: future.set_result(result)
+
+    def _dequeue(self, item):
+        self._pending.pop(item.key, None)
+        if item.priority >= PRIORITY_PROGRESS:
+            self._backlog[item.route] -= 1
+            if not self._backlog[item.route]: del self._backlog[item.route]
+
+    async def _loop(self):
+        last_prune = time.monotonic()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            now = time.monotonic()
+            delay = self._dispatch(now)
+            if now - last_prune > BUCKET_IDLE_SECONDS:
+                self._prune_buckets(now)
+                last_prune = now
+            # Còn edit nhưng không có hạn chờ: tất cả đang đợi edit trước cùng tin nhắn, _send xong sẽ đánh thức
+            if delay or self._heap:
+                self._wakeup.clear()
+                try: await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError: pass
+
+    def _dispatch(self, now):
+        """Gửi các edit có thể gửi ngay theo thứ tự ưu tiên, trả về thời gian chờ tới lượt kế tiếp"""
+        deferred = []
+        delay = None
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            if item.priority >= PRIORITY_PROGRESS and now - item.created > PROGRESS_MAX_AGE:
+                self._dequeue(item)
+                self.counters["dropped"] += len(item.futures)
+                self._resolve(item, None)
+                continue
+            if item.key in self._sending:
+                # Giữ lại tới khi edit trước của tin nhắn này gửi xong
+                deferred.append(item)
+                continue
+            if not self._global.ready(now):
+                deferred.append(item)
+                delay = self._global.wait_time(now)
+                break
+            bucket = self._bucket(item.route)
+            if not bucket.ready(now):
+                # Route này hết lượt, edit ưu tiên thấp hơn ở route khác vẫn được đi
+                deferred.append(item)
+                wait = bucket.wait_time(now)
+                delay = wait if delay is None else min(delay, wait)
+                continue
+            bucket.take()
+            self._global.take()
+            self._dequeue(item)
+            self._sending[item.key] = item.priority
+            asyncio.create_task(self._send(item))
+        for item in deferred:
+            heapq.heappush(self._heap, item)
+        return max(delay, 0.01) if delay is not None else None
+
+    async def _send(self, item):
+        try:
+            async with self._in_flight:
+                try:
+                    result = await item.fn(**item.kwargs)
+                except Exception as e:
+                    self.counters["failed"] += 1
+                    self._resolve(item, error=e)
+                    return
+            self.counters["sent"] += 1
+            self._resolve(item, result)
+        finally:
+            if self._sending.pop(item.key, None) is not None and item.key in self._pending:
+                self._wakeup.set()
+
+    def _prune_buckets(self, now):
+        """Bỏ bucket của kênh / interaction đã lâu không edit (đầy token thì không cần nhớ)"""
+        busy = {item.route for item in self._heap}
+        for route, bucket in list(self._buckets.items()):
+            if route not in busy and now - bucket.updated > BUCKET_IDLE_SECONDS:
+                del self._buckets[route]
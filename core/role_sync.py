@@ -0,0 +1,256 @@
+"""
+Đồng bộ Role & Nickname cảnh giới cho toàn server (/admin_sync_roles).
+Bước 1 so sánh ngay trong RAM từ cache member của guild: chỉ đệ tử có nickname hoặc role cảnh giới
+lệch với cảnh giới trong DB mới vào danh sách thay đổi (không gọi API nào).
+Bước 2 áp danh sách đó qua vài worker dùng chung một nhịp gửi; mỗi người chỉ tốn 1 request
+(nick + roles trong cùng một lần edit). Tiến độ được lưu vào app_state, bị ngắt giữa chừng thì
+lần chạy sau tiếp tục từ checkpoint.
+"""
+import asyncio
+import os
+import re
+import time
+import discord
+from core.helpers import rainbow_log, get_rank_info, get_all_rank_names, txa_embed
+from core.format import TXAFormat
+from core.roles_config import RoleConfig
+from core.rest_broker import TokenBucket
+
+ROLE_SYNC_STATE = "role_sync"
+ROLE_SYNC_CONCURRENCY = int(os.getenv("ROLE_SYNC_CONCURRENCY", "4"))
+ROLE_SYNC_REQUESTS_PER_SEC = float(os.getenv("ROLE_SYNC_REQUESTS_PER_SEC", "4"))
+CHECKPOINT_EVERY = 25  # Lưu checkpoint sau mỗi bấy nhiêu người
+
+_PREFIX_RE = re.compile(r"^\[.*?\]\s*")
+
+def nick_prefix(member_id, rank_name, super_admin_id=None, admin_ids=()):
+    if member_id == super_admin_id: return "[Chưởng Môn]"
+    if member_id in admin_ids: return "[Tổ Sư]"
+    return f"[{rank_name}]"
+
+def target_nick(display_name, prefix):
+    """Nickname mới (thay prefix cũ bằng prefix cảnh giới), None nếu không đổi hoặc dài quá 32 ký tự"""
+    nick = f"{prefix} {_PREFIX_RE.sub('', display_name)}"
+    if len(nick) > 32 or nick == display_name: return None
+    return nick
+
+async def create_rank_role(guild, rank_name):
+    """Tạo role cảnh giới còn thiếu (quyền cộng dồn từ các cảnh thấp hơn), None nếu lỗi"""
+    try:
+        permissions = discord.Permissions.none()
+        perm_dict = RoleConfig.get_cumulative_permissions(rank_name)
+        if perm_dict:
+            permissions.update(**perm_dict)
+        return await guild.create_role(
+            name=rank_name,
+            color=discord.Color(RoleConfig.get_role_data(rank_name)['color']),
+            hoist=True, # Show separately
+            permissions=permissions,
+            mentionable=False,
+            reason="Auto-generated by Cultivation Bot"
+        )
+    except Exception as e:
+        rainbow_log(f"Role create error: {e}")
+        return None
+
+class RankRoleIndex:
+    """
+    rank_name -> Role của từng guild, thay cho discord.utils.get(guild.roles, name=...) mỗi lần gọi.
+    Dựng lười từ guild.roles; sự kiện tạo / xóa / đổi tên role cảnh giới (hoặc RANKS đổi) làm index dựng lại.
+    """
+
+    def __init__(self):
+        self._guilds = {}  # guild_id -> (tập tên cảnh giới lúc dựng, {rank_name: Role})
+
+    def _index(self, guild):
+        names = get_all_rank_names()
+        entry = self._guilds.get(guild.id)
+        if entry is None or entry[0] is not names:
+            index = {}
+            # Trùng tên thì giữ role đứng trước như discord.utils.get
+            for role in guild.roles:
+                if role.name in names: index.setdefault(role.name, role)
+            entry = self._guilds[guild.id] = (names, index)
+        return entry[1]
+
+    def get(self, guild, rank_name):
+        return self._index(guild).get(rank_name)
+
+    def add(self, role):
+        """Ghi ngay role vừa tạo (sự kiện on_guild_role_create có thể tới sau)"""
+        self._index(role.guild).setdefault(role.name, role)
+
+    def invalidate(self, guild_id, *names):
+        """Bỏ index của guild nếu sự kiện đụng tới role cảnh giới"""
+        if not names or any(n in get_all_rank_names() for n in names):
+            self._guilds.pop(guild_id, None)
+
+class RoleChange:
+    __slots__ = ("user_id", "member", "rank_name", "nick", "add", "remove")
+
+    def __init__(self, user_id, member, rank_name, nick, add, remove):
+        self.user_id = user_id
+        self.member = member
+        self.rank_name = rank_name
+        self.nick = nick      # Nickname mới hoặc None
+        self.add = add        # Cần gắn role cảnh giới
+        self.remove = remove  # Role cảnh giới cũ phải gỡ
+
+def plan_member(member, layer, super_admin_id=None, admin_ids=()):
+    """So sánh nickname / role cảnh giới hiện tại với cảnh giới trong DB, None nếu đã khớp"""
+    rank_name, _ = get_rank_info(layer)
+    nick = target_nick(member.display_name, nick_prefix(member.id, rank_name, super_admin_id, admin_ids))
+    rank_names = get_all_rank_names()
+    remove = [r for r in member.roles if r.name in rank_names and r.name != rank_name]
+    add = not any(r.name == rank_name for r in member.roles)
+    if not nick and not add and not remove: return None
+    return RoleChange(str(member.id), member, rank_name, nick, add, remove)
+
+class RoleSync:
+    def __init__(self, bot, rank_roles, concurrency=ROLE_SYNC_CONCURRENCY, requests_per_sec=ROLE_SYNC_REQUESTS_PER_SEC):
+        self.bot = bot
+        self.db = bot.db
+        self.rank_roles = rank_roles
+        self.concurrency = concurrency
+        self._bucket = TokenBucket(requests_per_sec, max(1.0, requests_per_sec))
+        self._pace = asyncio.Lock()
+        self.running = False
+        self.progress = {}
+
+    async def plan(self, guild):
+        """Danh sách RoleChange (theo user_id) của mọi đệ tử đang ở trong server mà role / nickname bị lệch"""
+        # Cache thiếu member thì nạp cả danh sách một lần thay vì fetch_member từng người
+        if not guild.chunked: await guild.chunk()
+        super_id = getattr(self.bot, 'super_admin_id', None)
+        admin_ids = getattr(self.bot, 'admin_ids', [])
+        changes = []
+        async for u in self.db.iter_users(columns=['user_id', 'layer']):
+            self.progress['scanned'] += 1
+            member = guild.get_member(int(u['user_id']))
+            if not member:
+                self.progress['missing'] += 1
+                continue
+            change = plan_member(member, u['layer'], super_id, admin_ids)
+            if change: changes.append(change)
+        changes.sort(key=lambda c: c.user_id)
+        return changes
+
+    async def _wait_turn(self):
+        async with self._pace:
+            while True:
+                wait = self._bucket.wait_time(time.monotonic())
+                if not wait: break
+                await asyncio.sleep(wait)
+            self._bucket.take()
+
+    async def _apply(self, change):
+        """Gộp nick + roles vào một lần edit; bot không đủ quyền đổi nick (chủ server...) thì chỉ sửa role"""
+        member = change.member
+        target = self.rank_roles.get(member.guild, change.rank_name)
+        roles = None
+        if change.add or change.remove:
+            removed = {r.id for r in change.remove}
+            roles = [r for r in member.roles if not r.is_default() and r.id not in removed]
+            if change.add and target: roles.append(target)
+        kwargs = {}
+        if change.nick: kwargs['nick'] = change.nick
+        if roles is not None: kwargs['roles'] = roles
+        if not kwargs: return
+        await self._wait_turn()
+        try:
+            await member.edit(**kwargs, reason="Đồng bộ cảnh giới")
+        except discord.Forbidden:
+            if 'nick' not in kwargs or roles is None: raise
+            await self._wait_turn()
+            await member.edit(roles=roles, reason="Đồng bộ cảnh giới")
+
+    async def run(self, guild, restart=False):
+        """Lập danh sách thay đổi rồi áp dụng, trả về self.progress khi xong"""
+        if self.running: raise RuntimeError("Tiến trình đồng bộ đang chạy")
+        self.running = True
+        try:
+            return await self._run(guild, restart)
+        finally:
+            self.running = False
+
+    async def _run(self, guild, restart):
+        checkpoint = None if restart else await self.db.get_state(ROLE_SYNC_STATE)
+        if checkpoint and checkpoint.get('guild_id') != guild.id: checkpoint = None
+        cursor = checkpoint['cursor'] if checkpoint else ""
+        self.progress = {
+            "phase": "plan", "scanned": 0, "missing": 0, "total": 0,
+            "applied": checkpoint['applied'] if checkpoint else 0,
+            "failed": checkpoint['failed'] if checkpoint else 0,
+            "resumed": bool(checkpoint), "started": time.time(), "apply_started": None, "done_now": 0,
+        }
+        rainbow_log(f"🔄 [Đồng Bộ] Bắt đầu so sánh role/nickname{' (tiếp tục từ checkpoint)' if checkpoint else ''}...")
+        changes = [c for c in await self.plan(guild) if c.user_id > cursor]
+        progress = self.progress
+        progress.update(phase="apply", total=len(changes) + progress['applied'] + progress['failed'], apply_started=time.time())
+
+        # Role cảnh giới chưa có thì tạo một lần trước khi chia việc
+        for rank_name in {c.rank_name for c in changes if c.add}:
+            if not self.rank_roles.get(guild, rank_name):
+                role = await create_rank_role(guild, rank_name)
+                if role: self.rank_roles.add(role)
+
+        # Checkpoint là user_id lớn nhất mà mọi người đứng trước đều đã xử lý xong
+        finished = [False] * len(changes)
+        low = 0
+        queue = asyncio.Queue()
+        for i, change in enumerate(changes): queue.put_nowait(i)
+
+        async def save():
+            await self.db.set_state(ROLE_SYNC_STATE, {
+                "guild_id": guild.id, "cursor": changes[low - 1].user_id if low else cursor,
+                "applied": progress['applied'], "failed": progress['failed'],
+            })
+
+        async def worker():
+            nonlocal low
+            while not queue.empty():
+                i = queue.get_nowait()
+                try:
+                    await self._apply(changes[i])
+                    progress['applied'] += 1
+                except Exception as e:
+                    rainbow_log(f"  [!] Lỗi đồng bộ cho {changes[i].user_id}: {e}")
+                    progress['failed'] += 1
+                progress['done_now'] += 1
+                finished[i] = True
+                while low < len(changes) and finished[low]: low += 1
+                if progress['done_now'] % CHECKPOINT_EVERY == 0: await save()
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        await self.db.delete_state(ROLE_SYNC_STATE)
+        progress['phase'] = "done"
+        rainbow_log(
+            f"🔄 [Đồng Bộ] Xong: so {progress['scanned']} đệ tử, cập nhật {progress['applied']}, "
+            f"lỗi {progress['failed']}, không ở server {progress['missing']} "
+            f"trong {time.time() - progress['started']:.1f}s."
+        )
+        return progress
+
+    def progress_embed(self):
+        p = self.progress
+        if not p or p['phase'] == "plan":
+            desc = f"🔍 Đang so sánh cảnh giới với role hiện tại... ({p.get('scanned', 0)} đệ tử)"
+            return txa_embed("🔄 Đồng Bộ Role & Nickname", desc, discord.Color.blue())
+        done = p['applied'] + p['failed']
+        percent = done / p['total'] * 100 if p['total'] else 100
+        desc = (
+            f"Đã so **{p['scanned']}** đệ tử, **{p['total']}** người cần cập nhật."
+            f"{' *(tiếp tục từ lần trước)*' if p['resumed'] else ''}\n"
+            f"`{TXAFormat.progress_bar(percent, 15)}` ({percent:.0f}%)\n"
+            f"✅ Thành công: **{p['applied']}** • ❌ Lỗi: **{p['failed']}** • 👻 Không ở server: **{p['missing']}**"
+        )
+        if p['phase'] == "done":
+            embed = txa_embed("🔄 Đồng Bộ Hoàn Tất", desc, discord.Color.green())
+            embed.add_field(name="⏱️ Thời gian", value=TXAFormat.duration_detail(int(time.time() - p['started'])))
+            return embed
+        embed = txa_embed("🔄 Đang Đồng Bộ Role & Nickname", desc, discord.Color.blue())
+        elapsed = time.time() - p['apply_started']
+        if p['done_now'] and elapsed > 0:
+            eta = (p['total'] - done) / (p['done_now'] / elapsed)
+            embed.add_field(name="⏳ Ước tính còn", value=TXAFormat.remaining_detail(int(eta)))
+        return embed
@@ -0,0 +1,235 @@
+import time
+from core.helpers import rainbow_log
+
+# Migration schema có đánh số, phiên bản lưu trong PRAGMA user_version.
+# Mỗi bước chạy trong một transaction riêng; thêm bước mới thì nối vào cuối MIGRATIONS,
+# KHÔNG sửa hay đổi thứ tự các bước đã phát hành.
+
+async def _columns(db, table):
+    rows = await db.execute_fetchall(f"PRAGMA table_info({table})")
+    return {r['name'] for r in rows}
+
+async def _add_missing_columns(db, table, columns):
+    """Thêm các cột còn thiếu (DB tạo từ bản cũ), thay cho ALTER TABLE + except: pass"""
+    existing = await _columns(db, table)
+    for name, decl in columns:
+        if name not in existing:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+async def _v1_base_tables(database, db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            name TEXT,
+            layer INTEGER DEFAULT 1,
+            exp INTEGER DEFAULT 0,
+            goal INTEGER DEFAULT 200,
+            last_mission_reset REAL DEFAULT 0,
+            missions_completed INTEGER DEFAULT 0,
+            last_daily REAL DEFAULT 0,
+            last_daily_date TEXT,
+            daily_streak INTEGER DEFAULT 0,
+            spirit_stones INTEGER DEFAULT 0,
+            inventory TEXT DEFAULT '[]',
+            missions TEXT DEFAULT '[]',
+            current_mission TEXT DEFAULT NULL,
+            sect_id INTEGER DEFAULT NULL,
+            daily_exp INTEGER DEFAULT 0,
+            last_daily_exp_reset REAL DEFAULT 0,
+            buffs TEXT DEFAULT '{}'
+        )
+    """)
+    await _add_missing_columns(db, "users", [
+        ("sect_id", "INTEGER DEFAULT NULL"),
+        ("daily_exp", "INTEGER DEFAULT 0"),
+        ("last_daily_exp_reset", "REAL DEFAULT 0"),
+        ("buffs", "TEXT DEFAULT '{}'"),
+    ])
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS sects (
+            sect_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE,
+            leader_id TEXT,
+            level INTEGER DEFAULT 1,
+            exp INTEGER DEFAULT 0,
+            description TEXT,
+            kung_fu TEXT DEFAULT '[]'
+        )
+    """)
+    await _add_missing_columns(db, "sects", [("kung_fu", "TEXT DEFAULT '[]'")])
+
+async def _v2_child_tables(database, db):
+    # Bảng con thay cho các cột JSON inventory/missions/current_mission/buffs
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_items (
+            user_id TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            expiry REAL DEFAULT 0,
+            PRIMARY KEY (user_id, item_id)
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_missions (
+            user_id TEXT NOT NULL,
+            mission_id INTEGER NOT NULL,
+            title TEXT,
+            description TEXT,
+            difficulty INTEGER DEFAULT 1,
+            time INTEGER DEFAULT 0,
+            reward INTEGER DEFAULT 0,
+            stones INTEGER DEFAULT 0,
+            success_rate INTEGER DEFAULT 100,
+            done INTEGER DEFAULT 0,
+            retry_time REAL DEFAULT NULL,
+            end_time REAL DEFAULT NULL,
+            PRIMARY KEY (user_id, mission_id)
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_buffs (
+            user_id TEXT NOT NULL,
+            buff_id TEXT NOT NULL,
+            expiry REAL DEFAULT 0,
+            PRIMARY KEY (user_id, buff_id)
+        )
+    """)
+    # PRIMARY KEY (user_id, ...) đã là index theo user_id; thêm index theo hạn dùng
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_user_items_expiry ON user_items(expiry)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_user_buffs_expiry ON user_buffs(expiry)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_user_missions_end_time ON user_missions(end_time) WHERE end_time IS NOT NULL")
+
+async def _v3_json_blobs(database, db):
+    await database._migrate_json_blobs(db)
+
+async def _v4_hot_indexes(database, db):
+    # Bảng xếp hạng: ORDER BY layer DESC, exp DESC LIMIT n đọc thẳng theo index, không sort tạm
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_leaderboard ON users(layer DESC, exp DESC)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_sect_id ON users(sect_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_last_daily_date ON users(last_daily_date)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_sects_leader_id ON sects(leader_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_sects_exp ON sects(exp DESC)")
+    # sects.name đã có index ngầm nhờ ràng buộc UNIQUE
+
+async def _v5_app_state(database, db):
+    # Trạng thái dùng chung dạng key -> JSON (checkpoint import, mốc reset...)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS app_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+
+async def _v6_ledger(database, db):
+    # Sổ thu chi chỉ ghi thêm; dòng cũ được nén vào ledger_daily theo (ngày, user, lý do)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            ts REAL NOT NULL,
+            reason TEXT NOT NULL,
+            exp INTEGER DEFAULT 0,
+            spirit_stones INTEGER DEFAULT 0
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_ts ON ledger(ts)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user_ts ON ledger(user_id, ts)")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_daily (
+            day TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            exp INTEGER DEFAULT 0,
+            spirit_stones INTEGER DEFAULT 0,
+            entries INTEGER DEFAULT 0,
+            PRIMARY KEY (day, user_id, reason)
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_daily_user ON ledger_daily(user_id, day)")
+
+async def _v7_mission_pool(database, db):
+    # Kho nhiệm vụ AI sinh sẵn theo bậc độ khó, mission_seen để không phát trùng cho cùng một người
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS mission_pool (
+            id INTEGER PRIMARY KEY,
+            tier INTEGER NOT NULL,
+            title TEXT NOT NULL UNIQUE,
+            description TEXT,
+            difficulty INTEGER,
+            time INTEGER,
+            reward INTEGER,
+            uses INTEGER DEFAULT 0,
+            created REAL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_mission_pool_tier ON mission_pool(tier)")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS mission_seen (
+            user_id TEXT NOT NULL,
+            pool_id INTEGER NOT NULL,
+            ts REAL NOT NULL,
+            PRIMARY KEY (user_id, pool_id)
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_mission_seen_ts ON mission_seen(ts)")
+
+async def _v8_lucky_alias(database, db):
+    # Bảng alias cho rút thăm buff hàng giờ: slot là rowid nên bốc slot ngẫu nhiên chỉ tra khóa chính
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS lucky_alias (
+            slot INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            prob REAL NOT NULL,
+            alias_id TEXT NOT NULL
+        )
+    """)
+
+async def _v9_ledger_covering(database, db):
+    # Tổng hợp ledger theo user (GROUP BY reason) đọc thẳng từ index phủ, không cần bảng hay B-tree tạm.
+    # Index cũ (user_id, ts) / (user_id, day) là tiền tố user_id của index mới nên bỏ đi: mỗi dòng ledger vẫn chỉ ghi một index theo user
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user_reason ON ledger(user_id, reason, ts, exp, spirit_stones)")
+    await db.execute("DROP INDEX IF EXISTS idx_ledger_user_ts")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_daily_user_reason ON ledger_daily(user_id, reason, day, exp, spirit_stones, entries)")
+    await db.execute("DROP INDEX IF EXISTS idx_ledger_daily_user")
+
+MIGRATIONS = [
+    (1, "Bảng users/sects cơ bản", _v1_base_tables),
+    (2, "Bảng user_items/user_missions/user_buffs", _v2_child_tables),
+    (3, "Chuyển JSON inventory/missions/buffs sang bảng con", _v3_json_blobs),
+    (4, "Index cho bảng xếp hạng, tông môn và điểm danh", _v4_hot_indexes),
+    (5, "Bảng app_state", _v5_app_state),
+    (6, "Bảng ledger và ledger_daily", _v6_ledger),
+    (7, "Bảng mission_pool và mission_seen", _v7_mission_pool),
+    (8, "Bảng lucky_alias", _v8_lucky_alias),
+    (9, "Index phủ cho tổng hợp ledger theo user", _v9_ledger_covering),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+async def get_schema_version(database):
+    async with database.read() as db:
+        rows = await db.execute_fetchall("PRAGMA user_version")
+    return rows[0][0]
+
+async def run_migrations(database):
+    """Chạy các bước migration chưa áp dụng, trả về phiên bản schema hiện tại"""
+    current = await get_schema_version(database)
+    if current >= LATEST_VERSION:
+        rainbow_log(f"🗄️ [Schema] Database đã ở phiên bản {current}, bỏ qua migration.")
+        return current
+    if current > 0:
+        rainbow_log(f"🗄️ [Schema] Nâng cấp database từ phiên bản {current} lên {LATEST_VERSION}...")
+
+    total = time.perf_counter()
+    for version, desc, step in MIGRATIONS:
+        if version <= current: continue
+        started = time.perf_counter()
+        async with database.write() as db:
+            await step(database, db)
+            # user_version nằm trong header file nên commit/rollback cùng transaction
+            await db.execute(f"PRAGMA user_version = {int(version)}")
+        rainbow_log(f"   ✅ [Schema] v{version}: {desc} ({(time.perf_counter() - started) * 1000:.1f}ms)")
+        current = version
+    rainbow_log(f"🗄️ [Schema] Hoàn tất migration, phiên bản {current} ({(time.perf_counter() - total) * 1000:.1f}ms).")
+    return current
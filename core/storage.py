@@ -0,0 +1,642 @@
+import asyncio
+import copy
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+from core.progression import batch_level_up, level_up as calc_level_up
+from core.lucky_draw import LUCKY_ALIAS_STATE, alias_rows, pick_winners
+from core.helpers import rainbow_log
+
+# Cột của bảng users (không gồm các field ở bảng con) và giá trị mặc định khi tạo mới
+USER_DEFAULTS = {
+    "name": None,
+    "layer": 1,
+    "exp": 0,
+    "goal": 200,
+    "last_mission_reset": 0,
+    "missions_completed": 0,
+    "last_daily": 0,
+    "last_daily_date": None,
+    "daily_streak": 0,
+    "spirit_stones": 0,
+    "sect_id": None,
+    "daily_exp": 0,
+    "last_daily_exp_reset": 0,
+}
+USER_COLUMNS = ("user_id",) + tuple(USER_DEFAULTS)
+
+# Các cột số được phép cộng/trừ trực tiếp qua apply_delta
+DELTA_COLUMNS = ("exp", "layer", "spirit_stones", "daily_exp", "missions_completed", "daily_streak")
+
+# Các field của user nằm ở bảng con (user_items / user_missions / user_buffs)
+CHILD_FIELDS = ("inventory", "missions", "current_mission", "buffs")
+
+# Các cột mà bảng xếp hạng trong RAM (core/leaderboard.py) cần theo dõi
+RANK_FIELDS = ("name", "layer", "exp")
+
+def rank_fields(values):
+    """Lọc các cột liên quan tới bảng xếp hạng, None nếu không có"""
+    changed = {k: values[k] for k in RANK_FIELDS if k in values}
+    return changed or None
+
+# Khóa app_state lưu mốc (epoch) của lần reset ngày gần nhất
+DAILY_RESET_STATE = "daily_reset"
+
+# Sổ thu chi (ledger): chỉ ghi các biến động kinh tế, mỗi dòng kèm lý do
+LEDGER_COLUMNS = ("exp", "spirit_stones")
+# Giữ chi tiết từng dòng trong bao nhiêu ngày trước khi nén thành tổng theo ngày
+LEDGER_KEEP_DAYS = float(os.getenv("DB_LEDGER_KEEP_DAYS", "14"))
+# Ngày của ledger tính theo giờ Việt Nam (UTC+7, không đổi giờ)
+LEDGER_TZ_OFFSET = 7 * 3600
+
+def ledger_day(ts: float):
+    """Ngày (YYYY-MM-DD, giờ Việt Nam) của một mốc thời gian, khớp với date(ts + 25200, 'unixepoch') trong SQL"""
+    return time.strftime("%Y-%m-%d", time.gmtime(ts + LEDGER_TZ_OFFSET))
+
+def ledger_day_start(ts: float):
+    """Mốc 00:00 giờ Việt Nam của ngày chứa ts"""
+    return (ts + LEDGER_TZ_OFFSET) // 86400 * 86400 - LEDGER_TZ_OFFSET
+
+def ledger_entry(user_id, reason, deltas, ts=None):
+    """Dòng ledger (user_id, ts, reason, exp, spirit_stones) từ delta, None nếu không có biến động kinh tế"""
+    exp, stones = deltas.get('exp', 0) or 0, deltas.get('spirit_stones', 0) or 0
+    if not reason or (not exp and not stones): return None
+    return (user_id, ts or time.time(), reason, exp, stones)
+
+def pick_pool_rows(rows, n):
+    """Chọn n nhiệm vụ trong kho, ưu tiên mục ít được phát (uses nhỏ), cùng mức thì ngẫu nhiên"""
+    rows = list(rows)
+    random.shuffle(rows)
+    rows.sort(key=lambda r: r['uses'])
+    return rows[:n]
+
+def check_user_columns(columns):
+    """Chặn tên cột lạ (tên cột được ghép thẳng vào SQL)"""
+    unknown = [c for c in columns if c not in USER_COLUMNS and c not in CHILD_FIELDS]
+    if unknown:
+        raise ValueError(f"Cột không tồn tại trong users: {', '.join(unknown)}")
+
+class Storage(ABC):
+    """
+    Giao diện lưu trữ dùng chung cho mọi cog: user, bảng con, tông môn, bảng xếp hạng.
+    Bản cài đặt: Database (SQLite, core/database.py) và MemoryStorage (RAM, cho test/benchmark).
+    """
+    write_behind = False
+    _user_listeners = ()
+    _restore_listeners = ()
+
+    def add_user_listener(self, fn):
+        """fn(user_id, {name/layer/exp mới}) được gọi sau mỗi lần ghi đổi các cột đó (bảng xếp hạng trong RAM)"""
+        self._user_listeners = (*self._user_listeners, fn)
+
+    def _notify_user(self, user_id, values):
+        fields = rank_fields(values) if values else None
+        if not fields: return
+        for fn in self._user_listeners:
+            fn(user_id, fields)
+
+    def add_restore_listener(self, fn):
+        """Coroutine fn() được gọi sau khi dữ liệu bị thay cả khối (khôi phục backup): index trong RAM tự nạp lại"""
+        self._restore_listeners = (*self._restore_listeners, fn)
+
+    def remove_restore_listener(self, fn):
+        self._restore_listeners = tuple(f for f in self._restore_listeners if f != fn)
+
+    async def notify_restored(self):
+        for fn in self._restore_listeners:
+            try:
+                await fn()
+            except Exception as e:
+                rainbow_log(f"⚠️ [Storage] Nạp lại sau khôi phục thất bại ({getattr(fn, '__qualname__', fn)}): {e}")
+
+    # --- Vòng đời ---
+    @abstractmethod
+    async def initialize(self): ...
+    @abstractmethod
+    async def close(self): ...
+    async def flush(self):
+        """Ghi các thay đổi đang chờ, trả về số user được ghi"""
+        return 0
+    def cache_stats(self): return None
+    def metrics_snapshot(self):
+        """Thống kê độ trễ theo thao tác (core.metrics), None nếu backend không đo"""
+        return None
+
+    # --- User ---
+    @abstractmethod
+    async def get_user(self, user_id: str, children: bool = True): ...
+    @abstractmethod
+    async def get_inventory(self, user_id: str): ...
+    @abstractmethod
+    async def create_user(self, user_id: str, name: str): ...
+    @abstractmethod
+    async def update_user(self, user_id: str, **kwargs): ...
+    @abstractmethod
+    async def apply_delta(self, user_id: str, assign: dict = None, reason: str = None, level_up: bool = False, **deltas):
+        """
+        Cộng/trừ nguyên tử các cột số, trả về user sau cập nhật (None nếu không tồn tại).
+        reason: nguồn biến động (mission, daily, buy...) - có thì exp/spirit_stones được ghi vào ledger.
+        level_up: đột phá ngay trong cùng transaction từ dòng vừa cập nhật; user trả về có thêm
+        'layer_gained' (số tầng vừa đột phá, xem progression.level_up_result).
+        """
+    @abstractmethod
+    def iter_users(self, columns=None, where: dict = None, exclude: dict = None, batch_size: int = 500):
+        """
+        Async generator duyệt user theo user_id tăng dần.
+        where: {cột: giá trị} so khớp bằng; exclude: {cột: giá trị} loại bỏ (NULL được coi là khác giá trị).
+        """
+    @abstractmethod
+    async def count_users(self, where: dict = None, exclude: dict = None): ...
+    @abstractmethod
+    async def get_top_users(self, limit=10): ...
+    @abstractmethod
+    async def get_all_users(self): ...
+
+    # --- Bảng con ---
+    @abstractmethod
+    async def add_item(self, user_id: str, item_id: str, count: int = 1): ...
+    @abstractmethod
+    async def buy_item(self, user_id: str, item_id: str, price: int, count: int = 1):
+        """
+        Trừ linh thạch (chỉ khi đủ) và cộng vật phẩm trong cùng một transaction.
+        Trả về số linh thạch còn lại, None nếu không đủ linh thạch / user không tồn tại.
+        """
+    @abstractmethod
+    async def set_item(self, user_id: str, item_id: str, count: int, expiry: float = 0): ...
+    @abstractmethod
+    async def consume_item(self, user_id: str, item_id: str, duration: float = 0, now: float = 0): ...
+    @abstractmethod
+    async def prune_inventory(self, user_id: str, now: float): ...
+    @abstractmethod
+    async def update_mission(self, user_id: str, mission_id: int, **fields): ...
+    @abstractmethod
+    async def start_mission(self, user_id: str, mission_id: int, end_time: float): ...
+    @abstractmethod
+    async def clear_current_mission(self, user_id: str, mission_id: int = None): ...
+    @abstractmethod
+    async def get_mission_timers(self): ...
+    @abstractmethod
+    async def set_buff(self, user_id: str, buff_id: str, expiry: float): ...
+
+    # --- Trạng thái ---
+    @abstractmethod
+    async def get_state(self, key: str, default=None): ...
+    @abstractmethod
+    async def set_state(self, key: str, value): ...
+    @abstractmethod
+    async def delete_state(self, key: str): ...
+
+    @abstractmethod
+    async def apply_daily_reset(self, epoch: float):
+        """
+        Reset ngày cho mọi user chưa qua mốc `epoch`: daily_exp, missions_completed về 0,
+        bỏ nhiệm vụ cũ chưa làm (lệnh /nhiem_vu sẽ sinh đợt mới) và ghi mốc vào app_state.
+        Trả về số user được reset.
+        """
+
+    @abstractmethod
+    async def apply_level_ups(self):
+        """
+        Đột phá hàng loạt cho mọi user có exp >= goal (EXP cộng từ đường không tự đột phá như nhạc, admin...).
+        Trả về [(user_id, layer, exp, goal)] mới của những người được đột phá.
+        """
+
+    # --- Ledger ---
+    @abstractmethod
+    async def ledger_summary(self, user_id: str = None, since: float = None, until: float = None):
+        """
+        Tổng thu chi theo lý do trong [since, until): {reason: {exp, spirit_stones, entries}}.
+        Dữ liệu đã nén chỉ còn theo ngày nên phần cũ được làm tròn ra cả ngày.
+        """
+    @abstractmethod
+    async def compact_ledger(self, before: float):
+        """Gộp các dòng ledger trước mốc `before` (đầu ngày) vào bảng tổng hợp theo ngày, trả về số dòng đã gộp"""
+
+    # --- Kho nhiệm vụ ---
+    @abstractmethod
+    async def mission_pool_counts(self):
+        """Số nhiệm vụ trong kho theo bậc: {tier: count}"""
+    @abstractmethod
+    async def add_pool_missions(self, missions: list):
+        """Thêm nhiệm vụ đã kiểm tra vào kho (bỏ qua tiêu đề trùng), trả về số mục thêm được"""
+    @abstractmethod
+    async def take_pool_missions(self, user_id: str, tier_counts: dict):
+        """
+        Lấy {tier: n} nhiệm vụ trong kho mà user chưa từng nhận, đánh dấu đã nhận và tăng uses trong
+        cùng transaction. Trả về [{pool_id, tier, title, desc, difficulty, time, reward}] (có thể thiếu nếu kho cạn).
+        """
+    @abstractmethod
+    async def prune_mission_pool(self, max_uses: int, seen_before: float):
+        """Bỏ nhiệm vụ đã phát đủ max_uses lần và dấu đã nhận cũ hơn seen_before, trả về (số nhiệm vụ, số dấu) đã xóa"""
+
+    # --- Rút thăm buff ---
+    @abstractmethod
+    async def rebuild_lucky_alias(self, weight_column: str = None):
+        """
+        Dựng lại bảng alias rút thăm trên toàn bộ user (trọng số theo cột weight_column, None = đều nhau)
+        và ghi {n, built, weight} vào app_state. Trả về số slot.
+        """
+    @abstractmethod
+    async def draw_lucky_users(self, count: int, buff_id: str, expiry: float):
+        """Rút tối đa `count` user khác nhau từ bảng alias, ban buff_id tới expiry trong một câu lệnh, trả về user_id trúng"""
+
+    # --- Tông môn ---
+    @abstractmethod
+    async def get_all_sects(self): ...
+    @abstractmethod
+    async def get_sect(self, sect_id: int): ...
+    @abstractmethod
+    async def get_sect_by_name(self, name: str): ...
+    @abstractmethod
+    async def get_sect_by_leader(self, leader_id: str): ...
+    @abstractmethod
+    async def create_sect(self, name: str, leader_id: str):
+        """Tạo tông môn, trả về sect_id; ValueError nếu trùng tên"""
+    @abstractmethod
+    async def update_sect(self, sect_id: int, **kwargs): ...
+    @abstractmethod
+    async def update_sect_exp(self, sect_id: int, exp: int): ...
+    async def set_sect_leader(self, sect_id: int, leader_id: str):
+        await self.update_sect(sect_id, leader_id=leader_id)
+    @abstractmethod
+    async def delete_sect(self, sect_id: int):
+        """Xóa tông môn và trả các đệ tử về tán tu"""
+    @abstractmethod
+    async def get_sect_members(self, sect_id: int, exclude_user: str = None):
+        """Danh sách {user_id, name} của tông môn"""
+    @abstractmethod
+    async def count_sect_members(self, sect_id: int): ...
+
+class MemoryStorage(Storage):
+    """Lưu toàn bộ trong RAM, cùng ngữ nghĩa với Database - dùng cho test tải và benchmark"""
+
+    def __init__(self):
+        self._users = {}     # user_id -> cột users
+        self._items = {}     # user_id -> {item_id: {"count", "expiry"}}
+        self._missions = {}  # user_id -> {mission_id: {"mission": dict, "end_time": float | None}}
+        self._buffs = {}     # user_id -> {buff_id: expiry}
+        self._sects = {}     # sect_id -> dict
+        self._next_sect_id = 1
+        self._state = {}
+        self._ledger = []        # (user_id, ts, reason, exp, spirit_stones)
+        self._ledger_daily = {}  # (day, user_id, reason) -> [exp, spirit_stones, entries]
+        self._pool = {}          # pool_id -> dict
+        self._next_pool_id = 1
+        self._seen = {}          # (user_id, pool_id) -> ts
+        self._alias = []         # slot -> (user_id, prob, alias_id)
+
+    async def initialize(self): pass
+    async def close(self): pass
+
+    # --- User ---
+    def _build_user(self, user_id, children=True):
+        row = self._users.get(user_id)
+        if row is None: return None
+        user = copy.deepcopy(row)
+        user.update({'inventory': [], 'missions': [], 'current_mission': None, 'buffs': {}})
+        if children:
+            user['inventory'] = self._inventory(user_id)
+            for mid, entry in sorted(self._missions.get(user_id, {}).items()):
+                user['missions'].append(copy.deepcopy(entry['mission']))
+                if entry['end_time'] is not None:
+                    user['current_mission'] = {"id": mid, "end_time": entry['end_time']}
+            user['buffs'] = dict(self._buffs.get(user_id, {}))
+        return user
+
+    def _inventory(self, user_id):
+        return [{"id": iid, "count": it['count'], "expiry": it['expiry']}
+                for iid, it in sorted(self._items.get(user_id, {}).items())]
+
+    async def get_user(self, user_id: str, children: bool = True):
+        return self._build_user(user_id, children)
+
+    async def get_inventory(self, user_id: str):
+        return self._inventory(user_id)
+
+    async def create_user(self, user_id: str, name: str):
+        if user_id not in self._users:
+            self._users[user_id] = {"user_id": user_id, **USER_DEFAULTS, "name": name}
+            self._notify_user(user_id, self._users[user_id])
+
+    def _write_child_fields(self, user_id, children):
+        if 'inventory' in children:
+            self._items[user_id] = {
+                it['id']: {"count": it.get('count', 0), "expiry": it.get('expiry', 0)}
+                for it in children['inventory'] or []
+            }
+        if 'missions' in children:
+            missions = {}
+            for m in children['missions'] or []:
+                m = copy.deepcopy(m)
+                m['id'] = int(m['id'])
+                m['done'] = bool(m.get('done'))
+                if m.get('retry_time') is None: m.pop('retry_time', None)
+                missions[m['id']] = {"mission": m, "end_time": None}
+            self._missions[user_id] = missions
+        if 'current_mission' in children:
+            cm = children['current_mission']
+            for entry in self._missions.get(user_id, {}).values():
+                entry['end_time'] = None
+            if cm and int(cm['id']) in self._missions.get(user_id, {}):
+                self._missions[user_id][int(cm['id'])]['end_time'] = cm['end_time']
+        if 'buffs' in children:
+            self._buffs[user_id] = dict(children['buffs'] or {})
+
+    async def update_user(self, user_id: str, **kwargs):
+        check_user_columns(kwargs)
+        children = {k: kwargs.pop(k) for k in CHILD_FIELDS if k in kwargs}
+        self._write_child_fields(user_id, children)
+        if user_id in self._users:
+            self._users[user_id].update(kwargs)
+            self._notify_user(user_id, kwargs)
+
+    async def apply_delta(self, user_id: str, assign: dict = None, reason: str = None, level_up: bool = False, **deltas):
+        unknown = set(deltas) - set(DELTA_COLUMNS)
+        if unknown:
+            raise ValueError(f"apply_delta không hỗ trợ cột: {', '.join(sorted(unknown))}")
+        assign = dict(assign or {})
+        check_user_columns(assign)
+        row = self._users.get(user_id)
+        if row is None: return None
+        for k, v in deltas.items():
+            row[k] = (row.get(k) or 0) + v
+        children = {k: assign.pop(k) for k in CHILD_FIELDS if k in assign}
+        row.update(assign)
+        gained = 0
+        if level_up:
+            layer, exp, goal = calc_level_up(row['layer'], row['exp'], row['goal'])
+            gained = layer - row['layer']
+            row.update(layer=layer, exp=exp, goal=goal)
+        self._write_child_fields(user_id, children)
+        entry = ledger_entry(user_id, reason, deltas)
+        if entry: self._ledger.append(entry)
+        self._notify_user(user_id, row)
+        user = self._build_user(user_id)
+        if level_up: user['layer_gained'] = gained
+        return user
+
+    def _match(self, row, where, exclude):
+        if where and any(row.get(k) != v for k, v in where.items()): return False
+        if exclude and any(row.get(k) == v for k, v in exclude.items()): return False
+        return True
+
+    async def iter_users(self, columns=None, where: dict = None, exclude: dict = None, batch_size: int = 500):
+        columns = list(columns or [])
+        check_user_columns(columns + list(where or {}) + list(exclude or {}))
+        ids = sorted(uid for uid, row in self._users.items() if self._match(row, where, exclude))
+        for i in range(0, len(ids), batch_size):
+            for uid in ids[i:i + batch_size]:
+                if uid not in self._users: continue
+                user = self._build_user(uid, children=any(c in CHILD_FIELDS for c in columns))
+                if columns:
+                    keep = set(columns) | {"user_id"}
+                    user = {k: v for k, v in user.items() if k in keep}
+                else:
+                    for k in CHILD_FIELDS: user.pop(k, None)
+                yield user
+            await asyncio.sleep(0)
+
+    async def count_users(self, where: dict = None, exclude: dict = None):
+        return sum(1 for row in self._users.values() if self._match(row, where, exclude))
+
+    async def get_top_users(self, limit=10):
+        top = sorted(self._users.values(), key=lambda r: (-r['layer'], -r['exp'], r['user_id']))[:limit]
+        return [self._build_user(r['user_id']) for r in top]
+
+    async def get_all_users(self):
+        return [self._build_user(uid) for uid in self._users]
+
+    # --- Bảng con ---
+    async def add_item(self, user_id: str, item_id: str, count: int = 1):
+        it = self._items.setdefault(user_id, {}).setdefault(item_id, {"count": 0, "expiry": 0})
+        it['count'] += count
+
+    async def buy_item(self, user_id: str, item_id: str, price: int, count: int = 1):
+        row = self._users.get(user_id)
+        if row is None or row['spirit_stones'] < price: return None
+        row['spirit_stones'] -= price
+        await self.add_item(user_id, item_id, count)
+        entry = ledger_entry(user_id, 'buy', {'spirit_stones': -price})
+        if entry: self._ledger.append(entry)
+        return row['spirit_stones']
+
+    async def set_item(self, user_id: str, item_id: str, count: int, expiry: float = 0):
+        self._items.setdefault(user_id, {})[item_id] = {"count": count, "expiry": expiry}
+
+    async def consume_item(self, user_id: str, item_id: str, duration: float = 0, now: float = 0):
+        it = self._items.get(user_id, {}).get(item_id)
+        if not it or it['count'] <= 0: return None
+        it['count'] -= 1
+        if duration > 0:
+            it['expiry'] = max(it['expiry'], now) + duration
+        return {"id": item_id, "count": it['count'], "expiry": it['expiry']}
+
+    async def prune_inventory(self, user_id: str, now: float):
+        items = self._items.get(user_id, {})
+        for iid in list(items):
+            it = items[iid]
+            if it['count'] <= 0 and it['expiry'] <= now:
+                del items[iid]
+            elif 0 < it['expiry'] <= now:
+                it['expiry'] = 0
+
+    async def update_mission(self, user_id: str, mission_id: int, **fields):
+        entry = self._missions.get(user_id, {}).get(int(mission_id))
+        if not entry: return
+        if 'end_time' in fields:
+            entry['end_time'] = fields.pop('end_time')
+        if 'done' in fields: fields['done'] = bool(fields['done'])
+        entry['mission'].update(fields)
+
+    async def start_mission(self, user_id: str, mission_id: int, end_time: float):
+        await self.update_user(user_id, current_mission={"id": mission_id, "end_time": end_time})
+
+    async def clear_current_mission(self, user_id: str, mission_id: int = None):
+        count = 0
+        for mid, entry in self._missions.get(user_id, {}).items():
+            if entry['end_time'] is not None and (mission_id is None or mid == int(mission_id)):
+                entry['end_time'] = None
+                count += 1
+        return count
+
+    async def get_mission_timers(self):
+        return [(uid, mid, e['end_time']) for uid, ms in self._missions.items() for mid, e in ms.items() if e['end_time'] is not None]
+
+    async def set_buff(self, user_id: str, buff_id: str, expiry: float):
+        self._buffs.setdefault(user_id, {})[buff_id] = expiry
+
+    # --- Trạng thái ---
+    async def get_state(self, key: str, default=None):
+        return copy.deepcopy(self._state[key]) if key in self._state else default
+
+    async def set_state(self, key: str, value):
+        self._state[key] = copy.deepcopy(value)
+
+    async def delete_state(self, key: str):
+        self._state.pop(key, None)
+
+    async def apply_daily_reset(self, epoch: float):
+        count = 0
+        for uid, row in self._users.items():
+            if row['last_daily_exp_reset'] >= epoch and row['last_mission_reset'] >= epoch: continue
+            if row['last_mission_reset'] < epoch:
+                missions = self._missions.get(uid, {})
+                for mid in [mid for mid, e in missions.items() if e['end_time'] is None]:
+                    del missions[mid]
+            row.update(daily_exp=0, missions_completed=0, last_daily_exp_reset=epoch, last_mission_reset=epoch)
+            count += 1
+        self._state[DAILY_RESET_STATE] = epoch
+        return count
+
+    async def apply_level_ups(self):
+        changed = batch_level_up(
+            [(uid, r['layer'], r['exp'], r['goal']) for uid, r in self._users.items() if r['exp'] >= r['goal']]
+        )
+        for uid, layer, exp, goal in changed:
+            self._users[uid].update(layer=layer, exp=exp, goal=goal)
+            self._notify_user(uid, {"layer": layer, "exp": exp})
+        return changed
+
+    # --- Ledger ---
+    async def ledger_summary(self, user_id: str = None, since: float = None, until: float = None):
+        res = {}
+        def add(reason, exp, stones, entries):
+            r = res.setdefault(reason, {"exp": 0, "spirit_stones": 0, "entries": 0})
+            r['exp'] += exp; r['spirit_stones'] += stones; r['entries'] += entries
+        for uid, ts, reason, exp, stones in self._ledger:
+            if user_id is not None and uid != user_id: continue
+            if since is not None and ts < since: continue
+            if until is not None and ts >= until: continue
+            add(reason, exp, stones, 1)
+        first = ledger_day(since) if since is not None else None
+        last = ledger_day(until - 1e-3) if until is not None else None
+        for (day, uid, reason), (exp, stones, entries) in self._ledger_daily.items():
+            if user_id is not None and uid != user_id: continue
+            if first is not None and day < first: continue
+            if last is not None and day > last: continue
+            add(reason, exp, stones, entries)
+        return res
+
+    async def compact_ledger(self, before: float):
+        keep, count = [], 0
+        for uid, ts, reason, exp, stones in self._ledger:
+            if ts >= before:
+                keep.append((uid, ts, reason, exp, stones))
+                continue
+            agg = self._ledger_daily.setdefault((ledger_day(ts), uid, reason), [0, 0, 0])
+            agg[0] += exp; agg[1] += stones; agg[2] += 1
+            count += 1
+        self._ledger = keep
+        return count
+
+    # --- Kho nhiệm vụ ---
+    async def mission_pool_counts(self):
+        counts = {}
+        for m in self._pool.values():
+            counts[m['tier']] = counts.get(m['tier'], 0) + 1
+        return counts
+
+    async def add_pool_missions(self, missions: list):
+        titles = {m['title'] for m in self._pool.values()}
+        added = 0
+        for m in missions:
+            if m['title'] in titles: continue
+            titles.add(m['title'])
+            self._pool[self._next_pool_id] = {
+                "pool_id": self._next_pool_id, "tier": m['tier'], "title": m['title'], "desc": m['desc'],
+                "difficulty": m['difficulty'], "time": m['time'], "reward": m['reward'], "uses": 0, "created": time.time()
+            }
+            self._next_pool_id += 1
+            added += 1
+        return added
+
+    async def take_pool_missions(self, user_id: str, tier_counts: dict):
+        now = time.time()
+        picked = []
+        for tier, n in tier_counts.items():
+            rows = [m for pid, m in self._pool.items() if m['tier'] == tier and (user_id, pid) not in self._seen]
+            picked += pick_pool_rows(rows, n)
+        for m in picked:
+            self._seen[(user_id, m['pool_id'])] = now
+            m['uses'] += 1
+        return [{k: m[k] for k in ("pool_id", "tier", "title", "desc", "difficulty", "time", "reward")} for m in picked]
+
+    async def prune_mission_pool(self, max_uses: int, seen_before: float):
+        retired = [pid for pid, m in self._pool.items() if m['uses'] >= max_uses]
+        for pid in retired: del self._pool[pid]
+        gone = set(retired)
+        stale = [k for k, ts in self._seen.items() if ts < seen_before or k[1] in gone]
+        for k in stale: del self._seen[k]
+        return len(retired), len(stale)
+
+    # --- Rút thăm buff ---
+    async def rebuild_lucky_alias(self, weight_column: str = None):
+        rows = alias_rows([(uid, r[weight_column] if weight_column else None) for uid, r in self._users.items()])
+        self._alias = [(user_id, prob, alias_id) for _, user_id, prob, alias_id in rows]
+        self._state[LUCKY_ALIAS_STATE] = {"n": len(rows), "built": time.time(), "weight": weight_column}
+        return len(rows)
+
+    async def draw_lucky_users(self, count: int, buff_id: str, expiry: float):
+        n = len(self._alias)
+        if not n: return []
+        async def fetch(slots):
+            return {s: self._alias[s] for s in slots}
+        winners = [uid for uid in await pick_winners(n, count, fetch) if uid in self._users]
+        for uid in winners:
+            self._buffs.setdefault(uid, {})[buff_id] = expiry
+        return winners
+
+    # --- Tông môn ---
+    async def get_all_sects(self):
+        return [copy.deepcopy(s) for s in sorted(self._sects.values(), key=lambda s: -s['exp'])]
+
+    async def get_sect(self, sect_id: int):
+        s = self._sects.get(sect_id)
+        return copy.deepcopy(s) if s else None
+
+    async def get_sect_by_name(self, name: str):
+        return next((copy.deepcopy(s) for s in self._sects.values() if s['name'] == name), None)
+
+    async def get_sect_by_leader(self, leader_id: str):
+        return next((copy.deepcopy(s) for s in self._sects.values() if s['leader_id'] == leader_id), None)
+
+    async def create_sect(self, name: str, leader_id: str):
+        if any(s['name'] == name for s in self._sects.values()):
+            raise ValueError(f"Tông môn {name} đã tồn tại")
+        sect_id = self._next_sect_id
+        self._next_sect_id += 1
+        self._sects[sect_id] = {
+            "sect_id": sect_id, "name": name, "leader_id": leader_id,
+            "level": 1, "exp": 0, "description": None, "kung_fu": []
+        }
+        return sect_id
+
+    async def update_sect(self, sect_id: int, **kwargs):
+        if sect_id in self._sects:
+            self._sects[sect_id].update(copy.deepcopy(kwargs))
+
+    async def update_sect_exp(self, sect_id: int, exp: int):
+        if sect_id in self._sects:
+            self._sects[sect_id]['exp'] += exp
+
+    async def delete_sect(self, sect_id: int):
+        if self._sects.pop(sect_id, None) is None: return False
+        for row in self._users.values():
+            if row['sect_id'] == sect_id: row['sect_id'] = None
+        return True
+
+    async def get_sect_members(self, sect_id: int, exclude_user: str = None):
+        return [{"user_id": uid, "name": row['name']} for uid, row in sorted(self._users.items())
+                if row['sect_id'] == sect_id and uid != exclude_user]
+
+    async def count_sect_members(self, sect_id: int):
+        return sum(1 for row in self._users.values() if row['sect_id'] == sect_id)
+
+def create_storage():
+    """Chọn backend theo DB_BACKEND (sqlite mặc định, memory cho test/benchmark)"""
+    backend = os.getenv("DB_BACKEND", "sqlite").lower()
+    if backend == "memory":
+        return MemoryStorage()
+    from core.database import Database
+    return Database()
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import time
+from core.backup import BackupService, backup_database, restore_database
+from core.database import Database
+from core.leaderboard import Leaderboard
+
+def test_restore_reloads_leaderboard(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "t.db"))
+        await db.initialize()
+        board = Leaderboard(db)
+        await board.load()
+        await db.create_user("1", "a")
+        await db.create_user("2", "b")
+        await db.update_user("1", exp=500)
+        await db.update_user("2", exp=100)
+        await db.flush()
+        snapshot = await backup_database(db.db_path, str(tmp_path / "backups"), prune=False)
+
+        await db.update_user("2", exp=900)
+        await db.flush()
+        before = [row[1] for row in board.page(0)]
+        await restore_database(db, snapshot['path'])
+        after = [row[1] for row in board.page(0)]
+        exp = board._users["2"][2]
+        await db.close()
+        return before, after, exp
+
+    before, after, exp = asyncio.run(run())
+    assert before == ["2", "1"]
+    assert after == ["1", "2"]
+    assert exp == 100
+
+def test_stop_waits_for_running_copy(tmp_path, monkeypatch):
+    import threading
+    from core import backup
+
+    copying = threading.Event()
+    finished = []
+    real_copy = backup._copy_database
+
+    def slow_copy(*args, **kwargs):
+        copying.set()
+        time.sleep(0.2)
+        result = real_copy(*args, **kwargs)
+        finished.append(True)
+        return result
+
+    monkeypatch.setattr(backup, "_copy_database", slow_copy)
+
+    async def run():
+        db = Database(str(tmp_path / "t.db"))
+        await db.initialize()
+        service = BackupService(db, dest_dir=str(tmp_path / "backups"))
+        service._task = asyncio.create_task(service.run_once())
+        while not copying.is_set(): await asyncio.sleep(0.01)
+        await service.stop()
+        done = list(finished)
+        await db.close()
+        return done, os.listdir(tmp_path / "backups")
+
+    done, files = asyncio.run(run())
+    assert done == [True]
+    assert not any(f.endswith(".tmp") for f in files)
@@ -0,0 +1,49 @@
+import asyncio
+import time
+from core.live_views import LiveView, LiveViewScheduler
+
+def test_dropped_edit_is_retried():
+    async def run():
+        scheduler = LiveViewScheduler()
+        calls = []
+
+        async def render(now):
+            return {"content": "same"}
+
+        async def edit(**kwargs):
+            calls.append(kwargs)
+            return None if len(calls) == 1 else kwargs  # Lần đầu bị broker bỏ
+
+        view = scheduler.register(LiveView("k", render, edit, time.time() + 0.5, interval=0.05))
+        await asyncio.wait_for(view.wait(), 2)
+        await scheduler.stop()
+        return calls, scheduler.stats()
+
+    calls, stats = asyncio.run(run())
+    assert calls == [{"content": "same"}, {"content": "same"}]
+    assert stats["edits"] == 1
+    assert stats["skipped"] >= 1
+
+def test_idle_scheduler_parks_until_register():
+    async def run():
+        scheduler = LiveViewScheduler()
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        parked = not scheduler._wakeup.is_set()
+        edits = []
+
+        async def render(now):
+            return {"content": str(len(edits))}
+
+        async def edit(**kwargs):
+            edits.append(kwargs)
+            return kwargs
+
+        view = scheduler.register(LiveView("k", render, edit, time.time() + 0.2, interval=0.05))
+        await asyncio.wait_for(view.wait(), 2)
+        await scheduler.stop()
+        return parked, edits
+
+    parked, edits = asyncio.run(run())
+    assert parked
+    assert len(edits) >= 2
@@ -0,0 +1,20 @@
+import asyncio
+from core.mission_pool import MissionPool
+from core.storage import MemoryStorage
+
+def test_empty_pool_hands_out_winnable_missions():
+    async def run():
+        db = MemoryStorage()
+        await db.initialize()
+        pool = MissionPool(db)
+        missions = await pool.take("1", 10)
+        await db.close()
+        return missions, pool.fallbacks
+
+    missions, fallbacks = asyncio.run(run())
+    assert fallbacks == 10
+    assert [m['id'] for m in missions] == list(range(1, 11))
+    assert all(1 <= m['difficulty'] <= 5 for m in missions)
+    assert all(m['success_rate'] >= 40 for m in missions)
+    assert all(m['time'] <= 300 for m in missions)
+    assert [m['difficulty'] for m in missions] == sorted(m['difficulty'] for m in missions)
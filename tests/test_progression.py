@@ -0,0 +1,21 @@
+import asyncio
+import pytest
+from core.database import Database
+from core.storage import MemoryStorage
+from core.progression import level_up, level_up_result
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_concurrent_rewards_level_up_once(tmp_path, backend):
+    async def run():
+        db = MemoryStorage() if backend == "memory" else Database(str(tmp_path / "t.db"))
+        await db.initialize()
+        await db.create_user("1", "a")
+        await db.update_user("1", layer=1, exp=1900, goal=2000)
+        results = await asyncio.gather(*(db.apply_delta("1", reason="test", level_up=True, exp=100) for _ in range(2)))
+        user = await db.get_user("1")
+        await db.close()
+        return results, user
+
+    results, user = asyncio.run(run())
+    assert (user['layer'], user['exp'], user['goal']) == level_up(1, 2100, 2000)
+    assert sum(level_up_result(r)[0] for r in results) == 1
@@ -0,0 +1,95 @@
+import asyncio
+from core.rest_broker import RestBroker, PRIORITY_RESULT, PRIORITY_PROGRESS
+
+class _Channel:
+    id = 1
+
+class _Message:
+    id = 10
+    channel = _Channel()
+
+    def __init__(self):
+        self.edits = []
+
+    async def edit(self, **kwargs):
+        self.edits.append(kwargs)
+        return kwargs
+
+def test_progress_after_result_does_not_overwrite_it():
+    async def run():
+        broker = RestBroker()
+        msg = _Message()
+        # Giữ edit trong hàng đợi tới khi cả hai đã được gửi vào broker
+        result = broker.edit(msg, PRIORITY_RESULT, embed="result")
+        progress = broker.edit(msg, PRIORITY_PROGRESS, embed="progress")
+        sent = await result
+        dropped = await asyncio.wait_for(progress, 2)
+        await broker.stop()
+        return msg.edits, sent, dropped, broker.counters
+
+    edits, sent, dropped, counters = asyncio.run(run())
+    assert edits == [{"embed": "result"}]
+    assert sent == {"embed": "result"}
+    assert dropped is None
+    assert counters["dropped"] == 1
+
+def test_result_supersedes_queued_progress():
+    async def run():
+        broker = RestBroker()
+        msg = _Message()
+        progress = broker.edit(msg, PRIORITY_PROGRESS, embed="progress", content="x")
+        result = broker.edit(msg, PRIORITY_RESULT, embed="result")
+        await asyncio.gather(progress, result)
+        await broker.stop()
+        return msg.edits, broker._backlog
+
+    edits, backlog = asyncio.run(run())
+    assert edits == [{"embed": "result", "content": "x"}]
+    assert not backlog
+
+class _SlowMessage(_Message):
+    """Edit đầu tiên bị treo tới khi test thả `release`"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def edit(self, **kwargs):
+        if not self.edits and not self.release.is_set():
+            await self.release.wait()
+        return await super().edit(**kwargs)
+
+def test_result_waits_for_progress_already_in_flight():
+    async def run():
+        broker = RestBroker()
+        msg = _SlowMessage()
+        progress = broker.edit(msg, PRIORITY_PROGRESS, embed="progress")
+        await asyncio.sleep(0.05)  # Edit tiến độ đã rời hàng đợi và đang gửi
+        result = broker.edit(msg, PRIORITY_RESULT, embed="result")
+        late = broker.edit(msg, PRIORITY_PROGRESS, embed="late progress")
+        await asyncio.sleep(0.05)
+        msg.release.set()
+        await asyncio.wait_for(asyncio.gather(progress, result, late), 2)
+        await broker.stop()
+        return msg.edits, await late
+
+    edits, late = asyncio.run(run())
+    assert edits == [{"embed": "progress"}, {"embed": "result"}]
+    assert late is None
+
+def test_progress_dropped_while_result_in_flight():
+    async def run():
+        broker = RestBroker()
+        msg = _SlowMessage()
+        result = broker.edit(msg, PRIORITY_RESULT, embed="result")
+        await asyncio.sleep(0.05)
+        progress = broker.edit(msg, PRIORITY_PROGRESS, embed="progress")
+        dropped = await asyncio.wait_for(progress, 2)
+        msg.release.set()
+        await asyncio.wait_for(result, 2)
+        await broker.stop()
+        return msg.edits, dropped
+
+    edits, dropped = asyncio.run(run())
+    assert edits == [{"embed": "result"}]
+    assert dropped is None
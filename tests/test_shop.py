@@ -0,0 +1,23 @@
+import asyncio
+import pytest
+from core.database import Database
+from core.storage import MemoryStorage
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_concurrent_buys_never_overdraw(tmp_path, backend):
+    async def run():
+        db = MemoryStorage() if backend == "memory" else Database(str(tmp_path / "t.db"))
+        await db.initialize()
+        await db.create_user("1", "a")
+        await db.update_user("1", spirit_stones=150)
+        results = await asyncio.gather(*(db.buy_item("1", "pill", 100) for _ in range(3)))
+        user = await db.get_user("1")
+        summary = await db.ledger_summary("1")
+        await db.close()
+        return results, user, summary
+
+    results, user, summary = asyncio.run(run())
+    assert sorted(results, key=lambda r: r is None) == [50, None, None]
+    assert user['spirit_stones'] == 50
+    assert [(it['id'], it['count']) for it in user['inventory']] == [("pill", 1)]
+    assert summary['buy']['spirit_stones'] == -100